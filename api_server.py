@@ -1,21 +1,39 @@
 """FastAPI server for the BlueSearch RAG application."""
 
 import asyncio
-from typing import Optional, List
-from fastapi import FastAPI, HTTPException
+import json
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, List
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 from loguru import logger
 
-from simple_rag.config import get_cfg
-from simple_rag.rag import SimpleRAG
+from simple_rag.admission import Overloaded, QueryCancelled
+from simple_rag.engine import Engine
+from simple_rag.metrics import REGISTRY
 from simple_rag.utils import bsky_uri_to_web
 
+# One engine per process: clients are built and warmed at startup, then shared by requests
+engine = Engine()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(engine.start)
+    yield
+    # waits for running pipelines, then closes the engine's clients and connections
+    await asyncio.to_thread(engine.stop)
+
+
 app = FastAPI(
     title="LeftLeak API",
     description="API for retrieving leftist perspectives from Bluesky",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Configure CORS
@@ -30,12 +48,19 @@ app.add_middleware(
 # Request/Response models
 class QueryRequest(BaseModel):
     question: str
+    # include per-stage timings (ms) in the response
+    timings: bool = False
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[str]
     context_used: int
     followUpQuestions: List[str]
+    cached: bool = False
+    coalesced: bool = False
+    context_tokens: Optional[int] = None
+    context_tokens_saved: Optional[int] = None
+    timings: Optional[Dict[str, float]] = None
 
 DEFAULT_PERSONA = (
     "You are aggregating and summarizing real leftist opinions from Bluesky. Present what actual leftists are saying about topics. "
@@ -91,74 +116,217 @@ async def root():
     """Health check endpoint."""
     return {"status": "active", "message": "LeftLeak API is running"}
 
+def _overloaded(e: Overloaded) -> JSONResponse:
+    return JSONResponse(status_code=e.status, content={"detail": e.detail}, headers={"Retry-After": str(e.retry_after)})
+
+
+async def _watch_disconnect(http_request: Request, cancel: threading.Event) -> None:
+    """Flag the pipeline for cancellation as soon as the client goes away."""
+    while not cancel.is_set():
+        if await http_request.is_disconnected():
+            cancel.set()
+            return
+        await asyncio.sleep(0.5)
+
+
 @app.post("/api/query", response_model=QueryResponse)
-async def query(request: QueryRequest):
+async def query(request: QueryRequest, http_request: Request):
     """
     Query the RAG system for leftist perspectives on a topic.
+
+    The pipeline runs on the engine's bounded query executor; under overload the
+    request is refused with 429 (queue full) or 503 (no slot in time).
     """
     if not request.question or not request.question.strip():
         raise HTTPException(status_code=400, detail="Question cannot be empty")
-    
+    if not engine.ready:
+        raise HTTPException(status_code=503, detail=engine.error or "Engine is starting")
+    admission = engine.admission
+    cancel = threading.Event()
+    watcher = asyncio.create_task(_watch_disconnect(http_request, cancel))
     try:
-        cfg = get_cfg()
-        rag = SimpleRAG(cfg)
-        
-        # Quick attempt: fast hybrid retrieval first
-        logger.info(f"Processing query: {request.question}")
-        
-        try:
-            quick = rag.ask(request.question, fresh=True, persona=DEFAULT_PERSONA)
-        except Exception as e:
-            logger.warning(f"Quick retrieval failed: {e}")
-            quick = {"answer": None, "context_used": 0, "sources": []}
-        
-        # If quick retrieval got good results, use them
-        if quick.get("context_used", 0) >= 3 and quick.get("answer"):
-            result = quick
-        else:
-            # Fall back to Jetstream streaming
-            logger.info("Using Jetstream for better results...")
+        async with admission.slot():
+            rag = engine.get()
+
+            # Quick attempt: fast hybrid retrieval first
+            logger.info(f"Processing query: {request.question}")
+
             try:
-                result = await asyncio.to_thread(
-                    rag.ask_jetstream,
-                    request.question,
-                    keywords=None,
-                    max_posts=300,
-                    minutes=2,
-                    persona=DEFAULT_PERSONA
-                )
+                quick = await admission.run(rag.ask, request.question, fresh=True, persona=DEFAULT_PERSONA, cancel=cancel)
+            except QueryCancelled:
+                raise
             except Exception as e:
-                logger.error(f"Jetstream query failed: {e}")
-                raise HTTPException(status_code=500, detail=str(e))
-        
+                logger.warning(f"Quick retrieval failed: {e}")
+                quick = {"answer": None, "context_used": 0, "sources": []}
+
+            # If quick retrieval got good results, use them
+            if quick.get("context_used", 0) >= 3 and quick.get("answer"):
+                result = quick
+            elif not rag.cfg.ingest.request_fallback:
+                # The ingest daemon keeps the index fresh; streaming here would only add latency
+                if not quick.get("answer"):
+                    raise HTTPException(status_code=502, detail="Retrieval failed")
+                result = quick
+            else:
+                # Fall back to Jetstream streaming
+                logger.info("Using Jetstream for better results...")
+                try:
+                    result = await admission.run(
+                        rag.ask_jetstream,
+                        request.question,
+                        keywords=None,
+                        max_posts=300,
+                        minutes=2,
+                        persona=DEFAULT_PERSONA,
+                        cancel=cancel,
+                    )
+                except QueryCancelled:
+                    raise
+                except Exception as e:
+                    logger.error(f"Jetstream query failed: {e}")
+                    raise HTTPException(status_code=500, detail=str(e))
+
         # Convert sources to web URLs
         sources = result.get("sources", [])
         web_sources = [bsky_uri_to_web(uri) for uri in sources]
-        
+
         # Generate follow-up questions
         follow_up_questions = get_follow_up_questions(
             request.question,
             result.get("answer", "")
         )
-        
+
         return QueryResponse(
             answer=result.get("answer", "No answer found"),
             sources=web_sources,
             context_used=result.get("context_used", 0),
-            followUpQuestions=follow_up_questions
+            followUpQuestions=follow_up_questions,
+            cached=result.get("cached", False),
+            coalesced=result.get("coalesced", False),
+            context_tokens=result.get("context_tokens"),
+            context_tokens_saved=result.get("context_tokens_saved"),
+            timings=result.get("timings") if request.timings else None,
         )
-        
+
+    except Overloaded as e:
+        logger.warning(f"Query refused ({e.status}): {e.detail}")
+        return _overloaded(e)
+    except QueryCancelled:
+        admission.cancelled += 1
+        logger.info(f"Query cancelled, client disconnected: {request.question}")
+        # nobody is listening; 499 is what the access log will show
+        return JSONResponse(status_code=499, content={"detail": "Client closed request"})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Query error: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        watcher.cancel()
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/api/query/stream")
+async def query_stream(request: QueryRequest):
+    """
+    Server-Sent Events variant of /api/query.
+
+    Emits ``stage`` events as the pipeline progresses, ``sources`` as soon as
+    retrieval finishes, answer ``token`` events while the model generates, and
+    a final ``done`` event carrying the same fields as QueryResponse. When the
+    store has too little context and the Jetstream fallback runs, an ``answer``
+    event carries its whole answer, replacing the tokens streamed so far.
+    Shares the admission limits of /api/query; a client disconnect stops the
+    pipeline.
+    """
+    if not request.question or not request.question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+    if not engine.ready:
+        raise HTTPException(status_code=503, detail=engine.error or "Engine is starting")
+    admission = engine.admission
+    try:
+        # refuse before the 200 and the event stream start
+        admission.check()
+    except Overloaded as e:
+        return _overloaded(e)
+    rag = engine.get()
+    question = request.question
+    logger.info(f"Processing streaming query: {question}")
+
+    async def events():
+        cancel = threading.Event()
+        yield _sse("stage", {"stage": "accepted"})
+        try:
+            async with admission.slot():
+                done = {}
+                it = rag.ask_stream(question, fresh=True, persona=DEFAULT_PERSONA, cancel=cancel)
+                while True:
+                    ev = await admission.run(next, it, None)
+                    if ev is None:
+                        break
+                    name = ev.pop("event")
+                    if name == "done":
+                        done = ev
+                        continue
+                    if name == "sources":
+                        ev["sources"] = [bsky_uri_to_web(uri) for uri in ev["sources"]]
+                    yield _sse(name, ev)
+                if done.get("context_used", 0) < 3 and rag.cfg.ingest.request_fallback:
+                    yield _sse("stage", {"stage": "jetstream"})
+                    done = await admission.run(
+                        rag.ask_jetstream, question, keywords=None, max_posts=300, minutes=2, persona=DEFAULT_PERSONA, cancel=cancel
+                    )
+                    yield _sse("sources", {"sources": [bsky_uri_to_web(uri) for uri in done.get("sources", [])]})
+                    # replaces, rather than extends, the answer tokens already streamed
+                    yield _sse("answer", {"text": done.get("answer", "")})
+            yield _sse("done", {
+                "answer": done.get("answer", "No answer found"),
+                "sources": [bsky_uri_to_web(uri) for uri in done.get("sources", [])],
+                "context_used": done.get("context_used", 0),
+                "followUpQuestions": get_follow_up_questions(question, done.get("answer", "")),
+                "cached": done.get("cached", False),
+                "context_tokens": done.get("context_tokens"),
+                "context_tokens_saved": done.get("context_tokens_saved"),
+                "timings": done.get("timings") if request.timings else None,
+            })
+        except Overloaded as e:
+            yield _sse("error", {"detail": e.detail, "status": e.status, "retry_after": e.retry_after})
+        except asyncio.CancelledError:
+            # Starlette cancels the response task when the client disconnects
+            admission.cancelled += 1
+            logger.info(f"Streaming query cancelled, client disconnected: {question}")
+            raise
+        except Exception as e:
+            logger.error(f"Streaming query error: {e}")
+            yield _sse("error", {"detail": f"Internal server error: {str(e)}"})
+        finally:
+            cancel.set()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: stage latency histograms, embedding and Jetstream counters, cache and query stats."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/api/status")
 async def status():
     """Get system status and configuration."""
     try:
-        cfg = get_cfg()
+        # health touches SQLite and the store; keep it off the event loop
+        health = await asyncio.to_thread(engine.health)
+        if not health["ready"]:
+            return {"status": "starting" if not engine.error else "error", "health": health}
+        cfg = engine.cfg
         return {
             "status": "operational",
+            "health": health,
             "config": {
                 "text_model": cfg.gemini.text_model,
                 "embedding_model": cfg.gemini.embedding_model,
@@ -166,6 +334,7 @@ async def status():
                 "collection": cfg.chroma.collection,
                 "chunk_size": cfg.rag.chunk_size,
                 "max_results": cfg.rag.max_results,
+                "answer_cache_ttl": cfg.cache.answer_ttl,
             }
         }
     except Exception as e:
@@ -19,9 +19,10 @@ def cmd_query(args: argparse.Namespace):
     cfg = get_cfg()
     rag = SimpleRAG(cfg)
     console.print("[cyan]Fetching and retrieving relevant Bluesky posts...[/cyan]")
-    res = rag.ask(args.question, fresh=not args.no_fresh)
+    res = rag.ask(args.question, fresh=not args.no_fresh, use_cache=not args.no_cache)
     if "answer" in res:
-        console.print(Panel(res["answer"], title="Answer", border_style="green"))
+        title = "Answer (cached)" if res.get("cached") else "Answer"
+        console.print(Panel(res["answer"], title=title, border_style="green"))
         if res.get("sources"):
             console.print("\n[cyan]Sources:[/cyan]")
             for i, s in enumerate(res["sources"], 1):
@@ -44,8 +45,86 @@ def cmd_status(args: argparse.Namespace):
 def cmd_reset(args: argparse.Namespace):
     cfg = get_cfg()
     rag = SimpleRAG(cfg)
-    rag.db.clear()
-    console.print("[yellow]Vector store cleared.[/yellow]")
+    rag.clear()
+    console.print("[yellow]Vector store and dedupe index cleared.[/yellow]")
+
+
+def cmd_compact(args: argparse.Namespace):
+    cfg = get_cfg()
+    if cfg.chroma.partition.lower() not in ("day", "hour"):
+        console.print("[yellow]STORE_PARTITION is not set; nothing to compact.[/yellow]")
+        return
+    rag = SimpleRAG(cfg)
+    dropped = rag.compact()
+    for name in dropped:
+        console.print(f"[yellow]Dropped {name}[/yellow]")
+    console.print(f"[green]Compacted: {len(dropped)} partitions dropped, {rag.db.count()} chunks kept[/green]")
+
+
+def cmd_bench(args: argparse.Namespace):
+    import asyncio
+    import json
+    from simple_rag.bench import BenchOptions, compare, record_capture, run_bench
+    if args.record:
+        if not args.capture:
+            console.print("[red]--record needs --capture PATH to write to[/red]")
+            return
+        from simple_rag.config import IngestCfg
+        from simple_rag.ingest import JetstreamEndpoints, subscribe_url
+        # captures hold plain JSON frames, so never ask for compression here
+        cfg = IngestCfg()
+        n = asyncio.run(record_capture(subscribe_url(JetstreamEndpoints(cfg).bases[0], cfg), args.capture, args.record))
+        console.print(f"[green]Recorded {n} Jetstream frames to {args.capture}[/green]")
+        return
+    opts = BenchOptions(
+        iterations=args.iterations,
+        posts=args.posts,
+        xrpc_latency=args.latency_ms / 1000,
+        embed_latency=args.embed_latency_ms / 1000,
+        gen_latency=args.gen_latency_ms / 1000,
+        replay_rate=args.replay_rate,
+        stream_runs=args.stream_runs,
+        capture=args.capture or "",
+        backend=args.backend or "",
+        only=args.only or "",
+        keep_dir=args.keep,
+    )
+    report = run_bench(opts)
+    table = Table(title=f"bsrag bench ({report['meta']['backend']}, capture: {report['meta']['capture']})")
+    for col in ("benchmark", "n", "throughput", "p50 ms", "p95 ms", "p99 ms"):
+        table.add_column(col, justify="left" if col == "benchmark" else "right")
+    for name, r in report["results"].items():
+        if name.startswith("_") or not r.get("n"):
+            continue
+        table.add_row(name, str(r["n"]), f"{r['throughput']} {r['unit']}/s", f"{r['p50_ms']:.1f}", f"{r['p95_ms']:.1f}", f"{r['p99_ms']:.1f}")
+    console.print(table)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        console.print(f"[green]Results written to {args.out}[/green]")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        diff = Table(title=f"Change vs {args.compare}")
+        for col in ("benchmark", "throughput", "p50", "p95", "p99"):
+            diff.add_column(col, justify="left" if col == "benchmark" else "right")
+        for name, d in compare(baseline, report).items():
+            diff.add_row(name, *("n/a" if d[k] is None else f"{d[k]:+.1%}" for k in ("throughput", "p50_ms", "p95_ms", "p99_ms")))
+        console.print(diff)
+
+
+def cmd_ingest_daemon(args: argparse.Namespace):
+    import asyncio
+    from simple_rag.ingest import IngestDaemon
+    cfg = get_cfg()
+    rag = SimpleRAG(cfg)
+    daemon = IngestDaemon(rag, keywords=args.keywords)
+    console.print(f"[cyan]Streaming Jetstream into {cfg.chroma.db_path} (cursor: {daemon.cursor_us or 'live'})[/cyan]")
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        pass
+    console.print(f"[green]Stopped: {daemon.posts} posts → {daemon.chunks} chunks, {daemon.deleted} deletes, cursor {daemon.cursor_us}[/green]")
 
 
 def main():
@@ -55,21 +134,42 @@ def main():
     p_q = sub.add_parser("query", help="Ask a question")
     p_q.add_argument("question")
     p_q.add_argument("--no-fresh", action="store_true", help="Do not fetch fresh posts before answering")
+    p_q.add_argument("--no-cache", action="store_true", help="Do not reuse a cached answer")
 
     sub.add_parser("status", help="Show configuration")
     sub.add_parser("reset", help="Clear vector store")
+    sub.add_parser("compact", help="Drop (or archive) store partitions older than STORE_RETENTION_DAYS")
 
     p_ing = sub.add_parser("ingest-jetstream", help="Ingest live posts from Bluesky Jetstream")
     p_ing.add_argument("--keywords", type=str, help="Filter to posts containing these keywords (space-separated)")
     p_ing.add_argument("--max", type=int, default=200, help="Max posts to collect")
     p_ing.add_argument("--minutes", type=int, default=2, help="Max minutes to run")
 
+    p_d = sub.add_parser("ingest-daemon", help="Continuously ingest Jetstream posts, resuming from the saved cursor")
+    p_d.add_argument("--keywords", type=str, help="Only keep posts containing these keywords (space-separated)")
+
     p_lq = sub.add_parser("jetstream-query", help="One-shot: stream with keywords then answer the question")
     p_lq.add_argument("question")
     p_lq.add_argument("--keywords", type=str, help="Override keywords to stream (default: extracted from question)")
     p_lq.add_argument("--max", type=int, default=200, help="Max posts to collect via Jetstream")
     p_lq.add_argument("--minutes", type=int, default=2, help="How long to stream")
 
+    p_b = sub.add_parser("bench", help="Benchmark the pipeline offline against local Bluesky, Jetstream and Gemini stand-ins")
+    p_b.add_argument("--iterations", type=int, default=50, help="Queries per search/query/ask benchmark")
+    p_b.add_argument("--posts", type=int, default=2000, help="Synthetic posts in the corpus and per ingest/store run")
+    p_b.add_argument("--latency-ms", type=float, default=20, help="Per-request latency of the fake XRPC server")
+    p_b.add_argument("--embed-latency-ms", type=float, default=50, help="Per-request latency of the fake embedder")
+    p_b.add_argument("--gen-latency-ms", type=float, default=300, help="Per-answer latency of the fake generator")
+    p_b.add_argument("--replay-rate", type=float, default=0, help="Jetstream replay rate in frames/s (0 = unthrottled)")
+    p_b.add_argument("--stream-runs", type=int, default=3, help="Replays for the stream_posts benchmark")
+    p_b.add_argument("--capture", type=str, help="Recorded Jetstream capture (JSONL, optionally .gz) to replay")
+    p_b.add_argument("--record", type=int, default=0, help="Record this many live Jetstream frames to --capture and exit")
+    p_b.add_argument("--backend", type=str, help="Store backend to benchmark (default: STORE_BACKEND)")
+    p_b.add_argument("--only", type=str, help="Comma-separated subset: hybrid_search,stream_posts,ingest_posts,store,ask")
+    p_b.add_argument("--out", type=str, help="Write results as JSON to this path")
+    p_b.add_argument("--compare", type=str, help="Earlier JSON results to diff against")
+    p_b.add_argument("--keep", action="store_true", help="Keep the temporary store and caches")
+
     args = parser.parse_args()
     if not args.cmd:
         parser.print_help()
@@ -81,6 +181,8 @@ def main():
         cmd_status(args)
     elif args.cmd == "reset":
         cmd_reset(args)
+    elif args.cmd == "compact":
+        cmd_compact(args)
     elif args.cmd == "ingest-jetstream":
         from simple_rag.ingest import stream_posts
         cfg = get_cfg()
@@ -89,6 +191,10 @@ def main():
         posts = asyncio.get_event_loop().run_until_complete(stream_posts(cfg, args.keywords, args.max, args.minutes))
         added = rag.ingest_posts(posts)
         console.print(f"[green]Jetstream ingested {added} chunks from {len(posts)} posts[/green]")
+    elif args.cmd == "ingest-daemon":
+        cmd_ingest_daemon(args)
+    elif args.cmd == "bench":
+        cmd_bench(args)
     elif args.cmd == "jetstream-query":
         cfg = get_cfg()
         rag = SimpleRAG(cfg)
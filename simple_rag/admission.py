@@ -0,0 +1,154 @@
+"""Admission control for query pipelines served by the API."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+
+class Overloaded(Exception):
+    """Raised when a query is refused; carries the HTTP status and a Retry-After hint."""
+
+    def __init__(self, status: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class QueryCancelled(Exception):
+    """Raised inside the pipeline once the requesting client has gone away."""
+
+
+class _Held:
+    """Executor work started under one slot; the slot is only released once all of it has finished."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pending = 0
+        self._release: Optional[Callable[[], None]] = None
+
+    def track(self, fut: Future) -> None:
+        with self._lock:
+            self.pending += 1
+        fut.add_done_callback(self._done)
+
+    def _done(self, _fut: Future) -> None:
+        with self._lock:
+            self.pending -= 1
+            release = self._release if self.pending == 0 else None
+        if release is not None:
+            release()
+
+    def close(self, release: Callable[[], None]) -> bool:
+        """True when nothing is running; otherwise ``release`` is called (from a worker thread) once it all finishes."""
+        with self._lock:
+            if self.pending:
+                self._release = release
+                return False
+        return True
+
+
+# the slot held by the current request, so ``run`` can tie its executor work to it
+_held: ContextVar[Optional[_Held]] = ContextVar("admission_held", default=None)
+
+
+class AdmissionController:
+    """Bounds concurrent query pipelines and sheds load before it queues up.
+
+    At most ``max_concurrency`` pipelines hold a slot, and their blocking work
+    runs on a dedicated executor of that size so the event loop stays free. Up
+    to ``max_queue`` more requests wait for a slot; beyond that a request is
+    refused at once with 429, and one that waits longer than ``queue_timeout``
+    gets 503. Retry-After follows the recent average pipeline duration.
+
+    A slot whose request goes away (a cancelled stream) stays taken until the
+    executor work it started has returned, so abandoned pipelines still count
+    against the bound instead of queueing unseen inside the executor.
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_queue: int = 16, queue_timeout: float = 10.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="query")
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.avg_sec = 5.0
+
+    def _retry_after(self) -> int:
+        backlog = (self.waiting + self.running) / self.max_concurrency
+        return max(1, int(self.avg_sec * backlog + 0.5))
+
+    def check(self) -> None:
+        """Refuse immediately when the wait queue is already full."""
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(429, "Too many queries in flight, try again shortly", self._retry_after())
+
+    @asynccontextmanager
+    async def slot(self):
+        self.check()
+        if not self._sem.locked():
+            # a free slot is taken without suspending, so it never counts as queued
+            await self._sem.acquire()
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._sem.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise Overloaded(503, "Server busy, try again shortly", self._retry_after())
+            finally:
+                self.waiting -= 1
+        self.running += 1
+        self.admitted += 1
+        started = time.monotonic()
+        held = _Held()
+        token = _held.set(held)
+        try:
+            yield
+        finally:
+            _held.reset(token)
+            loop = asyncio.get_running_loop()
+            if held.close(lambda: loop.call_soon_threadsafe(self._release, started)):
+                self._release(started)
+
+    def _release(self, started: float) -> None:
+        self.running -= 1
+        self._sem.release()
+        self.avg_sec = 0.8 * self.avg_sec + 0.2 * (time.monotonic() - started)
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run blocking ``fn`` on the query executor, keeping the caller's slot until it returns."""
+        fut = self.pool.submit(partial(fn, *args, **kwargs))
+        held = _held.get()
+        if held is not None:
+            held.track(fut)
+        return await asyncio.wrap_future(fut)
+
+    def stop(self, wait: bool = False) -> None:
+        """Cancel queued work; with ``wait``, block until running pipelines return."""
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "cancelled": self.cancelled,
+            "avg_sec": round(self.avg_sec, 2),
+        }
@@ -0,0 +1,660 @@
+"""Offline benchmarks for simple RAG.
+
+Everything runs against local stand-ins so results depend on the code, not
+on the network or API quotas:
+
+- ``FakeXRPC``: a threaded HTTP server answering the XRPC calls ``BSky``
+  makes (session, profiles, timeline, feed, search) from a synthetic corpus.
+- ``JetstreamReplay``: a websocket server replaying a Jetstream capture (one
+  JSON frame per line, recorded with ``record_capture`` or synthesised) at a
+  configurable rate.
+- ``FakeGemini``: deterministic feature-hashed embeddings and canned answers
+  with configurable latency.
+
+``run_bench`` times each stage and returns throughput and p50/p95/p99 per
+benchmark as a JSON-serialisable dict; ``compare`` diffs two such results.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from loguru import logger
+
+from .config import AppCfg, BlueskyCfg, CacheCfg, ChromaCfg, GeminiCfg, IngestCfg, RAGCfg, ServerCfg
+from .embeddings import Gemini
+from .utils import ChunkBatch, KeywordMatcher, PostBatch, clean_text, extract_keywords, iso_to_epoch
+
+
+BENCHMARKS = ("hybrid_search", "stream_posts", "ingest_posts", "store", "ask")
+
+TOPICS = {
+    "climate": "climate carbon emissions warming heatwave drought wildfire solar wind grid policy",
+    "python": "python asyncio typing pandas numpy packaging wheels interpreter release library",
+    "election": "election ballot polls turnout candidate debate campaign senate district vote",
+    "space": "rocket launch orbit satellite telescope mars lunar booster payload mission",
+    "music": "album tour vinyl concert setlist guitar festival single chorus producer",
+}
+FILLER = "the a and of to in is that it for on with as this was but are have just really think".split()
+WORD_RE = re.compile(r"\w+")
+
+
+def _b32(data: bytes) -> str:
+    return base64.b32encode(data).decode().lower().rstrip("=")
+
+
+def _iso(dt: datetime) -> str:
+    return dt.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def synth_posts(n: int, seed: int = 0, repost_ratio: float = 0.08) -> List[Dict[str, Any]]:
+    """Deterministic synthetic posts spread over the last three days, newest first."""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    authors = [
+        {"did": "did:plc:" + _b32(hashlib.blake2b(f"author{i}".encode(), digest_size=15).digest())[:24], "handle": f"user{i}.bench.test", "displayName": f"User {i}"}
+        for i in range(max(1, n // 8))
+    ]
+    posts: List[Dict[str, Any]] = []
+    for i in range(n):
+        if posts and rng.random() < repost_ratio:
+            text = rng.choice(posts)["text"]
+        else:
+            topic = rng.choice(list(TOPICS))
+            vocab = TOPICS[topic].split()
+            words = [rng.choice(vocab) if rng.random() < 0.45 else rng.choice(FILLER) for _ in range(rng.choice([12, 24, 40, 90]))]
+            words.insert(rng.randrange(len(words)), topic)
+            if rng.random() < 0.3:
+                words.append(f"#{topic}")
+            text = " ".join(words).capitalize() + "."
+        author = rng.choice(authors)
+        rkey = _b32(hashlib.blake2b(f"{seed}:{i}".encode(), digest_size=8).digest())[:13]
+        posts.append({
+            **author,
+            "rkey": rkey,
+            "cid": "bafyrei" + _b32(hashlib.blake2b(f"{seed}:{i}:{text}".encode(), digest_size=32).digest()),
+            "text": text,
+            "createdAt": _iso(now - timedelta(seconds=rng.uniform(0, 3 * 86400))),
+            "likeCount": int(rng.paretovariate(1.2)) - 1,
+        })
+    posts.sort(key=lambda p: p["createdAt"], reverse=True)
+    return posts
+
+
+def to_posts(posts: List[Dict[str, Any]]) -> PostBatch:
+    batch = PostBatch()
+    for p in posts:
+        batch.append(
+            f"at://{p['did']}/app.bsky.feed.post/{p['rkey']}",
+            p["cid"],
+            p["handle"],
+            p["displayName"],
+            p["text"],
+            iso_to_epoch(p["createdAt"]),
+            like_count=p["likeCount"],
+        )
+    return batch
+
+
+def post_view(p: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "uri": f"at://{p['did']}/app.bsky.feed.post/{p['rkey']}",
+        "cid": p["cid"],
+        "author": {"did": p["did"], "handle": p["handle"], "displayName": p["displayName"]},
+        "record": {"$type": "app.bsky.feed.post", "text": p["text"], "createdAt": p["createdAt"], "langs": ["en"]},
+        "replyCount": 0,
+        "repostCount": 0,
+        "likeCount": p["likeCount"],
+        "indexedAt": p["createdAt"],
+    }
+
+
+def _jwt(sub: str, scope: str, ttl: int = 86400) -> str:
+    def enc(obj: Dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).decode().rstrip("=")
+
+    now = int(time.time())
+    return f"{enc({'typ': 'JWT', 'alg': 'HS256'})}.{enc({'scope': scope, 'sub': sub, 'iat': now, 'exp': now + ttl})}.c2ln"
+
+
+class FakeXRPC:
+    """Threaded HTTP server serving the XRPC endpoints ``BSky`` uses from canned posts."""
+
+    def __init__(self, posts: List[Dict[str, Any]], latency: float = 0.0, handle: str = "bench.bench.test"):
+        self.posts = posts
+        self.popular = sorted(posts, key=lambda p: p["likeCount"], reverse=True)
+        self.latency = latency
+        self.handle = handle
+        self.did = "did:plc:" + _b32(hashlib.blake2b(handle.encode(), digest_size=15).digest())[:24]
+        self.profiles = {p["did"]: {"did": p["did"], "handle": p["handle"], "displayName": p["displayName"]} for p in posts}
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def _session(self) -> Dict[str, Any]:
+        return {
+            "accessJwt": _jwt(self.did, "com.atproto.appPass"),
+            "refreshJwt": _jwt(self.did, "com.atproto.refresh", ttl=7 * 86400),
+            "handle": self.handle,
+            "did": self.did,
+            "active": True,
+        }
+
+    @staticmethod
+    def _page(items: List[Dict[str, Any]], params: Dict[str, str], wrap: bool) -> Dict[str, Any]:
+        limit = min(100, int(params.get("limit", 50)))
+        start = int(params.get("cursor") or 0)
+        page = [post_view(p) for p in items[start : start + limit]]
+        out: Dict[str, Any] = {"feed": [{"post": v} for v in page]} if wrap else {"posts": page}
+        if start + limit < len(items):
+            out["cursor"] = str(start + limit)
+        return out
+
+    def route(self, nsid: str, params: Dict[str, str], multi: Dict[str, List[str]]) -> Optional[Dict[str, Any]]:
+        if nsid in ("com.atproto.server.createSession", "com.atproto.server.refreshSession"):
+            return self._session()
+        if nsid == "com.atproto.server.getSession":
+            return {"handle": self.handle, "did": self.did, "active": True}
+        if nsid == "app.bsky.actor.getProfile":
+            return {"did": self.did, "handle": self.handle, "displayName": "Bench"}
+        if nsid == "app.bsky.actor.getProfiles":
+            return {"profiles": [self.profiles[d] for d in multi.get("actors", []) if d in self.profiles]}
+        if nsid == "app.bsky.feed.getTimeline":
+            return self._page(self.posts, params, wrap=True)
+        if nsid == "app.bsky.feed.getFeed":
+            return self._page(self.popular, params, wrap=True)
+        if nsid == "app.bsky.feed.searchPosts":
+            terms = set(WORD_RE.findall(params.get("q", "").lower()))
+            hits = [p for p in self.posts if terms & set(WORD_RE.findall(p["text"].lower()))]
+            return self._page(hits, params, wrap=False)
+        return None
+
+    def start(self) -> str:
+        xrpc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self):
+                url = urlparse(self.path)
+                nsid = url.path.rsplit("/", 1)[-1]
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                multi = parse_qs(url.query)
+                with xrpc._lock:
+                    xrpc.requests[nsid] = xrpc.requests.get(nsid, 0) + 1
+                if xrpc.latency:
+                    time.sleep(xrpc.latency)
+                body = xrpc.route(nsid, {k: v[-1] for k, v in multi.items()}, multi)
+                status = 200
+                if body is None:
+                    status, body = 501, {"error": "MethodNotImplemented", "message": nsid}
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _serve
+            do_POST = _serve
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-xrpc", daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def synth_capture(posts: List[Dict[str, Any]], seed: int = 0) -> List[bytes]:
+    """Jetstream frames for ``posts`` interleaved with the deletes and identity events a real capture carries."""
+    rng = random.Random(seed)
+    t_us = int(time.time() * 1_000_000) - len(posts) * 2000
+    frames: List[bytes] = []
+    for p in reversed(posts):
+        t_us += rng.randint(500, 3500)
+        frames.append(json.dumps({
+            "did": p["did"],
+            "time_us": t_us,
+            "kind": "commit",
+            "commit": {
+                "rev": _b32(t_us.to_bytes(8, "big"))[:13],
+                "operation": "create",
+                "collection": "app.bsky.feed.post",
+                "rkey": p["rkey"],
+                "record": {"$type": "app.bsky.feed.post", "createdAt": p["createdAt"], "langs": ["en"], "text": p["text"]},
+                "cid": p["cid"],
+            },
+        }, separators=(",", ":")).encode())
+        roll = rng.random()
+        if roll < 0.1:
+            frames.append(json.dumps({
+                "did": p["did"], "time_us": t_us + 1, "kind": "commit",
+                "commit": {"rev": "x", "operation": "delete", "collection": "app.bsky.feed.post", "rkey": p["rkey"][::-1]},
+            }, separators=(",", ":")).encode())
+        elif roll < 0.15:
+            frames.append(json.dumps({
+                "did": p["did"], "time_us": t_us + 1, "kind": "identity",
+                "identity": {"did": p["did"], "handle": p["handle"], "seq": t_us, "time": p["createdAt"]},
+            }, separators=(",", ":")).encode())
+    return frames
+
+
+def load_capture(path: str) -> List[bytes]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return [line.rstrip(b"\r\n") for line in f if line.strip()]
+
+
+async def record_capture(url: str, path: str, frames: int) -> int:
+    """Save ``frames`` raw frames from a live Jetstream endpoint to ``path`` (JSONL, gzipped if it ends in .gz)."""
+    import websockets
+
+    opener = gzip.open if path.endswith(".gz") else open
+    n = 0
+    async with websockets.connect(url, max_queue=1024) as ws:
+        with opener(path, "wb") as f:
+            while n < frames:
+                raw = await ws.recv(decode=False)
+                f.write(raw + b"\n")
+                n += 1
+    return n
+
+
+class JetstreamReplay:
+    """Local websocket server replaying ``frames`` to each connection at ``rate`` frames/s (0 = as fast as possible).
+
+    After the last frame the connection is held open, like a quiet firehose.
+    """
+
+    def __init__(self, frames: List[bytes], rate: float = 0.0, zstd_dict: Optional[bytes] = None):
+        self.frames = [f.decode("utf-8") for f in frames]
+        # sent instead when a client subscribes with compress=true, as Jetstream does
+        self.compressed: Optional[List[bytes]] = None
+        if zstd_dict is not None:
+            import zstandard
+
+            cctx = zstandard.ZstdCompressor(dict_data=zstandard.ZstdCompressionDict(zstd_dict))
+            self.compressed = [cctx.compress(f) for f in frames]
+        self.rate = rate
+        self.replays = 0
+        self.sent = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Future] = None
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.port = 0
+
+    async def _handler(self, ws) -> None:
+        started = time.perf_counter()
+        frames = self.frames
+        if self.compressed is not None and "compress=true" in (ws.request.path or ""):
+            frames = self.compressed
+        try:
+            for i, frame in enumerate(frames):
+                if self.rate > 0:
+                    delay = started + i / self.rate - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await ws.send(frame)
+                self.sent += 1
+            self.replays += 1
+            await ws.wait_closed()
+        except Exception:
+            pass
+
+    async def _serve(self) -> None:
+        from websockets.asyncio.server import serve
+
+        self._stop = asyncio.get_running_loop().create_future()
+        async with serve(self._handler, "127.0.0.1", 0, max_size=None) as server:
+            self.port = next(iter(server.sockets)).getsockname()[1]
+            self._ready.set()
+            await self._stop
+
+    def start(self) -> str:
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._serve())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="jetstream-replay", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return f"ws://127.0.0.1:{self.port}/subscribe?wantedCollections=app.bsky.feed.post"
+
+    def stop(self) -> None:
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(lambda: self._stop.done() or self._stop.set_result(None))
+        if self._thread is not None:
+            self._thread.join(5)
+
+
+def fake_vector(text: str, dim: int = 768) -> List[float]:
+    """Deterministic unit vector from hashed words, so texts sharing words land close together."""
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in WORD_RE.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "big")
+        vec[h % dim] += 1.0 if (h >> 63) else -1.0
+    norm = float(np.linalg.norm(vec))
+    if norm == 0:
+        vec[0], norm = 1.0, 1.0
+    return (vec / norm).tolist()
+
+
+class FakeTextModel:
+    """Stands in for ``GenerativeModel``: a canned answer citing the prompt's handles after ``latency`` seconds."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def _text(self, prompt: str) -> str:
+        handles = list(dict.fromkeys(re.findall(r"@[\w.-]+", prompt)))[:3]
+        return (
+            "Posts in the context discuss the question from several angles. "
+            f"{' and '.join(handles) or 'Several users'} share the most detailed views, "
+            "while others mostly repeat the same points."
+        )
+
+    def generate_content(self, prompt: str, generation_config=None, stream: bool = False):
+        self.calls += 1
+        text = self._text(prompt)
+        if not stream:
+            time.sleep(self.latency)
+            return SimpleNamespace(text=text, candidates=[])
+        return self._stream(text)
+
+    def _stream(self, text: str) -> Iterator[Any]:
+        words = text.split(" ")
+        for i, w in enumerate(words):
+            time.sleep(self.latency / len(words))
+            part = SimpleNamespace(text=w if i == len(words) - 1 else w + " ")
+            yield SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+class FakeGemini(Gemini):
+    """``Gemini`` with the API calls replaced by ``fake_vector`` and ``FakeTextModel``; batching and caching are real."""
+
+    def __init__(self, cfg: GeminiCfg, cache=None, embed_latency: float = 0.0, gen_latency: float = 0.0, dim: int = 768):
+        super().__init__(cfg, cache=cache)
+        self.text_model = FakeTextModel(gen_latency)
+        self.embed_latency = embed_latency
+        self.dim = dim
+        self.embed_calls = 0
+
+    def _embed_request(self, content, task_type: str):
+        self.embed_calls += 1
+        time.sleep(self.embed_latency)
+        if isinstance(content, list):
+            return {"embedding": [fake_vector(t, self.dim) for t in content]}
+        return {"embedding": {"values": fake_vector(content, self.dim)}}
+
+
+@dataclass
+class BenchOptions:
+    iterations: int = 50
+    posts: int = 2000
+    # per-request latency of the fake XRPC server, embedder and generator, in seconds
+    xrpc_latency: float = 0.02
+    embed_latency: float = 0.05
+    gen_latency: float = 0.3
+    replay_rate: float = 0.0
+    stream_runs: int = 3
+    capture: str = ""
+    backend: str = ""
+    only: str = ""
+    seed: int = 0
+    keep_dir: bool = False
+
+
+def summarize(samples: List[float], items: Optional[int] = None, unit: str = "ops") -> Dict[str, Any]:
+    """Latency percentiles (ms) over per-call ``samples`` (s) and throughput in ``unit`` per second."""
+    if not samples:
+        return {"n": 0, "unit": unit}
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    total = float(sum(samples))
+    return {
+        "n": len(samples),
+        "unit": unit,
+        "items": items if items is not None else len(samples),
+        "total_s": round(total, 4),
+        "throughput": round((items if items is not None else len(samples)) / total, 2) if total > 0 else None,
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def _timed(fn: Callable[[], Any]) -> "tuple[float, Any]":
+    t0 = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - t0, out
+
+
+def _questions(rng: random.Random, n: int) -> List[str]:
+    out = []
+    for i in range(n):
+        topic = list(TOPICS)[i % len(TOPICS)]
+        words = rng.sample(TOPICS[topic].split(), 2)
+        out.append(f"What are people saying about {topic} {words[0]} and {words[1]}?")
+    return out
+
+
+def _expected_posts(frames: List[bytes], keywords: str) -> int:
+    """Posts in the capture that ``stream_posts`` will keep for ``keywords``."""
+    from .firehose import post_records
+
+    matcher = KeywordMatcher(extract_keywords(keywords, max_terms=10))
+    n = 0
+    for raw in frames:
+        try:
+            _, records = post_records(json.loads(raw))
+        except Exception:
+            continue
+        n += sum(1 for _, _, rec in records if matcher.matches(clean_text(rec.get("text", ""))))
+    return n
+
+
+def bench_hybrid_search(rag, questions: List[str]) -> Dict[str, Any]:
+    samples, found = [], 0
+    for q in questions:
+        sec, posts = _timed(lambda: rag.bs.hybrid_search(q))
+        samples.append(sec)
+        found += len(posts)
+    return summarize(samples, items=len(samples), unit="queries") | {"posts_per_query": round(found / max(1, len(samples)), 1)}
+
+
+def bench_stream_posts(rag, frames: List[bytes], runs: int, rate: float) -> Dict[str, Any]:
+    from .ingest import stream_posts
+
+    topic_counts = {t: _expected_posts(frames, t) for t in TOPICS}
+    keywords = max(topic_counts, key=topic_counts.get)
+    expected = topic_counts[keywords]
+    samples, collected = [], 0
+    if not expected:
+        logger.warning("capture has no posts matching any benchmark topic; skipping stream_posts")
+        return summarize([], unit="posts")
+    from .firehose import zstd_decompressor
+    from .metrics import JETSTREAM_BYTES
+
+    cfg = rag.cfg
+    zstd_dict = None
+    if cfg.ingest.compress and zstd_decompressor(cfg.ingest.zstd_dict_path) is not None:
+        with open(cfg.ingest.zstd_dict_path, "rb") as f:
+            zstd_dict = f.read()
+    replay = JetstreamReplay(frames, rate=rate, zstd_dict=zstd_dict)
+    wire_before = JETSTREAM_BYTES.value(stage="wire")
+    rag.cfg = replace(cfg, ingest=replace(cfg.ingest, jetstream_url=replay.start()))
+    try:
+        for _ in range(runs):
+            stop = threading.Event()
+            # a capture the filter disagrees with must not hang the run
+            guard = threading.Timer(len(frames) / rate + 30 if rate > 0 else 60, stop.set)
+            guard.start()
+            sec, posts = _timed(lambda: asyncio.run(stream_posts(rag.cfg, keywords, expected, None, bs=rag.bs, stop=stop, dids=rag.dids)))
+            guard.cancel()
+            samples.append(sec)
+            collected += len(posts)
+    finally:
+        rag.cfg = cfg
+        replay.stop()
+    wire = JETSTREAM_BYTES.value(stage="wire") - wire_before
+    return summarize(samples, items=collected, unit="posts") | {
+        "compressed": zstd_dict is not None,
+        "wire_bytes_per_post": round(wire / max(1, collected)),
+        "frames": len(frames),
+        "frames_per_s": round(len(frames) * len(samples) / sum(samples), 1),
+        "keywords": keywords,
+    }
+
+
+def bench_ingest_posts(rag, posts: PostBatch, batch_size: int) -> Dict[str, Any]:
+    samples, chunks = [], 0
+    for i in range(0, len(posts), batch_size):
+        batch = posts.take(range(i, min(i + batch_size, len(posts))))
+        sec, n = _timed(lambda: rag.ingest_posts(batch))
+        samples.append(sec)
+        chunks += n
+    return summarize(samples, items=len(posts), unit="posts") | {"chunks": chunks}
+
+
+def bench_store(cfg: AppCfg, posts: PostBatch, questions: List[str], batch_size: int = 256) -> Dict[str, Dict[str, Any]]:
+    from .store import make_store
+
+    db = make_store(replace(cfg.chroma, collection="bench_store"))
+    chunks = ChunkBatch.from_posts(posts, cfg.rag.chunk_size, cfg.rag.chunk_overlap)
+    vecs = [fake_vector(t) for t in chunks.texts]
+    add_samples = []
+    for i in range(0, len(chunks), batch_size):
+        part = chunks.take(range(i, min(i + batch_size, len(chunks))))
+        sec, _ = _timed(lambda: db.add_chunks(part, vecs[i : i + batch_size]))
+        add_samples.append(sec)
+    qvecs = [fake_vector(q) for q in questions]
+    query_samples = []
+    for qv in qvecs:
+        sec, _ = _timed(lambda: db.query(qv, n=cfg.rag.max_results * cfg.rag.context_overfetch, recent_days=cfg.rag.recent_days))
+        query_samples.append(sec)
+    return {
+        "store_add_chunks": summarize(add_samples, items=len(chunks), unit="chunks"),
+        "store_query": summarize(query_samples, unit="queries") | {"stored": db.count()},
+    }
+
+
+def bench_ask(rag, questions: List[str]) -> Dict[str, Any]:
+    samples, tokens = [], 0
+    for q in questions:
+        sec, res = _timed(lambda: rag.ask(q, fresh=True, use_cache=False))
+        samples.append(sec)
+        tokens += res.get("context_tokens", 0)
+    return summarize(samples, unit="queries") | {"context_tokens": round(tokens / max(1, len(samples)), 1)}
+
+
+def run_bench(opts: BenchOptions) -> Dict[str, Any]:
+    """Run the selected benchmarks against fresh local stand-ins in a temporary directory."""
+    from .rag import SimpleRAG
+
+    selected = [b.strip() for b in opts.only.split(",") if b.strip()] or list(BENCHMARKS)
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+    rng = random.Random(opts.seed)
+    corpus = synth_posts(opts.posts, seed=opts.seed)
+    frames = load_capture(opts.capture) if opts.capture else synth_capture(corpus, seed=opts.seed)
+    workdir = tempfile.mkdtemp(prefix="bsrag-bench-")
+    xrpc = FakeXRPC(corpus, latency=opts.xrpc_latency)
+    base = xrpc.start()
+    chroma = ChromaCfg(db_path=os.path.join(workdir, "db"))
+    if opts.backend:
+        chroma = replace(chroma, backend=opts.backend)
+    cfg = AppCfg(
+        gemini=GeminiCfg(api_key="bench"),
+        bluesky=BlueskyCfg(handle=xrpc.handle, app_password="bench", service=base, public_api=base),
+        chroma=chroma,
+        rag=RAGCfg(),
+        cache=CacheCfg(dir=os.path.join(workdir, "cache")),
+        ingest=replace(IngestCfg(), cursor_path=os.path.join(workdir, "cache", "jetstream.cursor")),
+        server=ServerCfg(),
+    )
+    results: Dict[str, Any] = {}
+    try:
+        rag = SimpleRAG(cfg)
+        rag.gm = FakeGemini(cfg.gemini, cache=rag.embed_cache, embed_latency=opts.embed_latency, gen_latency=opts.gen_latency)
+        questions = _questions(rng, opts.iterations)
+        for name in BENCHMARKS:
+            if name not in selected:
+                continue
+            logger.info(f"bench: {name}")
+            if name == "hybrid_search":
+                results[name] = bench_hybrid_search(rag, questions)
+            elif name == "stream_posts":
+                results[name] = bench_stream_posts(rag, frames, opts.stream_runs, opts.replay_rate)
+            elif name == "ingest_posts":
+                fresh = to_posts(synth_posts(opts.posts, seed=opts.seed + 1))
+                results[name] = bench_ingest_posts(rag, fresh, cfg.ingest.batch_size)
+            elif name == "store":
+                store_posts = to_posts(synth_posts(opts.posts, seed=opts.seed + 2))
+                results.update(bench_store(cfg, store_posts, questions))
+            elif name == "ask":
+                results[name] = bench_ask(rag, questions)
+        results["_requests"] = dict(sorted(xrpc.requests.items()))
+    finally:
+        xrpc.stop()
+        if not opts.keep_dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "meta": {
+            "started_at": _iso(datetime.now(timezone.utc)),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": cfg.chroma.backend,
+            "partition": cfg.chroma.partition,
+            "capture": opts.capture or "synthetic",
+            "workdir": workdir if opts.keep_dir else None,
+            "options": asdict(opts),
+        },
+        "results": results,
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Dict[str, Optional[float]]]:
+    """Relative change (new/old - 1) of throughput and p50/p95/p99 for benchmarks present in both runs."""
+    out: Dict[str, Dict[str, Optional[float]]] = {}
+    for name, cur in new.get("results", {}).items():
+        prev = old.get("results", {}).get(name)
+        if name.startswith("_") or not prev:
+            continue
+        out[name] = {
+            key: round(cur[key] / prev[key] - 1.0, 4) if cur.get(key) and prev.get(key) else None
+            for key in ("throughput", "p50_ms", "p95_ms", "p99_ms")
+        }
+    return out
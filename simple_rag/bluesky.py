@@ -2,28 +2,66 @@
 
 from __future__ import annotations
 
+import threading
 import time
-from datetime import datetime, timezone
-from typing import List, Optional
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional, Tuple
 
-import requests
 from atproto import Client
+from atproto.exceptions import BadRequestError, LoginRequiredError, UnauthorizedError
 from loguru import logger
 
 from .config import BlueskyCfg
-from .utils import Post, clean_text, extract_keywords
+from .feeds import FeedSnapshot
+from .httpclient import PacedRequest, XrpcHttp
+from .metrics import timed
+from .utils import KeywordMatcher, PostBatch, PostView, clean_text, extract_keywords, iso_to_epoch
+
+
+HOT_FEED_URI = "at://did:plc:z72i7hdynmk6r22z27h6tvur/app.bsky.feed.generator/whats-hot"
 
 
 class BSky:
     def __init__(self, cfg: BlueskyCfg):
         self.cfg = cfg
-        self.client = Client()
+        # one pooled, rate-limit-paced transport for authenticated and public XRPC calls
+        self.http = XrpcHttp(cfg)
+        self.client = Client(base_url=cfg.service.rstrip("/") + "/xrpc", request=PacedRequest(self.http))
         self._auth = False
+        self._auth_lock = threading.Lock()
+        self.logins = 0
+        self.timeline_snapshot = FeedSnapshot(
+            "timeline",
+            lambda limit, cursor: self._call(self.client.get_timeline, limit=limit, cursor=cursor),
+            self._to_post,
+            size=cfg.feed_snapshot_size,
+            ttl=cfg.feed_snapshot_ttl,
+        )
+        self.popular_snapshot = FeedSnapshot(
+            "whats-hot",
+            lambda limit, cursor: self._call(self.client.app.bsky.feed.get_feed, {"feed": HOT_FEED_URI, "limit": limit, "cursor": cursor}),
+            self._to_post,
+            size=cfg.feed_snapshot_size,
+            ttl=cfg.feed_snapshot_ttl,
+            ranked=True,
+        )
+        # hybrid_search fans its sources out here; results are kept briefly so a
+        # source that misses its deadline still serves the next query
+        self._pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="bsky")
+        self._source_lock = threading.Lock()
+        self._source_cache: "OrderedDict[Tuple[str, str], Tuple[float, List[PostView]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], Future] = {}
 
     def login(self) -> bool:
+        with self._auth_lock:
+            return self._login()
+
+    def _login(self) -> bool:
         try:
             self.client.login(self.cfg.handle, self.cfg.app_password)
             self._auth = True
+            self.logins += 1
             logger.info(f"Logged in to Bluesky as {self.cfg.handle}")
             return True
         except Exception as e:
@@ -31,186 +69,225 @@ class BSky:
             self._auth = False
             return False
 
+    @property
+    def authenticated(self) -> bool:
+        return self._auth
+
     def _ensure(self):
-        if not self._auth:
-            if not self.login():
+        if self._auth:
+            return
+        with self._auth_lock:
+            # Another thread may have logged in while we waited for the lock
+            if not self._auth and not self._login():
                 raise RuntimeError("Bluesky auth failed")
 
-    def _to_post(self, item) -> Post:
+    def _is_auth_error(self, e: Exception) -> bool:
+        if isinstance(e, (UnauthorizedError, LoginRequiredError)):
+            return True
+        if isinstance(e, BadRequestError):
+            msg = str(e)
+            return "ExpiredToken" in msg or "InvalidToken" in msg or "AuthenticationRequired" in msg
+        return False
+
+    def _call(self, fn, *args, **kwargs):
+        """Invoke an authenticated client method, logging in again once if the session has expired."""
+        self._ensure()
+        generation = self.logins
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if not self._is_auth_error(e):
+                raise
+            with self._auth_lock:
+                # Only one thread re-authenticates; the others retry on the fresh session
+                if self.logins == generation:
+                    logger.info(f"Bluesky session rejected ({e}); logging in again")
+                    self._auth = False
+                    if not self._login():
+                        raise RuntimeError("Bluesky auth failed")
+            return fn(*args, **kwargs)
+
+    def _to_post(self, item, batch: Optional[PostBatch] = None) -> PostView:
+        """Append ``item`` to ``batch`` (a fresh one when omitted) and return its row."""
         post = item.post if hasattr(item, "post") else item
-        uri = getattr(post, "uri", "")
-        cid = getattr(post, "cid", "")
         author = getattr(post, "author", None)
         handle = getattr(author, "handle", "") if author else ""
-        display_name = getattr(author, "display_name", handle) if author else handle
         record = getattr(post, "record", None)
-        text = clean_text(getattr(record, "text", "") if record else "")
-        created_at = getattr(record, "created_at", None) if record else None
-        if isinstance(created_at, str):
-            try:
-                created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
-            except Exception:
-                created_at = datetime.now(timezone.utc)
-        if created_at is None:
-            created_at = datetime.now(timezone.utc)
-        reply_count = getattr(post, "reply_count", 0)
-        repost_count = getattr(post, "repost_count", 0)
-        like_count = getattr(post, "like_count", 0)
-        return Post(
-            uri=uri,
-            cid=cid,
-            author=handle,
-            author_display_name=display_name,
-            text=text,
-            created_at=created_at,
-            reply_count=reply_count,
-            repost_count=repost_count,
-            like_count=like_count,
+        return (batch if batch is not None else PostBatch()).append(
+            getattr(post, "uri", ""),
+            getattr(post, "cid", ""),
+            handle,
+            getattr(author, "display_name", handle) if author else handle,
+            clean_text(getattr(record, "text", "") if record else ""),
+            iso_to_epoch(getattr(record, "created_at", None) if record else None),
+            getattr(post, "reply_count", 0),
+            getattr(post, "repost_count", 0),
+            getattr(post, "like_count", 0),
         )
 
+    def _to_posts(self, items) -> List[PostView]:
+        batch = PostBatch()
+        return [self._to_post(it, batch) for it in items]
+
     def timeline(self, limit: int = 50):
-        self._ensure()
-        resp = self.client.get_timeline(limit=limit)
-        return [self._to_post(it) for it in resp.feed]
+        resp = self._call(self.client.get_timeline, limit=limit)
+        return self._to_posts(resp.feed)
 
-    def timeline_paged(self, total_limit: int = 120) -> List[Post]:
+    def timeline_paged(self, total_limit: int = 120) -> List[PostView]:
         self._ensure()
         cursor = None
-        out: List[Post] = []
+        out: List[PostView] = []
         while len(out) < total_limit:
             batch_size = min(50, total_limit - len(out))
-            resp = self.client.get_timeline(limit=batch_size, cursor=cursor)
-            out.extend([self._to_post(it) for it in resp.feed])
+            resp = self._call(self.client.get_timeline, limit=batch_size, cursor=cursor)
+            out.extend(self._to_posts(resp.feed))
             cursor = getattr(resp, 'cursor', None)
             if not cursor or not resp.feed:
                 break
-            time.sleep(0.2)
         return out
 
     def popular(self, limit: int = 50):
-        self._ensure()
         # What's hot feed
-        hot_uri = "at://did:plc:z72i7hdynmk6r22z27h6tvur/app.bsky.feed.generator/whats-hot"
-        resp = self.client.app.bsky.feed.get_feed({"feed": hot_uri, "limit": limit})
-        return [self._to_post(it) for it in resp.feed]
+        resp = self._call(self.client.app.bsky.feed.get_feed, {"feed": HOT_FEED_URI, "limit": limit})
+        return self._to_posts(resp.feed)
 
-    def popular_paged(self, total_limit: int = 120) -> List[Post]:
+    def popular_paged(self, total_limit: int = 120) -> List[PostView]:
         self._ensure()
-        hot_uri = "at://did:plc:z72i7hdynmk6r22z27h6tvur/app.bsky.feed.generator/whats-hot"
         cursor = None
-        out: List[Post] = []
+        out: List[PostView] = []
         while len(out) < total_limit:
             batch_size = min(50, total_limit - len(out))
-            resp = self.client.app.bsky.feed.get_feed({"feed": hot_uri, "limit": batch_size, "cursor": cursor})
-            out.extend([self._to_post(it) for it in resp.feed])
+            resp = self._call(self.client.app.bsky.feed.get_feed, {"feed": HOT_FEED_URI, "limit": batch_size, "cursor": cursor})
+            out.extend(self._to_posts(resp.feed))
             cursor = getattr(resp, 'cursor', None)
             if not cursor or not resp.feed:
                 break
-            time.sleep(0.2)
         return out
 
     def author_feed(self, actor: str, limit: int = 50):
-        self._ensure()
-        resp = self.client.get_author_feed(actor=actor, limit=limit)
-        return [self._to_post(it) for it in resp.feed]
+        resp = self._call(self.client.get_author_feed, actor=actor, limit=limit)
+        return self._to_posts(resp.feed)
 
-    def search_posts_public(self, q: str, limit: int = 25) -> List[Post]:
+    def search_posts_public(self, q: str, limit: int = 25) -> List[PostView]:
         """Use the HTTP search posts endpoint when available.
         Note: Public search API may have constraints; we keep this as a best-effort fallback.
         """
         try:
-            url = "https://public.api.bsky.app/xrpc/app.bsky.feed.searchPosts"
+            url = self.cfg.public_api.rstrip("/") + "/xrpc/app.bsky.feed.searchPosts"
             params = {"q": q, "limit": str(limit)}
-            headers = {
-                "User-Agent": "bsrag/1.0 (+https://local)",
-                "Accept-Language": "en",
-            }
-            r = requests.get(url, params=params, headers=headers, timeout=15)
-            r.raise_for_status()
-            data = r.json()
-            posts: List[Post] = []
+            data = self.http.get_json(url, params=params, headers={"Accept-Language": "en"})
+            batch = PostBatch()
             for it in data.get("posts", []):
                 author = it.get("author", {})
                 handle = author.get("handle", "")
-                display_name = author.get("displayName", handle)
-                created_at = it.get("indexedAt") or it.get("createdAt")
-                try:
-                    created_dt = datetime.fromisoformat(created_at.replace("Z", "+00:00")) if created_at else datetime.now(timezone.utc)
-                except Exception:
-                    created_dt = datetime.now(timezone.utc)
-                posts.append(Post(
-                    uri=it.get("uri", ""),
-                    cid=it.get("cid", ""),
-                    author=handle,
-                    author_display_name=display_name,
-                    text=clean_text(it.get("text", "")),
-                    created_at=created_dt,
-                    reply_count=it.get("replyCount", 0),
-                    repost_count=it.get("repostCount", 0),
-                    like_count=it.get("likeCount", 0),
-                ))
+                record = it.get("record") or {}
+                batch.append(
+                    it.get("uri", ""),
+                    it.get("cid", ""),
+                    handle,
+                    author.get("displayName", handle),
+                    clean_text(record.get("text") or it.get("text", "")),
+                    iso_to_epoch(record.get("createdAt") or it.get("indexedAt") or it.get("createdAt")),
+                    it.get("replyCount", 0),
+                    it.get("repostCount", 0),
+                    it.get("likeCount", 0),
+                )
+            posts = list(batch)
             return posts
         except Exception as e:
             logger.warning(f"Public search fallback failed: {e}")
             return []
 
-    def search_posts_auth(self, q: str, limit: int = 25) -> List[Post]:
+    def search_posts_auth(self, q: str, limit: int = 25) -> List[PostView]:
         """Try authenticated search via atproto XRPC if available."""
         try:
-            self._ensure()
             # Some atproto versions support this; headers to prefer English
-            data = self.client.app.bsky.feed.search_posts({
+            data = self._call(self.client.app.bsky.feed.search_posts, {
                 'q': q,
                 'limit': limit,
             }, headers={'Accept-Language': 'en'})
-            posts = []
             # The response should have a 'posts' attribute similar to public search
             items = getattr(data, 'posts', []) or getattr(data, 'feed', [])
-            for it in items:
-                posts.append(self._to_post(it))
-            return posts
+            return self._to_posts(items)
         except Exception as e:
             logger.warning(f"Authenticated search failed: {e}")
             return []
 
-    def hybrid_search(self, query: str, limit: int = 60) -> List[Post]:
-        """Combine timeline, popular, and public search results, then filter by keyword presence."""
-        terms = extract_keywords(query, max_terms=8)
-        results: List[Post] = []
-        try:
-            results.extend(self.timeline_paged(total_limit=120))
-        except Exception:
-            pass
-        try:
-            results.extend(self.popular_paged(total_limit=120))
-        except Exception:
-            pass
-        # Try authenticated search first, then public fallback
-        try:
-            results.extend(self.search_posts_auth(query, limit=40))
-        except Exception:
-            pass
-        try:
-            results.extend(self.search_posts_public(query, limit=40))
-        except Exception:
-            pass
+    def _source_done(self, key: Tuple[str, str], fut: Future) -> None:
+        with self._source_lock:
+            self._inflight.pop(key, None)
+            if fut.cancelled() or fut.exception() is not None:
+                return
+            posts = fut.result()
+            if posts and key[1]:
+                self._source_cache[key] = (time.time(), posts)
+                self._source_cache.move_to_end(key)
+                while len(self._source_cache) > 256:
+                    self._source_cache.popitem(last=False)
+
+    def _fetch_source(self, name: str, query_key: str, fn: Callable[[], List[PostView]]) -> Future:
+        """Start (or join) a source fetch. Empty ``query_key`` means the source caches itself."""
+        key = (name, query_key)
+        with self._source_lock:
+            hit = self._source_cache.get(key)
+            if hit and time.time() - hit[0] < self.cfg.feed_snapshot_ttl:
+                done: Future = Future()
+                done.set_result(hit[1])
+                return done
+            fut = self._inflight.get(key)
+            if fut is not None:
+                return fut
+            fut = self._pool.submit(timed(f"bsky.{name}")(fn))
+            self._inflight[key] = fut
+        fut.add_done_callback(lambda f: self._source_done(key, f))
+        return fut
+
+    def hybrid_search(self, query: str, limit: int = 60) -> PostBatch:
+        """Combine timeline, popular, and public search results, then filter by keyword presence.
+
+        The four sources are fetched concurrently, each with its own deadline.
+        Timeline and popular posts come from shared snapshots, so a warm query
+        does not touch those endpoints at all; a source that misses its
+        deadline keeps running and its result is cached for the next query.
+        """
+        matcher = KeywordMatcher(extract_keywords(query, max_terms=8))
+        qkey = " ".join(query.lower().split())
+        started = time.time()
+        sources = [
+            ("timeline", self.cfg.feed_deadline, self._fetch_source("timeline", "", self.timeline_snapshot.get)),
+            ("popular", self.cfg.feed_deadline, self._fetch_source("popular", "", self.popular_snapshot.get)),
+            # authenticated search first, then public fallback
+            ("search_auth", self.cfg.search_deadline, self._fetch_source("search_auth", qkey, lambda: self.search_posts_auth(query, limit=40))),
+            ("search_public", self.cfg.search_deadline, self._fetch_source("search_public", qkey, lambda: self.search_posts_public(query, limit=40))),
+        ]
+        results: List[PostView] = []
+        for name, deadline, fut in sources:
+            try:
+                results.extend(fut.result(timeout=max(0.0, started + deadline - time.time())))
+            except FutureTimeout:
+                logger.info(f"hybrid_search: {name} missed its {deadline:.1f}s deadline; keeping it for the next query")
+            except Exception:
+                pass
         # dedupe and filter
         seen = set()
-        deduped: List[Post] = []
-        filtered: List[Post] = []
+        deduped: List[PostView] = []
+        filtered: List[PostView] = []
         for p in results:
             if p.uri in seen:
                 continue
             seen.add(p.uri)
             deduped.append(p)
-            if terms:
-                text_l = p.text.lower()
-                # match plain terms; strip #/@ markers to match mentions/hashtags too
-                if any(t.lstrip('#@') in text_l for t in terms):
-                    filtered.append(p)
+            # match plain terms; #/@ markers are stripped to match mentions/hashtags too
+            if matcher and matcher.matches(p.text):
+                filtered.append(p)
         # choose filtered if available, otherwise use deduped
         final = filtered if filtered else deduped
-        return final[:limit]
+        return PostBatch.from_posts(final[:limit])
+
+    def close(self) -> None:
+        """Stop the hybrid-search pool and close the pooled HTTP connections."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self.http.close()
 
 if __name__ == "__main__":
     print("This module provides BSky client utilities.")
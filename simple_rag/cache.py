@@ -0,0 +1,318 @@
+"""Persistent caches for simple RAG."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: SQLite on disk, LRU dict in memory.
+
+    Entries are keyed on (normalized text, model, task_type). Hot entries are
+    served from memory; the table is trimmed to ``max_entries`` by last use.
+    """
+
+    def __init__(self, path: str, max_entries: int = 200_000, memory_entries: int = 20_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._mem: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(text: str, model: str, task_type: str) -> str:
+        raw = f"{model}\x00{task_type}\x00{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vec: List[float]) -> None:
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.memory_entries:
+            self._mem.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        missing: List[str] = []
+        with self._lock:
+            for k in keys:
+                vec = self._mem.get(k)
+                if vec is not None:
+                    self._mem.move_to_end(k)
+                    found[k] = vec
+                else:
+                    missing.append(k)
+            if missing:
+                now = time.time()
+                for i in range(0, len(missing), 500):
+                    part = missing[i : i + 500]
+                    marks = ",".join("?" * len(part))
+                    rows = self._conn.execute(f"SELECT key, vec FROM embeddings WHERE key IN ({marks})", part).fetchall()
+                    for k, blob in rows:
+                        vec = array("f", blob).tolist()
+                        found[k] = vec
+                        self._remember(k, vec)
+                    if rows:
+                        self._conn.executemany(
+                            "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k, _ in rows]
+                        )
+                self._conn.commit()
+            hits = sum(1 for k in keys if k in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def get(self, key: str) -> Optional[List[float]]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vec, last_used) VALUES (?, ?, ?)",
+                [(k, array("f", v).tobytes(), now) for k, v in items.items()],
+            )
+            self._conn.commit()
+            for k, v in items.items():
+                self._remember(k, v)
+            self._writes += len(items)
+            if self._writes >= 1000:
+                self._writes = 0
+                self._evict()
+
+    def put(self, key: str, vec: List[float]) -> None:
+        self.put_many({key: vec})
+
+    def _evict(self) -> None:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        # Trim a little below the cap so eviction does not run on every insert
+        excess += self.max_entries // 10
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._conn.commit()
+        logger.info(f"embedding cache evicted {excess} entries")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "memory_entries": len(self._mem)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class AnswerCache:
+    """Semantic cache of recent answers, persisted to SQLite.
+
+    A question is served from cache when an earlier question with the same
+    persona matches it exactly (after normalisation) or its query embedding is
+    within ``max_distance`` cosine distance, and that answer is younger than
+    ``ttl`` seconds. The oldest entries are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, path: str, ttl: float = 300.0, max_distance: float = 0.08, max_entries: int = 512):
+        self.path = path
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # key -> (persona key, unit query vector or None, result, created_at)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._matrix = None
+        self._matrix_keys: List[str] = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, persona TEXT NOT NULL, vec BLOB, result TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        if self.enabled:
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    @staticmethod
+    def _persona_key(persona: Optional[str]) -> str:
+        return hashlib.sha1((persona or "").encode("utf-8")).hexdigest()[:16]
+
+    def _key(self, question: str, persona: Optional[str]) -> str:
+        return f"{self._persona_key(persona)}:{normalize_text(question).lower()}"
+
+    @staticmethod
+    def _unit(vec):
+        v = np.asarray(vec, dtype=np.float32)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else None
+
+    def _load(self) -> None:
+        cutoff = time.time() - self.ttl
+        self._conn.execute("DELETE FROM answers WHERE created_at < ?", (cutoff,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT key, persona, vec, result, created_at FROM answers ORDER BY created_at DESC LIMIT ?", (self.max_entries,)
+        ).fetchall()
+        for key, persona_key, blob, result, created_at in reversed(rows):
+            vec = np.frombuffer(blob, dtype=np.float32) if blob else None
+            self._entries[key] = (persona_key, vec, json.loads(result), created_at)
+
+    def _live_matrix(self):
+        if self._matrix is None:
+            keys = [k for k, e in self._entries.items() if e[1] is not None]
+            self._matrix_keys = keys
+            self._matrix = np.stack([self._entries[k][1] for k in keys]) if keys else None
+        return self._matrix
+
+    def lookup(self, question: str, persona: Optional[str] = None, qvec: Optional[List[float]] = None) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(self._key(question, persona))
+            if entry is None and qvec is not None:
+                unit = self._unit(qvec)
+                matrix = self._live_matrix()
+                if unit is not None and matrix is not None and matrix.shape[1] == unit.shape[0]:
+                    sims = matrix @ unit
+                    pk = self._persona_key(persona)
+                    for i in np.argsort(-sims):
+                        if 1.0 - float(sims[i]) > self.max_distance:
+                            break
+                        cand = self._entries[self._matrix_keys[i]]
+                        if cand[0] == pk and now - cand[3] < self.ttl:
+                            entry = cand
+                            break
+            if entry is None or now - entry[3] >= self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(entry[2])
+
+    def put(self, question: str, persona: Optional[str], qvec: Optional[List[float]], result: Dict) -> None:
+        if not self.enabled:
+            return
+        key = self._key(question, persona)
+        unit = self._unit(qvec) if qvec is not None else None
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (self._persona_key(persona), unit, dict(result), now)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            self._matrix = None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, persona, vec, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, self._persona_key(persona), unit.tobytes() if unit is not None else None, json.dumps(result), now),
+            )
+            if evicted:
+                self._conn.executemany("DELETE FROM answers WHERE key = ?", [(k,) for k in evicted])
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class DIDCache:
+    """DID -> (handle, display name): size-bounded LRU with a TTL, persisted to SQLite.
+
+    One per process, shared by every ``DIDResolver`` (the ingest daemon and
+    request-time Jetstream streams), so a restart or a new stream does not
+    re-resolve every active author. Thread-safe.
+    """
+
+    def __init__(self, path: str, ttl_sec: float = 86400, max_entries: int = 50_000):
+        self.ttl = ttl_sec
+        self.max_entries = max_entries
+        self._mem: "OrderedDict[str, Tuple[str, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS dids (did TEXT PRIMARY KEY, handle TEXT NOT NULL, display TEXT NOT NULL, resolved_at REAL NOT NULL)")
+        self._conn.commit()
+        self._load()
+
+    def _load(self) -> None:
+        cutoff = time.time() - self.ttl
+        rows = self._conn.execute(
+            "SELECT did, handle, display, resolved_at FROM dids WHERE resolved_at >= ? ORDER BY resolved_at DESC LIMIT ?",
+            (cutoff, self.max_entries),
+        ).fetchall()
+        for did, handle, display, ts in reversed(rows):
+            self._mem[did] = (handle, display, ts)
+
+    def _remember(self, did: str, handle: str, display: str, ts: float) -> None:
+        self._mem[did] = (handle, display, ts)
+        self._mem.move_to_end(did)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def lookup(self, did: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            entry = self._mem.get(did)
+            if entry is None or time.time() - entry[2] >= self.ttl:
+                return None
+            self._mem.move_to_end(did)
+            return entry[0], entry[1]
+
+    def remember(self, did: str, handle: str, display: str) -> None:
+        """Hold an entry in memory only (e.g. a DID that did not resolve)."""
+        with self._lock:
+            self._remember(did, handle, display, time.time())
+
+    def put_many(self, found: Dict[str, Tuple[str, str]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO dids (did, handle, display, resolved_at) VALUES (?, ?, ?, ?)",
+                [(did, h, d, now) for did, (h, d) in found.items()],
+            )
+            self._conn.commit()
+            for did, (h, d) in found.items():
+                self._remember(did, h, d, now)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
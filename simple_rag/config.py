@@ -1,7 +1,7 @@
 """Configuration for simple RAG app."""
 
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional
 
 from dotenv import load_dotenv
@@ -16,6 +16,10 @@ class GeminiCfg:
     embedding_model: str = os.getenv("GEMINI_EMBEDDING_MODEL", "models/text-embedding-004")
     temperature: float = float(os.getenv("TEMPERATURE", "0.4"))
     max_tokens: int = int(os.getenv("MAX_TOKENS", "1536"))
+    embed_batch_size: int = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+    embed_concurrency: int = int(os.getenv("EMBED_CONCURRENCY", "4"))
+    embed_rps: float = float(os.getenv("EMBED_RPS", "5"))
+    embed_retries: int = int(os.getenv("EMBED_RETRIES", "4"))
 
 
 @dataclass
@@ -23,12 +27,31 @@ class BlueskyCfg:
     handle: str
     app_password: str
     service: str = os.getenv("BLUESKY_SERVICE", "https://bsky.social")
+    public_api: str = os.getenv("BLUESKY_PUBLIC_API", "https://public.api.bsky.app")
+    # pooled HTTP for all XRPC calls: pacing ceiling per host and rate-limit policy (ratelimit-* headers can lower it), retries on 429/5xx
+    http_rps: float = float(os.getenv("BSKY_HTTP_RPS", "10"))
+    http_retries: int = int(os.getenv("BSKY_HTTP_RETRIES", "3"))
+    http_timeout: float = float(os.getenv("BSKY_HTTP_TIMEOUT", "15"))
+    http_pool: int = int(os.getenv("BSKY_HTTP_POOL", "20"))
+    feed_snapshot_size: int = int(os.getenv("FEED_SNAPSHOT_SIZE", "120"))
+    feed_snapshot_ttl: float = float(os.getenv("FEED_SNAPSHOT_TTL", "60"))
+    feed_deadline: float = float(os.getenv("FEED_DEADLINE", "4"))
+    search_deadline: float = float(os.getenv("SEARCH_DEADLINE", "6"))
 
 
 @dataclass
 class ChromaCfg:
     db_path: str = os.getenv("CHROMA_DB_PATH", "./chroma_db_simple")
     collection: str = os.getenv("COLLECTION_NAME", "bluesky_posts_simple")
+    # chroma | numpy (in-process memory-mapped matrix, see npstore.py)
+    backend: str = os.getenv("STORE_BACKEND", "chroma")
+    numpy_dtype: str = os.getenv("NUMPY_STORE_DTYPE", "float32")
+    # none | day | hour: one collection per time bucket of created_at (see partitions.py)
+    partition: str = os.getenv("STORE_PARTITION", "none")
+    # partitions older than this are dropped (or archived) by compaction; 0 keeps everything
+    retention_days: int = int(os.getenv("STORE_RETENTION_DAYS", "30"))
+    archive_dir: str = os.getenv("STORE_ARCHIVE_DIR", "")
+    compact_interval: int = int(os.getenv("STORE_COMPACT_INTERVAL", "3600"))
 
 
 @dataclass
@@ -38,6 +61,91 @@ class RAGCfg:
     max_results: int = int(os.getenv("MAX_RESULTS", "12"))
     similarity_threshold: float = float(os.getenv("SIMILARITY_THRESHOLD", "0.35"))
     recent_days: int = int(os.getenv("RECENT_DAYS", "14"))
+    # in-memory BM25 index fused with vector results (see lexical.py)
+    lexical: bool = os.getenv("LEXICAL_INDEX", "true").lower() in ("1", "true", "yes")
+    lexical_max_docs: int = int(os.getenv("LEXICAL_MAX_DOCS", "100000"))
+    # seconds between reloads of the index from the store in the API server, so chunks a separate
+    # ingest-daemon writes (or deletes) are seen; 0 only indexes what this process ingests
+    lexical_refresh: float = float(os.getenv("LEXICAL_REFRESH", "120"))
+    # answer a #tag/@handle query from keyword hits alone when this many contain every tag
+    lexical_min_hits: int = int(os.getenv("LEXICAL_MIN_HITS", "3"))
+    rrf_k: int = int(os.getenv("RRF_K", "60"))
+    # concurrent asks with the same question or keyword set share one pipeline run
+    coalesce: bool = os.getenv("COALESCE_QUERIES", "true").lower() in ("1", "true", "yes")
+    # prompt context: fetch this many times max_results, diversify with MMR, fill the token budget
+    # (never more than the unpacked top-10 context would take)
+    context_overfetch: int = int(os.getenv("CONTEXT_OVERFETCH", "3"))
+    context_token_budget: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+    mmr_lambda: float = float(os.getenv("MMR_LAMBDA", "0.7"))
+    # SimHash near-duplicate suppression at ingest (see dedupe.py)
+    dedupe: bool = os.getenv("DEDUPE", "true").lower() in ("1", "true", "yes")
+    dedupe_max_distance: int = int(os.getenv("DEDUPE_MAX_DISTANCE", "3"))
+    dedupe_days: int = int(os.getenv("DEDUPE_DAYS", "14"))
+    dedupe_max_entries: int = int(os.getenv("DEDUPE_MAX_ENTRIES", "500000"))
+
+
+@dataclass
+class CacheCfg:
+    dir: str = os.getenv("CACHE_DIR", "./cache_simple")
+    embed_max_entries: int = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+    embed_memory_entries: int = int(os.getenv("EMBED_CACHE_MEMORY_ENTRIES", "20000"))
+    answer_ttl: float = float(os.getenv("ANSWER_CACHE_TTL", "300"))
+    answer_max_distance: float = float(os.getenv("ANSWER_CACHE_DISTANCE", "0.08"))
+    answer_max_entries: int = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+    did_ttl: float = float(os.getenv("DID_CACHE_TTL", "86400"))
+    did_max_entries: int = int(os.getenv("DID_CACHE_MAX_ENTRIES", "50000"))
+
+
+@dataclass
+class IngestCfg:
+    # explicit subscribe endpoint; when empty one is built per host in jetstream_hosts
+    jetstream_url: str = os.getenv("JETSTREAM_URL", "")
+    # public instances, tried in order; a failed connection moves on to the next
+    jetstream_hosts: str = os.getenv(
+        "JETSTREAM_HOSTS",
+        "jetstream2.us-east.bsky.network,jetstream1.us-east.bsky.network,jetstream1.us-west.bsky.network,jetstream2.us-west.bsky.network",
+    )
+    # server-side filters (comma-separated); Jetstream drops everything else before sending
+    wanted_collections: str = os.getenv("JETSTREAM_WANTED_COLLECTIONS", "app.bsky.feed.post")
+    wanted_dids: str = os.getenv("JETSTREAM_WANTED_DIDS", "")
+    # frames larger than this are not sent at all; 0 means no limit
+    max_message_size: int = int(os.getenv("JETSTREAM_MAX_MESSAGE_SIZE", "0"))
+    # zstd-compressed frames; needs the zstandard package and Jetstream's published dictionary file
+    compress: bool = os.getenv("JETSTREAM_COMPRESS", "false").lower() in ("1", "true", "yes")
+    zstd_dict_path: str = os.getenv("JETSTREAM_ZSTD_DICT", "./cache_simple/jetstream_zstd_dictionary")
+    # metadata filters run on each firehose record before any text work (see filters.py)
+    # comma-separated BCP-47 prefixes, e.g. "en,de"; empty keeps every language
+    langs: str = os.getenv("INGEST_LANGS", "")
+    # all | top (only direct replies to a thread root) | none
+    replies: str = os.getenv("INGEST_REPLIES", "all")
+    quotes: bool = os.getenv("INGEST_QUOTES", "true").lower() in ("1", "true", "yes")
+    min_chars: int = int(os.getenv("INGEST_MIN_CHARS", "10"))
+    # self-labels that drop a post
+    exclude_labels: str = os.getenv("INGEST_EXCLUDE_LABELS", "porn,sexual,nudity,graphic-media")
+    # posts kept per author per window; 0 disables the cap
+    author_cap: int = int(os.getenv("INGEST_AUTHOR_CAP", "20"))
+    author_window: float = float(os.getenv("INGEST_AUTHOR_WINDOW", "60"))
+    cursor_path: str = os.getenv("JETSTREAM_CURSOR_PATH", "./cache_simple/jetstream.cursor")
+    cursor_rewind_sec: float = float(os.getenv("JETSTREAM_CURSOR_REWIND", "5"))
+    queue_size: int = int(os.getenv("INGEST_QUEUE_SIZE", "5000"))
+    batch_size: int = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+    flush_interval: float = float(os.getenv("INGEST_FLUSH_INTERVAL", "5"))
+    # processes decoding/cleaning/filtering frames (see workers.py); 0 decodes on the event loop, -1 one per core but one
+    workers: int = int(os.getenv("INGEST_WORKERS", "0"))
+    # raw frames shipped to a worker per task
+    worker_batch: int = int(os.getenv("INGEST_WORKER_BATCH", "256"))
+    # Stream from Jetstream inside a request when quick retrieval is thin; turn off when the daemon runs
+    request_fallback: bool = os.getenv("JETSTREAM_REQUEST_FALLBACK", "true").lower() in ("1", "true", "yes")
+
+
+@dataclass
+class ServerCfg:
+    # query pipelines running at once (each on its own worker thread)
+    query_concurrency: int = int(os.getenv("QUERY_CONCURRENCY", "4"))
+    # queries waiting for a slot before new ones are refused with 429
+    query_queue: int = int(os.getenv("QUERY_QUEUE_DEPTH", "16"))
+    # seconds a query may wait for a slot before it is refused with 503
+    query_queue_timeout: float = float(os.getenv("QUERY_QUEUE_TIMEOUT", "10"))
 
 
 @dataclass
@@ -46,6 +154,9 @@ class AppCfg:
     bluesky: BlueskyCfg
     chroma: ChromaCfg
     rag: RAGCfg
+    cache: CacheCfg = field(default_factory=CacheCfg)
+    ingest: IngestCfg = field(default_factory=IngestCfg)
+    server: ServerCfg = field(default_factory=ServerCfg)
 
 
 def get_cfg() -> AppCfg:
@@ -65,4 +176,7 @@ def get_cfg() -> AppCfg:
         bluesky=BlueskyCfg(handle=handle, app_password=app_password),
         chroma=ChromaCfg(),
         rag=RAGCfg(),
+        cache=CacheCfg(),
+        ingest=IngestCfg(),
+        server=ServerCfg(),
     )
@@ -0,0 +1,288 @@
+"""Near-duplicate detection (SimHash + LSH) for simple RAG ingestion."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .store import chunk_id
+from .utils import Chunk, ChunkLike
+
+
+URL_RE = re.compile(r"https?://\S+")
+WORD_RE = re.compile(r"#\w+|@\w+|\w+")
+BANDS = 4
+BAND_BITS = 64 // BANDS
+# shorter texts only collapse on identical signatures
+MIN_NEAR_WORDS = 8
+
+
+def _to_signed(sig: int) -> int:
+    return sig - (1 << 64) if sig >= 1 << 63 else sig
+
+
+def _hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def simhash(text: str) -> Tuple[int, int]:
+    """64-bit SimHash of word 3-shingles (links dropped, case folded); returns (signature, word count)."""
+    words = WORD_RE.findall(URL_RE.sub(" ", text).lower())
+    if not words:
+        return 0, 0
+    feats = [" ".join(words[i : i + 3]) for i in range(max(1, len(words) - 2))]
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "big") for f in feats],
+        dtype=np.uint64,
+    )
+    bits = np.unpackbits(hashes.byteswap().view(np.uint8)).reshape(-1, 64)
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(feats)
+    return int.from_bytes(np.packbits(votes > 0).tobytes(), "big"), len(words)
+
+
+class DuplicateIndex:
+    """SimHash signatures of stored chunks with a banded LSH lookup, persisted to SQLite.
+
+    Two texts are near-duplicates when their signatures differ in at most
+    ``max_distance`` bits. With ``BANDS`` 16-bit bands any such pair shares a
+    band exactly whenever ``max_distance < BANDS``, so a lookup only compares
+    against the chunks in its four buckets. Duplicates are not embedded or
+    stored; each one is recorded as an attestation (uri, author) of the
+    canonical chunk instead.
+    """
+
+    def __init__(self, path: str, max_distance: int = 3, window_days: int = 14, max_entries: int = 500_000):
+        self.path = path
+        self.max_distance = max_distance
+        self.window_days = window_days
+        self.max_entries = max_entries
+        self.suppressed = 0
+        # chunk id -> (signature, created_at_ts)
+        self._sigs: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._bands: List[Dict[int, set]] = [{} for _ in range(BANDS)]
+        self._echoes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS signatures (chunk_id TEXT PRIMARY KEY, sig INTEGER NOT NULL, created_at_ts REAL NOT NULL, uri TEXT)"
+        )
+        # signatures written before posts could be deleted have no uri column
+        if "uri" not in {r[1] for r in self._conn.execute("PRAGMA table_info(signatures)")}:
+            self._conn.execute("ALTER TABLE signatures ADD COLUMN uri TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS signatures_uri ON signatures(uri)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS attestations (uri TEXT NOT NULL, chunk_index INTEGER NOT NULL, canonical_id TEXT NOT NULL, "
+            "author TEXT NOT NULL, created_at_ts REAL NOT NULL, PRIMARY KEY (uri, chunk_index))"
+        )
+        # attestations written before edits were re-checked have no cid column
+        if "cid" not in {r[1] for r in self._conn.execute("PRAGMA table_info(attestations)")}:
+            self._conn.execute("ALTER TABLE attestations ADD COLUMN cid TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS attestations_canonical ON attestations(canonical_id)")
+        self._conn.commit()
+        self._load()
+
+    def _load(self) -> None:
+        cutoff = time.time() - self.window_days * 86400
+        self._conn.execute("DELETE FROM signatures WHERE created_at_ts < ?", (cutoff,))
+        self._conn.execute("DELETE FROM attestations WHERE created_at_ts < ?", (cutoff,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT chunk_id, sig, created_at_ts FROM signatures ORDER BY created_at_ts DESC LIMIT ?", (self.max_entries,)
+        ).fetchall()
+        for cid, sig, ts in reversed(rows):
+            self._add(cid, sig & ((1 << 64) - 1), ts)
+        for cid, n in self._conn.execute("SELECT canonical_id, COUNT(*) FROM attestations GROUP BY canonical_id"):
+            self._echoes[cid] = n
+        logger.info(f"dedupe index loaded {len(self._sigs)} signatures")
+
+    def _add(self, cid: str, sig: int, ts: float) -> None:
+        self._sigs[cid] = (sig, ts)
+        for b in range(BANDS):
+            self._bands[b].setdefault((sig >> (b * BAND_BITS)) & 0xFFFF, set()).add(cid)
+        while len(self._sigs) > self.max_entries:
+            self._discard(next(iter(self._sigs)))
+
+    def _discard(self, cid: str) -> None:
+        entry = self._sigs.pop(cid, None)
+        if entry is None:
+            return
+        sig = entry[0]
+        for b in range(BANDS):
+            key = (sig >> (b * BAND_BITS)) & 0xFFFF
+            bucket = self._bands[b].get(key)
+            if bucket is not None:
+                bucket.discard(cid)
+                if not bucket:
+                    del self._bands[b][key]
+
+    def _nearest(self, sig: int, limit: int, sigs: Dict[str, Tuple[int, float]], bands: List[Dict[int, set]]) -> Optional[str]:
+        best, best_d = None, limit + 1
+        for b in range(BANDS):
+            for cid in bands[b].get((sig >> (b * BAND_BITS)) & 0xFFFF, ()):
+                d = _hamming(sig, sigs[cid][0])
+                if d < best_d:
+                    best, best_d = cid, d
+        return best
+
+    def split(self, chunks: List[ChunkLike]) -> Tuple[List[ChunkLike], List[Tuple[ChunkLike, ChunkLike]], List[Tuple[ChunkLike, str]]]:
+        """Partition chunks into (new, duplicates of a new chunk in this batch, duplicates of a stored chunk id)."""
+        fresh: List[ChunkLike] = []
+        in_batch: List[Tuple[ChunkLike, ChunkLike]] = []
+        stored: List[Tuple[ChunkLike, str]] = []
+        batch_sigs: Dict[str, Tuple[int, float]] = {}
+        batch_bands: List[Dict[int, set]] = [{} for _ in range(BANDS)]
+        batch_chunks: Dict[str, ChunkLike] = {}
+        with self._lock:
+            for ch in chunks:
+                sig, words = simhash(ch.text)
+                if not words:
+                    fresh.append(ch)
+                    continue
+                limit = self.max_distance if words >= MIN_NEAR_WORDS else 0
+                cid = chunk_id(ch.post.uri, ch.index)
+                hit = self._nearest(sig, limit, self._sigs, self._bands)
+                if hit is not None and hit != cid:
+                    stored.append((ch, hit))
+                    continue
+                hit = self._nearest(sig, limit, batch_sigs, batch_bands)
+                if hit is not None:
+                    in_batch.append((ch, batch_chunks[hit]))
+                    continue
+                batch_sigs[cid] = (sig, ch.post.created_ts)
+                batch_chunks[cid] = ch
+                for b in range(BANDS):
+                    batch_bands[b].setdefault((sig >> (b * BAND_BITS)) & 0xFFFF, set()).add(cid)
+                fresh.append(ch)
+        return fresh, in_batch, stored
+
+    def commit(self, stored_chunks: List[ChunkLike], duplicates: List[Tuple[ChunkLike, str]]) -> None:
+        """Register chunks that made it into the store and record duplicates against their canonical ids."""
+        sig_rows = []
+        with self._lock:
+            for ch in stored_chunks:
+                sig, words = simhash(ch.text)
+                if not words:
+                    continue
+                cid = chunk_id(ch.post.uri, ch.index)
+                ts = ch.post.created_ts
+                self._add(cid, sig, ts)
+                sig_rows.append((cid, _to_signed(sig), ts, ch.post.uri))
+            self._conn.executemany("INSERT OR REPLACE INTO signatures (chunk_id, sig, created_at_ts, uri) VALUES (?, ?, ?, ?)", sig_rows)
+            for ch, canonical in duplicates:
+                cur = self._conn.execute(
+                    "INSERT OR IGNORE INTO attestations (uri, chunk_index, canonical_id, author, created_at_ts, cid) VALUES (?, ?, ?, ?, ?, ?)",
+                    (ch.post.uri, ch.index, canonical, ch.post.author, ch.post.created_ts, ch.post.cid),
+                )
+                if cur.rowcount:
+                    self._echoes[canonical] = self._echoes.get(canonical, 0) + 1
+                    self.suppressed += 1
+            self._conn.commit()
+
+    def attested_cids(self, uris: List[str]) -> Dict[str, str]:
+        """CID (empty for rows written without one) of each post URI already recorded as a duplicate."""
+        wanted = [u for u in uris if u]
+        found: Dict[str, str] = {}
+        with self._lock:
+            for i in range(0, len(wanted), 500):
+                part = wanted[i : i + 500]
+                marks = ",".join("?" * len(part))
+                for uri, cid in self._conn.execute(f"SELECT DISTINCT uri, cid FROM attestations WHERE uri IN ({marks})", part):
+                    found[uri] = cid or ""
+        return found
+
+    def clear(self) -> None:
+        """Forget every signature and attestation (the store they describe was wiped)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM signatures")
+            self._conn.execute("DELETE FROM attestations")
+            self._conn.commit()
+            self._sigs.clear()
+            self._bands = [{} for _ in range(BANDS)]
+            self._echoes.clear()
+
+    def prune(self, before_ts: float) -> int:
+        """Forget signatures of chunks created before ``before_ts`` (dropped by retention), with their attestations."""
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute("SELECT chunk_id FROM signatures WHERE created_at_ts < ?", (before_ts,))]
+            for cid in ids:
+                self._discard(cid)
+            self._conn.execute("DELETE FROM signatures WHERE created_at_ts < ?", (before_ts,))
+            self._conn.execute(
+                "DELETE FROM attestations WHERE created_at_ts < ? OR canonical_id NOT IN (SELECT chunk_id FROM signatures)", (before_ts,)
+            )
+            self._conn.commit()
+            self._echoes = dict(self._conn.execute("SELECT canonical_id, COUNT(*) FROM attestations GROUP BY canonical_id").fetchall())
+        return len(ids)
+
+    def remove_posts(self, uris: Iterable[str]) -> int:
+        """Forget the signatures of deleted or rewritten posts, and the attestations on or by them.
+
+        Duplicates recorded against a removed chunk lose their attestation too,
+        so they are embedded like any new post when they are seen again.
+        """
+        wanted = sorted({u for u in uris if u})
+        removed = 0
+        with self._lock:
+            for i in range(0, len(wanted), 500):
+                part = wanted[i : i + 500]
+                marks = ",".join("?" * len(part))
+                ids = [r[0] for r in self._conn.execute(f"SELECT chunk_id FROM signatures WHERE uri IN ({marks})", part)]
+                for cid in ids:
+                    self._discard(cid)
+                    self._echoes.pop(cid, None)
+                removed += len(ids)
+                for (canonical,) in self._conn.execute(f"SELECT canonical_id FROM attestations WHERE uri IN ({marks})", part).fetchall():
+                    if canonical in self._echoes:
+                        self._echoes[canonical] -= 1
+                        if self._echoes[canonical] <= 0:
+                            del self._echoes[canonical]
+                self._conn.execute(f"DELETE FROM attestations WHERE uri IN ({marks})", part)
+                self._conn.execute(f"DELETE FROM signatures WHERE uri IN ({marks})", part)
+                for j in range(0, len(ids), 500):
+                    chunk_ids = ids[j : j + 500]
+                    self._conn.execute(f"DELETE FROM attestations WHERE canonical_id IN ({','.join('?' * len(chunk_ids))})", chunk_ids)
+            self._conn.commit()
+        return removed
+
+    def echoes(self, chunk_ids: List[str]) -> Dict[str, int]:
+        """Number of duplicate posts recorded against each canonical chunk id."""
+        with self._lock:
+            return {c: self._echoes[c] for c in chunk_ids if c in self._echoes}
+
+    def attestations(self, canonical_id: str) -> List[Tuple[str, str]]:
+        """(uri, author) of every duplicate recorded against ``canonical_id``."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT uri, author FROM attestations WHERE canonical_id = ? ORDER BY created_at_ts", (canonical_id,)
+            ).fetchall()
+
+    def collapse(self, chunks: List[Chunk]) -> List[Chunk]:
+        """Drop near-duplicates from a ranked result list, keeping the best-ranked copy."""
+        kept: List[Chunk] = []
+        sigs: List[Tuple[int, int]] = []
+        for ch in chunks:
+            sig, words = simhash(ch.text)
+            limit = self.max_distance if words >= MIN_NEAR_WORDS else 0
+            if words and any(_hamming(sig, s) <= min(limit, lim) for s, lim in sigs):
+                continue
+            sigs.append((sig, limit))
+            kept.append(ch)
+        return kept
+
+    def stats(self) -> Dict[str, int]:
+        return {"signatures": len(self._sigs), "suppressed": self.suppressed, "canonical_with_echoes": len(self._echoes)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -2,23 +2,30 @@
 
 from __future__ import annotations
 
-import time
-from typing import List, Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Dict
 
 import google.generativeai as genai
+from google.api_core.exceptions import TooManyRequests
 from google.generativeai import GenerativeModel
 from loguru import logger
 
+from .cache import EmbeddingCache
 from .config import GeminiCfg
-from .utils import Chunk, format_doc_for_prompt
+from .metrics import EMBED_REQUESTS, EMBED_TEXTS, EMBED_THROTTLED, timed
+from .ratelimit import AdaptiveLimiter
+from .utils import DOC_SEPARATOR, Chunk, format_doc_for_prompt
 
 
 class Gemini:
-    def __init__(self, cfg: GeminiCfg):
+    def __init__(self, cfg: GeminiCfg, cache: Optional[EmbeddingCache] = None):
         self.cfg = cfg
+        self.cache = cache
         genai.configure(api_key=cfg.api_key)
         self.text_model = GenerativeModel(cfg.text_model)
         self.embedding_model = cfg.embedding_model
+        self.limiter = AdaptiveLimiter(cfg.embed_rps)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, cfg.embed_concurrency), thread_name_prefix="embed")
 
     def _extract_text(self, response) -> Optional[str]:
         try:
@@ -41,6 +48,14 @@ class Gemini:
             pass
         return None
 
+    def _delta_text(self, response) -> str:
+        """Text of one streamed chunk, unstripped so word boundaries between chunks survive."""
+        try:
+            parts = response.candidates[0].content.parts
+            return "".join(getattr(p, "text", "") for p in parts)
+        except Exception:
+            return ""
+
     def _extract_vec(self, result) -> Optional[List[float]]:
         try:
             v = result.get("embedding")
@@ -52,40 +67,106 @@ class Gemini:
             pass
         return None
 
+    def _embed_request(self, content, task_type: str):
+        """One embed_content call, paced by the limiter and retried on 429."""
+        for attempt in range(self.cfg.embed_retries + 1):
+            self.limiter.acquire()
+            EMBED_REQUESTS.inc(kind="batch" if isinstance(content, list) else "single")
+            EMBED_TEXTS.inc(len(content) if isinstance(content, list) else 1)
+            try:
+                res = genai.embed_content(
+                    model=self.embedding_model,
+                    content=content,
+                    task_type=task_type,
+                )
+                self.limiter.on_success()
+                return res
+            except TooManyRequests as e:
+                EMBED_THROTTLED.inc()
+                if attempt >= self.cfg.embed_retries:
+                    raise
+                logger.warning(f"embed throttled, backing off (rate={self.limiter.rate:.2f}/s): {e}")
+                self.limiter.on_throttle()
+
+    @timed("gemini.embed")
     def embed(self, text: str, task_type: str = "RETRIEVAL_DOCUMENT") -> Optional[List[float]]:
         if not text or not text.strip():
             return None
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(text, self.embedding_model, task_type)
+            vec = self.cache.get(key)
+            if vec is not None:
+                return vec
         try:
-            res = genai.embed_content(
-                model=self.embedding_model,
-                content=text.strip(),
-                task_type=task_type,
-            )
-            vec = self._extract_vec(res)
+            vec = self._extract_vec(self._embed_request(text.strip(), task_type))
             if vec is None:
                 logger.warning("Embedding returned no vector")
+            elif key is not None:
+                self.cache.put(key, vec)
             return vec
         except Exception as e:
             logger.error(f"embed error: {e}")
             return None
 
-    def embed_batch(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT", batch_size: int = 16, delay: float = 0.2) -> List[Optional[List[float]]]:
-        out: List[Optional[List[float]]] = []
-        for i in range(0, len(texts), batch_size):
-            b = texts[i : i + batch_size]
-            for t in b:
-                out.append(self.embed(t, task_type=task_type))
-                time.sleep(0.05)
-            if i + batch_size < len(texts):
-                time.sleep(delay)
+    def _embed_many(self, texts: List[str], task_type: str) -> List[Optional[List[float]]]:
+        try:
+            res = self._embed_request(texts, task_type)
+            vecs = res.get("embedding") or []
+            if len(vecs) == len(texts):
+                return [v or None for v in vecs]
+            logger.warning(f"batch embed returned {len(vecs)} vectors for {len(texts)} texts")
+        except Exception as e:
+            logger.warning(f"batch embed failed, retrying texts individually: {e}")
+        # Isolate the bad input instead of losing the whole batch
+        return [self.embed(t, task_type=task_type) for t in texts]
+
+    def cached_vectors(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[Optional[List[float]]]:
+        """Cached embeddings for ``texts`` (None where absent); never calls the API."""
+        if self.cache is None:
+            return [None] * len(texts)
+        keys = [self.cache.key(t, self.embedding_model, task_type) for t in texts]
+        found = self.cache.get_many(list(set(keys)))
+        return [found.get(k) for k in keys]
+
+    @timed("gemini.embed_batch")
+    def embed_batch(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT", batch_size: Optional[int] = None, delay: Optional[float] = None) -> List[Optional[List[float]]]:
+        """Embed texts with the batch API, several requests in flight at once.
+
+        Output is aligned with ``texts``; empty texts and failures yield None.
+        ``delay`` is accepted for compatibility and ignored: pacing comes from the limiter.
+        """
+        batch_size = max(1, min(batch_size or self.cfg.embed_batch_size, 100))
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        idx = [i for i, t in enumerate(texts) if t and t.strip()]
+        keys: Dict[int, str] = {}
+        if self.cache is not None and idx:
+            keys = {i: self.cache.key(texts[i], self.embedding_model, task_type) for i in idx}
+            cached = self.cache.get_many(list(set(keys.values())))
+            for i in idx:
+                out[i] = cached.get(keys[i])
+            idx = [i for i in idx if out[i] is None]
+        batches = [idx[i : i + batch_size] for i in range(0, len(idx), batch_size)]
+
+        def run(batch: List[int]) -> None:
+            vecs = self._embed_many([texts[i].strip() for i in batch], task_type)
+            for i, v in zip(batch, vecs):
+                out[i] = v
+
+        if len(batches) == 1:
+            run(batches[0])
+        elif batches:
+            list(self._pool.map(run, batches))
+        if keys and idx:
+            self.cache.put_many({keys[i]: out[i] for i in idx if out[i] is not None})
         return out
 
     def query_embed(self, text: str) -> Optional[List[float]]:
         return self.embed(text, task_type="RETRIEVAL_QUERY")
 
     def build_prompt(self, question: str, chunks: List[Chunk], persona: Optional[str] = None) -> str:
-        docs = "\n\n---\n\n".join(
-            format_doc_for_prompt(i + 1, ch) for i, ch in enumerate(chunks[:10])
+        docs = DOC_SEPARATOR.join(
+            format_doc_for_prompt(i + 1, ch) for i, ch in enumerate(chunks)
         )
         base_style = (
             "You are a helpful assistant summarizing and citing Bluesky posts. "
@@ -97,6 +178,7 @@ class Gemini:
         prompt = f"{base_style}\n\nContext:\n{docs}\n\nQuestion: {question}\n\nAnswer:"
         return prompt
 
+    @timed("gemini.answer")
     def answer(self, question: str, chunks: List[Chunk], persona: Optional[str] = None) -> Optional[str]:
         prompt = self.build_prompt(question, chunks, persona=persona)
         try:
@@ -123,3 +205,36 @@ class Gemini:
         except Exception as e:
             logger.error(f"gen error: {e}")
             return None
+
+    def answer_stream(
+        self, question: str, chunks: List[Chunk], persona: Optional[str] = None, errors: Optional[List[Exception]] = None
+    ) -> Iterator[str]:
+        """Yield answer text as the model generates it, falling back to ``answer`` if nothing streams.
+
+        A generation error after text has streamed ends the answer early; it is
+        appended to ``errors`` so the caller knows the text is incomplete.
+        """
+        prompt = self.build_prompt(question, chunks, persona=persona)
+        produced = False
+        try:
+            cfg = genai.types.GenerationConfig(
+                max_output_tokens=self.cfg.max_tokens,
+                temperature=self.cfg.temperature,
+            )
+            for part in self.text_model.generate_content(prompt, generation_config=cfg, stream=True):
+                txt = self._delta_text(part)
+                if txt:
+                    produced = True
+                    yield txt
+        except Exception as e:
+            logger.error(f"stream gen error: {e}")
+            if produced and errors is not None:
+                errors.append(e)
+        if not produced:
+            # Blocked or failed before any text: use the non-streaming path with its safe-persona retry
+            txt = self.answer(question, chunks, persona=persona)
+            if txt:
+                yield txt
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,141 @@
+"""Long-lived RAG engine shared by API requests."""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+from loguru import logger
+
+from .admission import AdmissionController
+from .config import AppCfg, ServerCfg, get_cfg
+from .metrics import REGISTRY, Sample
+from .rag import SimpleRAG
+from .workers import close_shared_pool
+
+
+class Engine:
+    """Builds the SimpleRAG components once, warms them, and reports readiness.
+
+    The Bluesky client, Gemini model and Chroma client are created at startup and
+    shared by every request instead of being rebuilt per query.
+    """
+
+    def __init__(self, cfg: Optional[AppCfg] = None):
+        self.cfg = cfg
+        self.rag: Optional[SimpleRAG] = None
+        self.started_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+        server = cfg.server if cfg is not None else ServerCfg()
+        self.admission = AdmissionController(server.query_concurrency, server.query_queue, server.query_queue_timeout)
+        REGISTRY.collector(self.collect)
+
+    @property
+    def ready(self) -> bool:
+        return self.rag is not None and self.error is None
+
+    def start(self) -> None:
+        with self._lock:
+            if self.rag is not None:
+                return
+            t0 = time.time()
+            try:
+                self.cfg = self.cfg or get_cfg()
+                rag = SimpleRAG(self.cfg)
+            except Exception as e:
+                self.error = str(e)
+                logger.error(f"engine startup failed: {e}")
+                return
+            # Warm-up: open the session and touch the collection so the first query pays nothing
+            if not rag.bs.login():
+                logger.warning("engine warm-up: Bluesky login failed; will retry on first use")
+            try:
+                rag.db.count()
+            except Exception as e:
+                logger.warning(f"engine warm-up: store not reachable: {e}")
+            self.rag = rag
+            self.error = None
+            self.started_at = time.time()
+            logger.info(f"engine ready in {self.started_at - t0:.2f}s")
+            if rag.lexical is not None and self.cfg.rag.lexical_refresh > 0:
+                self._stopping.clear()
+                self._refresher = threading.Thread(target=self._refresh_lexical, args=(rag,), name="lexical-refresh", daemon=True)
+                self._refresher.start()
+
+    def _refresh_lexical(self, rag: SimpleRAG) -> None:
+        # the ingest-daemon writes the store from another process, so the keyword index is reloaded from it
+        while not self._stopping.wait(self.cfg.rag.lexical_refresh):
+            try:
+                rag.refresh_lexical()
+            except Exception as e:
+                logger.warning(f"lexical index refresh failed: {e}")
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stopping.set()
+            if self._refresher is not None:
+                self._refresher.join()
+                self._refresher = None
+            # running pipelines still use the rag, so they finish before it is closed
+            self.admission.stop(wait=True)
+            close_shared_pool()
+            if self.rag is not None:
+                self.rag.close()
+            self.rag = None
+            self.started_at = None
+
+    def get(self) -> SimpleRAG:
+        if self.rag is None:
+            raise RuntimeError(self.error or "engine not started")
+        return self.rag
+
+    def collect(self) -> Iterator[Sample]:
+        """Component counters for /metrics; reads in-memory stats only, never the store."""
+        a = self.admission
+        yield "bsrag_ready", "gauge", "1 once the engine has started.", {}, 1 if self.ready else 0
+        yield "bsrag_queries_running", "gauge", "Query pipelines holding a slot.", {}, a.running
+        yield "bsrag_queries_waiting", "gauge", "Queries waiting for a slot.", {}, a.waiting
+        for outcome, n in (("admitted", a.admitted), ("rejected", a.rejected), ("timed_out", a.timed_out), ("cancelled", a.cancelled)):
+            yield "bsrag_queries_total", "counter", "Queries by admission outcome.", {"outcome": outcome}, n
+        rag = self.rag
+        if rag is None:
+            return
+        for name, cache in (("embedding", rag.embed_cache), ("answer", rag.answers)):
+            yield "bsrag_cache_hits_total", "counter", "Cache lookups that hit.", {"cache": name}, cache.hits
+            yield "bsrag_cache_misses_total", "counter", "Cache lookups that missed.", {"cache": name}, cache.misses
+        yield "bsrag_bluesky_logins_total", "counter", "Bluesky session logins.", {}, rag.bs.logins
+        if rag.flights is not None:
+            yield "bsrag_pipeline_runs_total", "counter", "Query pipelines executed.", {}, rag.flights.executions
+            yield "bsrag_coalesced_queries_total", "counter", "Queries served by another query's run.", {}, rag.flights.coalesced
+        if rag.lexical is not None:
+            yield "bsrag_lexical_searches_total", "counter", "Keyword index searches.", {"strong": "false"}, rag.lexical.searches - rag.lexical.strong_searches
+            yield "bsrag_lexical_searches_total", "counter", "Keyword index searches.", {"strong": "true"}, rag.lexical.strong_searches
+        if rag.dedupe is not None:
+            yield "bsrag_dedupe_suppressed_total", "counter", "Near-duplicate chunks not embedded.", {}, rag.dedupe.suppressed
+
+    def health(self) -> Dict[str, Any]:
+        rag = self.rag
+        out: Dict[str, Any] = {"ready": self.ready, "queries": self.admission.stats()}
+        if self.error:
+            out["error"] = self.error
+        if rag is None:
+            return out
+        out["uptime_sec"] = round(time.time() - (self.started_at or time.time()), 1)
+        out["bluesky"] = {"authenticated": rag.bs.authenticated, "logins": rag.bs.logins, "http": rag.bs.http.stats()}
+        out["embed_cache"] = rag.embed_cache.stats()
+        out["answer_cache"] = rag.answers.stats()
+        if rag.flights is not None:
+            out["coalescing"] = rag.flights.stats()
+        if rag.lexical is not None:
+            out["lexical"] = rag.lexical.stats()
+        if rag.dedupe is not None:
+            out["dedupe"] = rag.dedupe.stats()
+        try:
+            out["store"] = {"ok": True, "chunks": rag.db.count()}
+        except Exception as e:
+            out["store"] = {"ok": False, "error": str(e)}
+        return out
@@ -0,0 +1,88 @@
+"""Shared, incrementally refreshed feed snapshots for simple RAG."""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from loguru import logger
+
+from .utils import PostBatch, PostView
+
+
+class FeedSnapshot:
+    """Rolling window of the newest posts of one paged feed, shared by all queries.
+
+    Within ``ttl`` seconds of the last refresh ``get`` returns the snapshot
+    without any network call. A refresh pages from the head and stops as soon
+    as it reaches posts it already holds, so only the new head is fetched.
+    Ranked feeds (e.g. what's-hot) reorder between calls, so for them paging
+    stops at the first page that brings nothing new rather than at the first
+    known URI.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fetch_page: Callable[[int, Optional[str]], Any],
+        to_post: Callable[[Any, PostBatch], PostView],
+        size: int = 120,
+        ttl: float = 60.0,
+        ranked: bool = False,
+    ):
+        self.name = name
+        self.fetch_page = fetch_page
+        self.to_post = to_post
+        self.size = size
+        self.ttl = ttl
+        self.ranked = ranked
+        self.posts: List[PostView] = []
+        self.refreshed_at = 0.0
+        self.pages_fetched = 0
+        self._lock = threading.Lock()
+
+    @property
+    def fresh(self) -> bool:
+        return bool(self.posts) and time.time() - self.refreshed_at < self.ttl
+
+    def get(self) -> List[PostView]:
+        if not self.fresh:
+            with self._lock:
+                # Concurrent callers wait for one refresh instead of each paging the feed
+                if not self.fresh:
+                    self.refresh()
+        return list(self.posts)
+
+    def refresh(self) -> int:
+        known = {p.uri for p in self.posts}
+        new: List[PostView] = []
+        # one column batch per refresh; the snapshot keeps views into it
+        batch = PostBatch()
+        cursor = None
+        while len(new) < self.size:
+            resp = self.fetch_page(min(50, self.size - len(new)), cursor)
+            self.pages_fetched += 1
+            feed = getattr(resp, "feed", None) or []
+            page_new = 0
+            reached_known = False
+            for it in feed:
+                p = self.to_post(it, batch)
+                if p.uri in known:
+                    reached_known = True
+                    if not self.ranked:
+                        break
+                    continue
+                known.add(p.uri)
+                new.append(p)
+                page_new += 1
+            cursor = getattr(resp, "cursor", None)
+            if not cursor or not feed:
+                break
+            if (reached_known and not self.ranked) or (self.ranked and page_new == 0):
+                break
+        new_uris = {p.uri for p in new}
+        self.posts = (new + [p for p in self.posts if p.uri not in new_uris])[: self.size]
+        self.refreshed_at = time.time()
+        logger.info(f"feed snapshot {self.name}: {len(new)} new posts, {len(self.posts)} held")
+        return len(new)
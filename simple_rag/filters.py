@@ -0,0 +1,134 @@
+"""Cheap metadata filters applied to firehose post records before any text work."""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from .config import IngestCfg
+from .metrics import FILTER_DROPPED
+
+QUOTE_EMBEDS = ("app.bsky.embed.record", "app.bsky.embed.recordWithMedia")
+
+
+def _csv(value: str) -> Tuple[str, ...]:
+    return tuple(v.strip().lower() for v in (value or "").split(",") if v.strip())
+
+
+class RecordFilter:
+    """Stateless checks on a post record dict, cheapest first.
+
+    Runs before ``clean_text``, keyword matching and timestamp parsing, so a
+    dropped record costs a few dict lookups. ``drops`` counts rejections per
+    stage; like ``FrameFilter``, worker processes count locally and the parent
+    ``absorb``s their counts.
+    """
+
+    STAGES = ("lang", "reply", "quote", "length", "label")
+
+    def __init__(
+        self,
+        langs: Iterable[str] = (),
+        replies: str = "all",
+        quotes: bool = True,
+        min_chars: int = 0,
+        exclude_labels: Iterable[str] = (),
+        metrics: bool = True,
+    ):
+        self.langs = tuple(langs)
+        self.replies = replies
+        self.quotes = quotes
+        self.min_chars = min_chars
+        self.exclude_labels = frozenset(exclude_labels)
+        self.metrics = metrics
+        self.drops: Dict[str, int] = {s: 0 for s in self.STAGES}
+
+    @classmethod
+    def from_cfg(cls, cfg: IngestCfg) -> "RecordFilter":
+        return cls(_csv(cfg.langs), cfg.replies.lower(), cfg.quotes, cfg.min_chars, _csv(cfg.exclude_labels))
+
+    def spec(self) -> Tuple[Any, ...]:
+        """Hashable constructor arguments, for rebuilding the filter in a worker process."""
+        return (self.langs, self.replies, self.quotes, self.min_chars, tuple(sorted(self.exclude_labels)))
+
+    def reject(self, rec: Dict[str, Any]) -> Optional[str]:
+        """The stage that drops ``rec``, or None when it passes."""
+        if self.langs:
+            langs = rec.get("langs")
+            # posts without declared languages get the benefit of the doubt
+            if langs and not any(str(l).lower().startswith(self.langs) for l in langs):
+                return "lang"
+        if self.replies != "all":
+            reply = rec.get("reply")
+            if reply:
+                if self.replies == "none":
+                    return "reply"
+                parent, root = reply.get("parent") or {}, reply.get("root") or {}
+                if parent.get("uri") != root.get("uri"):
+                    return "reply"
+        if not self.quotes:
+            embed = rec.get("embed")
+            if isinstance(embed, dict) and embed.get("$type") in QUOTE_EMBEDS:
+                return "quote"
+        if self.min_chars:
+            text = rec.get("text") or ""
+            if len(text) < self.min_chars or len(text.strip()) < self.min_chars:
+                return "length"
+        if self.exclude_labels:
+            labels = rec.get("labels")
+            if isinstance(labels, dict):
+                for label in labels.get("values") or ():
+                    if isinstance(label, dict) and label.get("val") in self.exclude_labels:
+                        return "label"
+        return None
+
+    def admit(self, rec: Dict[str, Any]) -> bool:
+        stage = self.reject(rec)
+        if stage is None:
+            return True
+        self.drops[stage] += 1
+        if self.metrics:
+            FILTER_DROPPED.inc(stage=stage)
+        return False
+
+    def absorb(self, drops: Dict[str, int]) -> None:
+        for stage, n in drops.items():
+            if n:
+                self.drops[stage] = self.drops.get(stage, 0) + n
+                if self.metrics:
+                    FILTER_DROPPED.inc(n, stage=stage)
+
+
+class AuthorCap:
+    """Keeps at most ``limit`` posts per author per ``window`` seconds.
+
+    The last stage of the cascade. It holds state, so it runs in the process
+    that owns the stream rather than in decode workers, where each shard
+    would only see part of an author's posts.
+    """
+
+    def __init__(self, limit: int, window: float = 60.0, max_authors: int = 100_000):
+        self.limit = limit
+        self.window = window
+        self.max_authors = max_authors
+        self.dropped = 0
+        # author -> (window start, posts kept in it)
+        self._counts: Dict[str, Tuple[float, int]] = {}
+
+    @classmethod
+    def from_cfg(cls, cfg: IngestCfg) -> Optional["AuthorCap"]:
+        return cls(cfg.author_cap, cfg.author_window) if cfg.author_cap > 0 else None
+
+    def allow(self, author: str, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        start, n = self._counts.get(author, (now, 0))
+        if now - start >= self.window:
+            start, n = now, 0
+        if n >= self.limit:
+            self.dropped += 1
+            FILTER_DROPPED.inc(stage="author_cap")
+            return False
+        if len(self._counts) >= self.max_authors and author not in self._counts:
+            self._counts = {a: v for a, v in self._counts.items() if now - v[0] < self.window}
+        self._counts[author] = (start, n + 1)
+        return True
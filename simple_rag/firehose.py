@@ -0,0 +1,206 @@
+"""Fast-path decoding and filtering of raw Jetstream frames."""
+
+from __future__ import annotations
+
+import json
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+
+from .filters import RecordFilter
+from .metrics import JETSTREAM_BYTES, JETSTREAM_FRAMES
+from .utils import KeywordMatcher, clean_text, iso_to_epoch
+
+try:  # optional faster decoder
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover - falls back to the stdlib
+    _loads = json.loads
+
+try:  # optional: Jetstream's compress=true mode
+    import zstandard
+except ImportError:  # pragma: no cover - frames are requested uncompressed
+    zstandard = None
+
+
+POST_COLLECTION = "app.bsky.feed.post"
+POST_MARKER = POST_COLLECTION.encode()
+TEXT_MARKER = b'"text"'
+# Jetstream writes compact JSON, so a delete op always carries this exact substring
+DELETE_MARKER = b'"operation":"delete"'
+
+
+@lru_cache(maxsize=4)
+def zstd_decompressor(dict_path: str):
+    """Decompressor for Jetstream's zstd frames, or None when zstandard or the dictionary is missing.
+
+    Jetstream compresses every frame against its published dictionary
+    (``zstd_dictionary`` in the bluesky-social/jetstream repository).
+    """
+    if zstandard is None:
+        logger.warning("JETSTREAM_COMPRESS needs the zstandard package; streaming uncompressed")
+        return None
+    try:
+        with open(dict_path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        logger.warning(f"Jetstream zstd dictionary unavailable ({e}); streaming uncompressed")
+        return None
+    return zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(data))
+
+
+class FrameFilter:
+    """Rejects frames on their raw bytes before paying for a full JSON parse.
+
+    Almost every firehose frame is dropped (wrong collection, no text, no
+    keyword), so cheap substring and regex checks on the undecoded frame run
+    first and only the survivors are decoded. With ``zstd_dict`` binary
+    frames are decompressed first; ``bytes_in``/``bytes_out`` count frame
+    bytes before and after that. With ``deletes`` post delete ops, which
+    carry no text, are let through too.
+    """
+
+    def __init__(
+        self,
+        matcher: Optional[KeywordMatcher] = None,
+        metrics: bool = True,
+        zstd_dict: Optional[str] = None,
+        records: Optional[RecordFilter] = None,
+        deletes: bool = False,
+    ):
+        self.matcher = matcher or KeywordMatcher([])
+        self.deletes = deletes
+        # metadata cascade applied to each decoded post record (see filters.py)
+        self.records = records
+        # worker processes count locally and report back through ``absorb``
+        self.metrics = metrics
+        self.zstd_dict = zstd_dict
+        self._zstd = zstd_decompressor(zstd_dict) if zstd_dict else None
+        self.frames = 0
+        self.rejected = 0
+        self.invalid = 0
+        self.decoded = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _count(self, outcome: str, n: int = 1) -> None:
+        if self.metrics and n:
+            JETSTREAM_FRAMES.inc(n, outcome=outcome)
+
+    def _count_bytes(self, wire: int, decoded: int) -> None:
+        self.bytes_in += wire
+        self.bytes_out += decoded
+        if self.metrics:
+            JETSTREAM_BYTES.inc(wire, stage="wire")
+            JETSTREAM_BYTES.inc(decoded, stage="decompressed")
+
+    def absorb(self, frames: int, rejected: int, invalid: int, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        """Add counts from frames filtered elsewhere (see ``workers.py``)."""
+        decoded = frames - rejected - invalid
+        self.frames += frames
+        self.rejected += rejected
+        self.invalid += invalid
+        self.decoded += decoded
+        self._count("rejected", rejected)
+        self._count("invalid", invalid)
+        self._count("decoded", decoded)
+        self._count_bytes(bytes_in, bytes_out)
+
+    def decode(self, raw: Union[bytes, str]) -> Optional[Dict[str, Any]]:
+        self.frames += 1
+        wire = len(raw)
+        if self._zstd is not None and isinstance(raw, (bytes, bytearray)):
+            try:
+                raw = self._zstd.decompressobj().decompress(raw)
+            except zstandard.ZstdError:
+                self._count_bytes(wire, 0)
+                self.invalid += 1
+                self._count("invalid")
+                return None
+        self._count_bytes(wire, len(raw))
+        if isinstance(raw, (bytes, bytearray)):
+            post_marker, text_marker, delete_marker = POST_MARKER, TEXT_MARKER, DELETE_MARKER
+        else:
+            post_marker, text_marker, delete_marker = POST_COLLECTION, '"text"', DELETE_MARKER.decode()
+        if post_marker not in raw or (
+            not (self.deletes and delete_marker in raw) and (text_marker not in raw or not self.matcher.may_match_raw(raw))
+        ):
+            self.rejected += 1
+            self._count("rejected")
+            return None
+        try:
+            msg = _loads(raw)
+        except Exception:
+            self.invalid += 1
+            self._count("invalid")
+            return None
+        self.decoded += 1
+        self._count("decoded")
+        return msg if isinstance(msg, dict) else None
+
+
+def post_uri(repo: Optional[str], rkey: str) -> str:
+    return f"at://{repo}/{POST_COLLECTION}/{rkey or 'unknown'}"
+
+
+def _post_ops(msg: Dict[str, Any]) -> Tuple[Optional[str], Dict[str, Any], List[Tuple[str, str, str, Optional[Dict]]]]:
+    """(repo DID, commit, ``(action, rkey, cid, record)`` of each post operation in a Jetstream message)."""
+    # Expect a commit-like structure with op(s) and record
+    commit = msg.get("commit") or msg
+    repo = commit.get("repo") or msg.get("repo") or msg.get("did")
+    out: List[Tuple[str, str, str, Optional[Dict]]] = []
+    record = commit.get("record") or msg.get("record")
+    action = commit.get("operation") or "create"
+    if commit.get("collection", POST_COLLECTION) == POST_COLLECTION and (
+        action == "delete" or (isinstance(record, dict) and record.get("$type", "").endswith(POST_COLLECTION))
+    ):
+        out.append((action, commit.get("rkey") or "", commit.get("cid") or "", record))
+    for op in commit.get("ops") or commit.get("operations") or []:
+        if not isinstance(op, dict):
+            continue
+        path = op.get("path", "")
+        if POST_COLLECTION not in path:
+            continue
+        out.append((op.get("action") or op.get("op") or "", path.rsplit("/", 1)[-1], str(op.get("cid") or ""), op.get("record") or record))
+    return repo, commit, out
+
+
+def post_records(msg: Dict[str, Any]) -> Tuple[Optional[str], List[Tuple[str, str, Dict]]]:
+    """Pull (repo DID, ``(rkey, cid, record)`` of each post created or updated by this event) out of a Jetstream message."""
+    repo, _, ops = _post_ops(msg)
+    out: List[Tuple[str, str, Dict]] = []
+    for action, rkey, cid, rec in ops:
+        if action in ("create", "update") and isinstance(rec, dict) and rec.get("text"):
+            out.append((rkey, cid, rec))
+    return repo, out
+
+
+def post_deletes(msg: Dict[str, Any]) -> Tuple[Optional[str], List[str]]:
+    """(repo DID, rkeys of the posts deleted by this event)."""
+    repo, _, ops = _post_ops(msg)
+    return repo, [rkey for action, rkey, _, _ in ops if action == "delete" and rkey]
+
+
+def extract_posts(
+    msg: Dict[str, Any], matcher: KeywordMatcher, records: Optional[RecordFilter] = None
+) -> Tuple[Optional[str], List[Tuple[str, str, str, int]]]:
+    """(repo DID, ``(rkey, cid, clean text, created_ts)`` of each post record in ``msg`` that passes ``records`` and matches)."""
+    repo, recs = post_records(msg)
+    out: List[Tuple[str, str, str, int]] = []
+    for rkey, cid, rec in recs:
+        # metadata checks first: they cost a few dict lookups, the text work below does not
+        if records is not None and not records.admit(rec):
+            continue
+        raw_text = rec.get("text", "")
+        # keywords are checked on the raw text first so most records skip clean_text entirely
+        if matcher and not matcher.matches(raw_text):
+            continue
+        text = clean_text(raw_text)
+        if not text:
+            continue
+        if matcher and not matcher.matches(text):
+            continue
+        out.append((rkey, cid, text, iso_to_epoch(rec.get("createdAt") or rec.get("indexedAt"))))
+    return repo, out
@@ -0,0 +1,160 @@
+"""Pooled, rate-limit-aware HTTP for Bluesky XRPC calls."""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from atproto_client.exceptions import InvokeTimeoutError, NetworkError, RequestErrorBase
+from atproto_client.request import Request, RequestBase
+from loguru import logger
+
+from .config import BlueskyCfg
+from .metrics import HTTP_RETRIES
+from .ratelimit import TokenBucket, backoff_delay, retry_after
+
+try:  # HTTP/2 needs the optional h2 package
+    import h2  # noqa: F401
+
+    HTTP2 = True
+except ImportError:  # pragma: no cover - HTTP/1.1 keep-alive still applies
+    HTTP2 = False
+
+
+USER_AGENT = "bsrag/1.0 (+https://local)"
+
+
+def _retryable(status: Optional[int]) -> bool:
+    return status is None or status == 429 or status >= 500
+
+
+class XrpcHttp:
+    """One keep-alive connection pool (HTTP/2 when available) shared by every Bluesky request.
+
+    Requests are paced by one ``TokenBucket`` per host and rate-limit policy,
+    which follows the ``ratelimit-*`` headers of its responses. Bluesky limits
+    some endpoints (createSession allows 30 per 5 minutes) separately from
+    the host-wide quota, so each endpoint is mapped to the bucket of the
+    ``ratelimit-policy`` it last answered with and a tight endpoint never
+    slows the others. 429s, 5xx and
+    transport errors are retried with full-jitter backoff, waiting at least
+    as long as Retry-After or the rate-limit reset asks.
+    """
+
+    def __init__(self, cfg: BlueskyCfg):
+        self.rate = cfg.http_rps
+        self.retries = cfg.http_retries
+        self.client = httpx.Client(
+            http2=HTTP2,
+            timeout=cfg.http_timeout,
+            limits=httpx.Limits(max_connections=cfg.http_pool, max_keepalive_connections=cfg.http_pool),
+            headers={"User-Agent": USER_AGENT},
+            follow_redirects=True,
+        )
+        self._buckets: Dict[str, TokenBucket] = {}
+        # endpoint (host + path) -> bucket key of the rate-limit policy it answered with
+        self._policies: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> TokenBucket:
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                b = self._buckets[key] = TokenBucket(self.rate)
+            return b
+
+    def bucket(self, url: str) -> TokenBucket:
+        """Bucket of the policy this endpoint last answered with; the host's until it has answered."""
+        parts = urlsplit(url)
+        return self._get(self._policies.get(parts.netloc + parts.path, parts.netloc))
+
+    def update(self, url: str, headers: Mapping[str, str]) -> None:
+        """Feed a response's ``ratelimit-*`` headers to the bucket of the policy they describe."""
+        parts = urlsplit(url)
+        key = parts.netloc
+        policy = headers.get("ratelimit-policy")
+        if policy:
+            key = f"{parts.netloc} {policy}"
+            with self._lock:
+                self._policies[parts.netloc + parts.path] = key
+        self._get(key).update(headers)
+
+    def backoff(self, url: str, attempt: int, status: Optional[int], headers: Dict[str, str]) -> None:
+        """Sleep before retry ``attempt``; a 429 also stalls every other caller of that host."""
+        host = urlsplit(url).netloc
+        delay = backoff_delay(attempt, floor=retry_after(headers))
+        if status == 429:
+            self.bucket(url).on_throttle(delay)
+        HTTP_RETRIES.inc(host=host, status=str(status or "error"))
+        logger.warning(f"{host} answered {status or 'no response'}; retry {attempt + 1}/{self.retries} in {delay:.1f}s")
+        time.sleep(delay)
+
+    def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            self.bucket(url).acquire()
+            try:
+                resp = self.client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+                self.backoff(url, attempt, None, {})
+                continue
+            self.update(url, resp.headers)
+            if not _retryable(resp.status_code) or attempt >= self.retries:
+                return resp
+            self.backoff(url, attempt, resp.status_code, dict(resp.headers))
+        return resp
+
+    def get_json(self, url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None) -> Any:
+        resp = self.request("GET", url, params=params, headers=headers)
+        resp.raise_for_status()
+        return resp.json()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {
+            key: {"rate": round(b.rate, 2), "remaining": b.remaining, "throttled": b.throttled}
+            for key, b in buckets.items()
+        }
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class PacedRequest(Request):
+    """atproto transport that sends through ``XrpcHttp``'s pool, buckets and retry policy."""
+
+    def __init__(self, http: XrpcHttp):
+        RequestBase.__init__(self)
+        self._http = http
+        self._client = http.client
+        self._client_kwargs = {}
+
+    def _new_instance(self) -> "PacedRequest":
+        return type(self)(self._http)
+
+    def _send_request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        for attempt in range(self._http.retries + 1):
+            self._http.bucket(url).acquire()
+            try:
+                # the base class pops ``headers``, so each attempt gets its own kwargs
+                resp = super()._send_request(method, url, **dict(kwargs))
+            except (NetworkError, InvokeTimeoutError, RequestErrorBase) as e:
+                response = getattr(e, "response", None)
+                status = getattr(response, "status_code", None)
+                headers = getattr(response, "headers", None) or {}
+                self._http.update(url, headers)
+                if attempt >= self._http.retries or not _retryable(status):
+                    raise
+                self._http.backoff(url, attempt, status, headers)
+                continue
+            self._http.update(url, resp.headers)
+            return resp
+
+    def close(self) -> None:
+        # the pool belongs to XrpcHttp
+        pass
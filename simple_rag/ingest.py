@@ -3,148 +3,490 @@
 from __future__ import annotations
 
 import asyncio
-import json
+import os
+import threading
 import time
-from typing import List, Optional, Dict
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
 
 import websockets
 from loguru import logger
 
 from .bluesky import BSky
-from .config import AppCfg
-from .utils import Post, clean_text, extract_keywords
+from .cache import DIDCache
+from .config import AppCfg, IngestCfg
+from .filters import AuthorCap, RecordFilter
+from .firehose import FrameFilter, extract_posts, post_uri, zstd_decompressor
+from .metrics import INGEST_DROPPED, JETSTREAM_POSTS
+from .utils import KeywordMatcher, PostBatch, PostLike, PostView, extract_keywords
+from .workers import DecodedBatch, FrameDecoder, shared_pool
 
+if TYPE_CHECKING:
+    from .rag import SimpleRAG
 
-JETSTREAM_URL = "wss://jetstream2.us-east.bsky.network/subscribe?wantedCollections=app.bsky.feed.post"
 
+def _csv(value: str) -> List[str]:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
 
-class DIDCache:
-    def __init__(self, bs: BSky, ttl_sec: int = 3600):
+
+def subscribe_url(base: str, cfg: IngestCfg, cursor_us: Optional[int] = None, compress: bool = False) -> str:
+    """``base`` with the configured subscription options; options already in ``base`` are kept as they are."""
+    parts = urlsplit(base)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k not in ("cursor", "compress")]
+    present = {k for k, _ in query}
+    if "wantedCollections" not in present:
+        query += [("wantedCollections", c) for c in _csv(cfg.wanted_collections)]
+    if "wantedDids" not in present:
+        query += [("wantedDids", d) for d in _csv(cfg.wanted_dids)]
+    if cfg.max_message_size > 0 and "maxMessageSizeBytes" not in present:
+        query.append(("maxMessageSizeBytes", str(cfg.max_message_size)))
+    if compress:
+        query.append(("compress", "true"))
+    if cursor_us:
+        query.append(("cursor", str(cursor_us)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class JetstreamEndpoints:
+    """Subscribe URLs for the configured Jetstream instances, failing over from one to the next.
+
+    ``JETSTREAM_URL`` pins a single endpoint; otherwise one is built per host
+    in ``JETSTREAM_HOSTS``. zstd compression is only requested when frames
+    can actually be decompressed here.
+    """
+
+    def __init__(self, cfg: IngestCfg):
+        self.cfg = cfg
+        self.bases = [cfg.jetstream_url] if cfg.jetstream_url else [f"wss://{h}/subscribe" for h in _csv(cfg.jetstream_hosts)]
+        self.current = 0
+        self.zstd_dict = cfg.zstd_dict_path if cfg.compress and zstd_decompressor(cfg.zstd_dict_path) is not None else None
+
+    def frame_filter(self, matcher: KeywordMatcher, deletes: bool = False) -> FrameFilter:
+        return FrameFilter(matcher, zstd_dict=self.zstd_dict, records=RecordFilter.from_cfg(self.cfg), deletes=deletes)
+
+    def url(self, cursor_us: Optional[int] = None) -> str:
+        return subscribe_url(self.bases[self.current], self.cfg, cursor_us, compress=self.zstd_dict is not None)
+
+    def failed(self) -> None:
+        """Move on to the next host after a failed or dropped connection."""
+        if len(self.bases) > 1:
+            self.current = (self.current + 1) % len(self.bases)
+            logger.info(f"Jetstream failing over to {urlsplit(self.bases[self.current]).netloc}")
+
+
+class DIDResolver:
+    """Resolves repo DIDs to handles without blocking the event loop.
+
+    Posts are handed over with their DID as the author and enriched in place
+    once the handle is known. Unknown DIDs are queued and resolved in batches
+    of up to 25 through ``app.bsky.actor.getProfiles`` on a worker thread.
+    Results go to the shared ``DIDCache``; the queue belongs to one event loop.
+    """
+
+    BATCH = 25
+
+    def __init__(self, bs: BSky, cache: DIDCache, flush_interval: float = 0.5):
         self.bs = bs
-        self.ttl = ttl_sec
-        self.cache: Dict[str, Dict[str, str]] = {}
-        self.times: Dict[str, float] = {}
-
-    def get(self, did: str) -> Dict[str, str]:
-        now = time.time()
-        if did in self.cache and now - self.times.get(did, 0) < self.ttl:
-            return self.cache[did]
-        # Resolve via profile
+        self.cache = cache
+        self.flush_interval = flush_interval
+        self.lookups = 0
+        self.resolved = 0
+        self.failed = 0
+        self._pending: "OrderedDict[str, List[PostLike]]" = OrderedDict()
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    def lookup(self, did: str) -> Optional[Tuple[str, str]]:
+        return self.cache.lookup(did)
+
+    def enrich(self, post: PostLike, did: Optional[str]) -> None:
+        """Fill in handle/display name now if known, otherwise once resolution finishes."""
+        self.lookups += 1
+        if not did:
+            return
+        known = self.lookup(did)
+        if known is not None:
+            post.author, post.author_display_name = known
+            return
+        self._pending.setdefault(did, []).append(post)
+        if self._wake is not None and len(self._pending) >= self.BATCH:
+            self._wake.set()
+
+    def _resolve_batch(self, dids: List[str]) -> Optional[Dict[str, Tuple[str, str]]]:
+        try:
+            resp = self.bs._call(self.bs.client.get_profiles, actors=dids)
+        except Exception as e:
+            logger.warning(f"DID batch resolution failed: {e}")
+            return None
+        out: Dict[str, Tuple[str, str]] = {}
+        for prof in getattr(resp, "profiles", None) or []:
+            handle = getattr(prof, "handle", None) or prof.did
+            out[prof.did] = (handle, getattr(prof, "display_name", None) or handle)
+        self.cache.put_many(out)
+        return out
+
+    async def flush(self) -> None:
+        """Resolve everything queued so far."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        while self._pending:
+            dids = list(self._pending)[: self.BATCH]
+            found = await asyncio.to_thread(self._resolve_batch, dids)
+            for did in dids:
+                posts = self._pending.pop(did, [])
+                if found is None:
+                    # transient failure: posts keep their DID, the next sighting retries
+                    self.failed += 1
+                    continue
+                if did in found:
+                    handle, display = found[did]
+                    self.resolved += 1
+                else:
+                    # deleted/suspended accounts keep their DID; remember that so we do not ask again
+                    handle, display = did, did
+                    self.failed += 1
+                    self.cache.remember(did, handle, display)
+                for p in posts:
+                    p.author, p.author_display_name = handle, display
+
+    async def drain(self, timeout: float = 5.0) -> None:
         try:
-            prof = self.bs.client.get_profile(actor=did)
-            handle = getattr(prof, 'handle', did)
-            display = getattr(prof, 'display_name', handle)
-        except Exception:
-            handle = did
-            display = did
-        self.cache[did] = {"handle": handle, "display": display}
-        self.times[did] = now
-        return self.cache[did]
-
-
-async def stream_posts(cfg: AppCfg, keywords: Optional[str], max_posts: Optional[int], minutes: Optional[int]) -> List[Post]:
-    bs = BSky(cfg.bluesky)
-    if not bs.login():
+            await asyncio.wait_for(self.flush(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"DID resolution still pending for {len(self._pending)} authors")
+
+    async def run(self) -> None:
+        """Background loop: resolve queued DIDs every ``flush_interval`` or once a batch is full."""
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._pending:
+                await self.flush()
+
+
+def posts_from_message(
+    msg: Dict[str, Any],
+    matcher: KeywordMatcher,
+    resolver: DIDResolver,
+    batch: Optional[PostBatch] = None,
+    records: Optional[RecordFilter] = None,
+) -> List[PostView]:
+    """Append the matching posts of one message to ``batch`` (a fresh one when omitted) and return their rows."""
+    repo, found = extract_posts(msg, matcher, records)
+    if not found:
+        return []
+    if batch is None:
+        batch = PostBatch()
+    return [add_post(batch, resolver, repo, rkey, cid, text, created_ts) for rkey, cid, text, created_ts in found]
+
+
+def add_post(batch: PostBatch, resolver: DIDResolver, repo: Optional[str], rkey: str, cid: str, text: str, created_ts: int) -> PostView:
+    p = batch.append(
+        post_uri(repo, rkey),
+        # without an rkey the URI is not the post's own, so it must not look stable
+        cid if rkey else "",
+        repo or "unknown",
+        repo or "unknown",
+        text,
+        created_ts,
+    )
+    resolver.enrich(p, repo)
+    return p
+
+
+def open_did_cache(cfg: AppCfg) -> DIDCache:
+    return DIDCache(os.path.join(cfg.cache.dir, "dids.sqlite"), ttl_sec=cfg.cache.did_ttl, max_entries=cfg.cache.did_max_entries)
+
+
+async def stream_posts(
+    cfg: AppCfg,
+    keywords: Optional[str],
+    max_posts: Optional[int],
+    minutes: Optional[int],
+    bs: Optional[BSky] = None,
+    stop: Optional[threading.Event] = None,
+    dids: Optional[DIDCache] = None,
+) -> PostBatch:
+    """Collect matching posts from Jetstream; pass the caller's ``dids`` cache to reuse resolved handles."""
+    if bs is None:
+        bs = BSky(cfg.bluesky)
+    if not bs.authenticated and not bs.login():
         raise RuntimeError("Bluesky auth failed for Jetstream ingestion")
-    did_cache = DIDCache(bs)
+    if dids is not None:
+        return await _stream_posts(cfg, keywords, max_posts, minutes, DIDResolver(bs, dids), stop)
+    dids = open_did_cache(cfg)
+    try:
+        return await _stream_posts(cfg, keywords, max_posts, minutes, DIDResolver(bs, dids), stop)
+    finally:
+        dids.close()
 
-    terms = extract_keywords(keywords, max_terms=10) if keywords else []
-    collected: List[Post] = []
+
+async def _stream_posts(cfg: AppCfg, keywords: Optional[str], max_posts: Optional[int], minutes: Optional[int], resolver: DIDResolver, stop: Optional[threading.Event]) -> PostBatch:
+    resolver_task = asyncio.create_task(resolver.run())
+
+    matcher = KeywordMatcher(extract_keywords(keywords, max_terms=10) if keywords else [])
+    endpoints = JetstreamEndpoints(cfg.ingest)
+    frames = endpoints.frame_filter(matcher)
+    decoder = FrameDecoder(frames, shared_pool(cfg.ingest))
+    cap = AuthorCap.from_cfg(cfg.ingest)
+    collected = PostBatch()
+
+    def keep(ready: List[DecodedBatch]) -> None:
+        for decoded in ready:
+            kept = 0
+            for repo, rkey, cid, text, created_ts, _ in decoded.rows():
+                if cap is not None and not cap.allow(repo):
+                    continue
+                add_post(collected, resolver, repo, rkey, cid, text, created_ts)
+                kept += 1
+            if kept:
+                JETSTREAM_POSTS.inc(kept, consumer="request")
     deadline = time.time() + (minutes * 60) if minutes else None
 
     attempts = 0
+    def done() -> bool:
+        return bool(
+            (max_posts and len(collected) >= max_posts)
+            or (deadline and time.time() > deadline)
+            or (stop is not None and stop.is_set())
+        )
+
     while True:
-        if max_posts and len(collected) >= max_posts:
-            break
-        if deadline and time.time() > deadline:
+        if done():
             break
         if attempts > 3:
             break
         attempts += 1
-        logger.info(f"Connecting to Jetstream: {JETSTREAM_URL} (attempt {attempts})")
+        url = endpoints.url()
+        logger.info(f"Connecting to Jetstream: {url} (attempt {attempts})")
         try:
             async with websockets.connect(
-                JETSTREAM_URL,
+                url,
                 ping_interval=20,
                 ping_timeout=20,
                 close_timeout=10,
                 max_queue=1024,
             ) as ws:
-                while True:
-                    if max_posts and len(collected) >= max_posts:
-                        break
-                    if deadline and time.time() > deadline:
-                        break
+                while not done():
                     try:
-                        raw = await asyncio.wait_for(ws.recv(), timeout=30)
+                        raw = await asyncio.wait_for(ws.recv(decode=False), timeout=decoder.timeout(30))
                     except asyncio.TimeoutError:
+                        keep(await decoder.flush())
                         continue
                     except Exception as e:
                         logger.warning(f"WebSocket recv error: {e}")
                         break
-                    try:
-                        msg = json.loads(raw)
-                    except Exception:
-                        continue
-
-                    # Expect a commit-like structure with op(s) and record
-                    commit = msg.get("commit") or msg
-                    repo = commit.get("repo") or msg.get("repo")
-                    ops = commit.get("ops") or commit.get("operations") or []
-                    record = commit.get("record") or msg.get("record")
-
-                    if not ops and not record:
-                        # Some Jetstream variants include 'kind' and 'evt' fields; skip if no record
-                        continue
-
-                    # Try to build posts from operations
-                    texts: List[Dict] = []
-                    if record and isinstance(record, dict) and record.get("$type", "").endswith("app.bsky.feed.post"):
-                        texts.append(record)
-                    for op in ops:
-                        if not isinstance(op, dict):
-                            continue
-                        path = op.get("path", "")
-                        if "app.bsky.feed.post" in path and (op.get("action") or op.get("op")) == "create":
-                            rec = op.get("record") or record
-                            if isinstance(rec, dict) and rec.get("text"):
-                                texts.append(rec)
-
-                    for rec in texts:
-                        text = clean_text(rec.get("text", ""))
-                        if not text:
-                            continue
-                        if terms:
-                            tl = text.lower()
-                            if not any(t.lstrip('#@') in tl for t in terms):
-                                continue
-                        try:
-                            created_at = rec.get("createdAt") or rec.get("indexedAt")
-                            from datetime import datetime, timezone
-                            if created_at:
-                                created_dt = datetime.fromisoformat(str(created_at).replace("Z", "+00:00"))
-                            else:
-                                created_dt = datetime.now(timezone.utc)
-                        except Exception:
-                            from datetime import datetime, timezone
-                            created_dt = datetime.now(timezone.utc)
-
-                        author_meta = did_cache.get(repo) if repo else {"handle": repo or "unknown", "display": repo or "unknown"}
-                        p = Post(
-                            uri=f"at://{repo}/app.bsky.feed.post/unknown",
-                            cid="",
-                            author=author_meta["handle"],
-                            author_display_name=author_meta["display"],
-                            text=text,
-                            created_at=created_dt,
-                        )
-                        collected.append(p)
-                        if max_posts and len(collected) >= max_posts:
-                            break
+                    keep(await decoder.push(raw))
         except Exception as e:
             logger.warning(f"Jetstream connect error: {e}")
+            endpoints.failed()
             await asyncio.sleep(0.5)
             continue
+        if not done():
+            endpoints.failed()
 
-    logger.info(f"Jetstream collected {len(collected)} posts")
+    # frames still with the workers when the stream stopped
+    keep(await decoder.flush(wait=True))
+    resolver_task.cancel()
+    await resolver.drain()
+    if max_posts and len(collected) > max_posts:
+        collected = collected.take(range(max_posts))
+    drops = dict(frames.records.drops) if frames.records is not None else {}
+    if cap is not None:
+        drops["author_cap"] = cap.dropped
+    logger.info(
+        f"Jetstream collected {len(collected)} posts ({frames.rejected}/{frames.frames} frames rejected before decoding, "
+        f"{frames.bytes_in / 1024:.0f} KiB received, {frames.bytes_out / 1024:.0f} KiB decompressed; "
+        f"filtered {', '.join(f'{k}={n}' for k, n in drops.items() if n) or 'none'})"
+    )
     return collected
+
+
+class IngestDaemon:
+    """Long-running Jetstream consumer that keeps the store fresh.
+
+    A reader task decodes events into a bounded queue (it stops reading when the
+    queue is full, so backpressure reaches the socket) and a writer task drains
+    it in micro-batches through ``SimpleRAG.ingest_posts``. The ``time_us``
+    cursor is persisted only after the events before it are stored, and a
+    restart resumes from it, rewound slightly so no event is skipped.
+    """
+
+    def __init__(self, rag: "SimpleRAG", keywords: Optional[str] = None):
+        self.rag = rag
+        self.cfg = rag.cfg.ingest
+        self.matcher = KeywordMatcher(extract_keywords(keywords, max_terms=10) if keywords else [])
+        self.endpoints = JetstreamEndpoints(self.cfg)
+        # the daemon keeps a persistent store, so it also follows post deletions
+        self.frames = self.endpoints.frame_filter(self.matcher, deletes=True)
+        self.decoder = FrameDecoder(self.frames, shared_pool(self.cfg))
+        self.cap = AuthorCap.from_cfg(self.cfg)
+        self.resolver = DIDResolver(rag.bs, rag.dids)
+        # (time_us, post to store, or URI of a deleted post)
+        self.queue: "asyncio.Queue[Tuple[int, Union[PostView, str]]]" = asyncio.Queue(maxsize=self.cfg.queue_size)
+        self.cursor_us: Optional[int] = self._load_cursor()
+        self.last_seen_us: Optional[int] = self.cursor_us
+        self.events = 0
+        self.posts = 0
+        self.chunks = 0
+        self.deleted = 0
+        # newest cursor that may be persisted once a batch was dropped: everything after it replays on restart
+        self._cursor_hold: Optional[int] = None
+        self._stopping = False
+
+    def _load_cursor(self) -> Optional[int]:
+        try:
+            with open(self.cfg.cursor_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _save_cursor(self, cursor_us: Optional[int]) -> None:
+        if cursor_us and self._cursor_hold is not None:
+            cursor_us = min(cursor_us, self._cursor_hold)
+        if not cursor_us or (self.cursor_us and cursor_us <= self.cursor_us):
+            return
+        os.makedirs(os.path.dirname(self.cfg.cursor_path) or ".", exist_ok=True)
+        tmp = self.cfg.cursor_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(cursor_us))
+        os.replace(tmp, self.cfg.cursor_path)
+        self.cursor_us = cursor_us
+
+    def _url(self) -> str:
+        if not self.cursor_us:
+            return self.endpoints.url()
+        return self.endpoints.url(max(1, self.cursor_us - int(self.cfg.cursor_rewind_sec * 1_000_000)))
+
+    async def _reader(self) -> None:
+        backoff = 1.0
+        while not self._stopping:
+            url = self._url()
+            logger.info(f"ingest-daemon connecting: {url}")
+            try:
+                async with websockets.connect(url, ping_interval=20, ping_timeout=20, close_timeout=10, max_queue=1024) as ws:
+                    backoff = 1.0
+                    while not self._stopping:
+                        try:
+                            raw = await asyncio.wait_for(ws.recv(decode=False), timeout=self.decoder.timeout(None))
+                        except asyncio.TimeoutError:
+                            ready = await self.decoder.flush()
+                        else:
+                            self.events += 1
+                            ready = await self.decoder.push(raw)
+                        for decoded in ready:
+                            posts = PostBatch()
+                            for repo, rkey, cid, text, created_ts, time_us in decoded.rows():
+                                if self.cap is not None and not self.cap.allow(repo):
+                                    continue
+                                p = add_post(posts, self.resolver, repo, rkey, cid, text, created_ts)
+                                # blocks while the writer is behind
+                                await self.queue.put((time_us, p))
+                                JETSTREAM_POSTS.inc(consumer="daemon")
+                            # deletes queue behind the posts they may remove, so a post never outlives its delete
+                            for uri, time_us in decoded.deleted:
+                                await self.queue.put((time_us, uri))
+                            # frames still buffered or with a worker stay behind the cursor
+                            if decoded.last_time_us:
+                                self.last_seen_us = decoded.last_time_us
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"ingest-daemon connection lost: {e}; reconnecting in {backoff:.0f}s")
+                self.endpoints.failed()
+            if not self._stopping:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+
+    async def _next_batch(self) -> List[Tuple[int, Union[PostView, str]]]:
+        batch: List[Tuple[int, Union[PostView, str]]] = []
+        try:
+            batch.append(await asyncio.wait_for(self.queue.get(), timeout=self.cfg.flush_interval))
+        except asyncio.TimeoutError:
+            return batch
+        flush_at = time.monotonic() + self.cfg.flush_interval
+        while len(batch) < self.cfg.batch_size:
+            remaining = flush_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _writer(self) -> None:
+        while not self._stopping or not self.queue.empty():
+            seen_before = self.last_seen_us
+            batch = await self._next_batch()
+            if not batch:
+                # Everything read so far has been handled (filtered out or stored)
+                if self.queue.empty():
+                    self._save_cursor(seen_before)
+                continue
+            # give in-flight handle lookups a moment so stored metadata carries handles
+            await self.resolver.drain(timeout=self.cfg.flush_interval)
+            # resolved handles were written into the per-message rows, so copy them only now
+            posts = PostBatch.from_posts(p for _, p in batch if not isinstance(p, str))
+            # within a batch deletes apply after writes, which also covers a post created and deleted in it
+            deleted = [p for _, p in batch if isinstance(p, str)]
+            added = None
+            for attempt in range(3):
+                try:
+                    added = await asyncio.to_thread(self.rag.ingest_posts, posts, deleted)
+                    break
+                except Exception as e:
+                    logger.error(f"ingest-daemon batch failed (attempt {attempt + 1}): {e}")
+                    await asyncio.sleep(2 ** attempt)
+            if added is None:
+                # the cursor stops short of the dropped batch, so a restart replays it (writes are idempotent)
+                hold = min(t for t, _ in batch) - 1
+                self._cursor_hold = hold if self._cursor_hold is None else min(self._cursor_hold, hold)
+                logger.error(f"ingest-daemon dropped a batch of {len(posts)} posts; cursor held at {self._cursor_hold} until restart")
+                INGEST_DROPPED.inc(len(posts))
+                added = 0
+            self.posts += len(posts)
+            self.chunks += added
+            self.deleted += len(deleted)
+            self._save_cursor(max(t for t, _ in batch))
+            logger.info(
+                f"ingest-daemon stored {added} chunks from {len(posts)} posts, applied {len(deleted)} deletes "
+                f"(events={self.events}, queued={self.queue.qsize()})"
+            )
+
+    async def _compactor(self) -> None:
+        interval = self.rag.cfg.chroma.compact_interval
+        if interval <= 0:
+            return
+        while not self._stopping:
+            try:
+                await asyncio.to_thread(self.rag.compact)
+            except Exception as e:
+                logger.warning(f"ingest-daemon compaction failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def run(self) -> None:
+        if not self.rag.bs.authenticated and not self.rag.bs.login():
+            raise RuntimeError("Bluesky auth failed for Jetstream ingestion")
+        reader = asyncio.create_task(self._reader())
+        writer = asyncio.create_task(self._writer())
+        resolver = asyncio.create_task(self.resolver.run())
+        compactor = asyncio.create_task(self._compactor())
+        try:
+            await asyncio.gather(reader, writer, resolver, compactor)
+        finally:
+            # The cursor only covers stored batches, so queued posts are replayed on restart
+            self._stopping = True
+            reader.cancel()
+            writer.cancel()
+            resolver.cancel()
+            compactor.cancel()
@@ -0,0 +1,202 @@
+"""Incremental in-memory BM25 index over stored chunks for simple RAG."""
+
+from __future__ import annotations
+
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from loguru import logger
+
+from .store import chunk_id
+from .utils import Chunk, ChunkBatch, extract_keywords
+
+
+TOKEN_RE = re.compile(r"#\w+|@\w+|\w+")
+
+
+def tokenize(text: str, author: str = "") -> List[str]:
+    """Lowercased tokens; ``#tag``/``@name`` also index their bare word, the author indexes as ``@name``."""
+    tokens: List[str] = []
+    for t in TOKEN_RE.findall(text.lower()):
+        tokens.append(t)
+        if t[0] in "#@" and len(t) > 1:
+            tokens.append(t[1:])
+    if author:
+        tokens.append("@" + author.lower().split(".")[0])
+    return tokens
+
+
+def required_terms(terms: Sequence[str]) -> List[str]:
+    """Hashtags and handles are what a query is really about; otherwise every keyword counts."""
+    tagged = [t for t in terms if t[0] in "#@"]
+    return tagged or list(terms)
+
+
+@dataclass
+class LexicalHits:
+    # (score, document, metadata), best first
+    hits: List[Tuple[float, str, Dict[str, Any]]] = field(default_factory=list)
+    # a #tag/@handle query whose tags enough hits contain: answerable without vector search
+    strong: bool = False
+
+
+def rrf_fuse(rankings: Iterable[List[tuple]], n: int, k: int = 60) -> List[tuple]:
+    """Reciprocal-rank fusion of rankings of (document, metadata, ...) tuples, keyed on chunk id."""
+    scores: Dict[str, float] = {}
+    items: Dict[str, tuple] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            meta = item[1]
+            key = chunk_id(meta.get("uri", ""), meta.get("chunk_index", 0))
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            items.setdefault(key, item)
+    best = sorted(scores, key=scores.get, reverse=True)[:n]
+    return [items[key] for key in best]
+
+
+class LexicalIndex:
+    """BM25 (k1=1.2, b=0.75) over chunk texts, updated as chunks are stored.
+
+    Holds the newest ``max_docs`` chunks with their document and metadata, so
+    lexical hits can be returned without touching the vector store. Oldest
+    chunks (by insertion) are evicted first.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, max_docs: int = 100_000, min_hits: int = 3):
+        self.max_docs = max_docs
+        self.min_hits = min_hits
+        # chunk id -> (term counts, length, created_at_ts, document, metadata)
+        self._docs: "OrderedDict[str, tuple]" = OrderedDict()
+        self._postings: Dict[str, Dict[str, int]] = {}
+        # post URI -> ids of its indexed chunks
+        self._by_uri: Dict[str, set] = {}
+        self._total_len = 0
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.strong_searches = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, doc_id: str, document: str, meta: Dict[str, Any]) -> None:
+        tf = Counter(tokenize(document, meta.get("author", "")))
+        if not tf:
+            return
+        with self._lock:
+            if doc_id in self._docs:
+                return
+            length = sum(tf.values())
+            self._docs[doc_id] = (tf, length, float(meta.get("created_at_ts", 0.0)), document, meta)
+            self._total_len += length
+            for term, n in tf.items():
+                self._postings.setdefault(term, {})[doc_id] = n
+            self._by_uri.setdefault(meta.get("uri", ""), set()).add(doc_id)
+            while len(self._docs) > self.max_docs:
+                self._remove(next(iter(self._docs)))
+
+    def add_chunks(self, chunks: Union[ChunkBatch, List[Chunk]], embeddings: Optional[List[Optional[List[float]]]] = None) -> None:
+        """Index chunks that were stored (those with an embedding, when given)."""
+        chunks = ChunkBatch.from_chunks(chunks)
+        if embeddings is not None:
+            chunks = chunks.take([i for i, vec in enumerate(embeddings[: len(chunks)]) if vec is not None])
+        for doc_id, text, meta in zip(chunks.ids(), chunks.texts, chunks.metadatas()):
+            self.add(doc_id, text, meta)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._by_uri.clear()
+            self._total_len = 0
+
+    def remove_posts(self, uris: Iterable[str]) -> int:
+        """Drop every indexed chunk of the given post URIs (deleted or about to be rewritten)."""
+        removed = 0
+        with self._lock:
+            for uri in uris:
+                for doc_id in list(self._by_uri.get(uri, ())):
+                    self._remove(doc_id)
+                    removed += 1
+        return removed
+
+    def _remove(self, doc_id: str) -> None:
+        tf, length, _, _, meta = self._docs.pop(doc_id)
+        uri = meta.get("uri", "")
+        ids = self._by_uri.get(uri)
+        if ids is not None:
+            ids.discard(doc_id)
+            if not ids:
+                del self._by_uri[uri]
+        self._total_len -= length
+        for term in tf:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[term]
+
+    def reload(self, rows: Iterable[Tuple[str, str, Dict[str, Any], Any]]) -> int:
+        """Rebuild from ``VectorStore.scan`` rows off-lock, then swap the result in; counters are kept."""
+        fresh = LexicalIndex(max_docs=self.max_docs, min_hits=self.min_hits)
+        n = fresh.load(rows)
+        with self._lock:
+            self._docs, self._postings, self._by_uri = fresh._docs, fresh._postings, fresh._by_uri
+            self._total_len = fresh._total_len
+        return n
+
+    def load(self, rows: Iterable[Tuple[str, str, Dict[str, Any], Any]]) -> int:
+        """Bulk-index ``VectorStore.scan`` rows."""
+        started = time.perf_counter()
+        n = 0
+        for doc_id, document, meta, _ in rows:
+            self.add(doc_id, document, meta)
+            n += 1
+        logger.info(f"lexical index loaded {n} chunks in {time.perf_counter() - started:.1f}s")
+        return n
+
+    def search(self, query: str, n: int = 10, since: Optional[float] = None) -> LexicalHits:
+        terms = extract_keywords(query, max_terms=8)
+        if not terms:
+            return LexicalHits()
+        required = set(required_terms(terms))
+        # plain keyword queries always go through fusion with vector results
+        tagged = any(t[0] in "#@" for t in terms)
+        scores: Dict[str, float] = {}
+        matched: Dict[str, int] = {}
+        with self._lock:
+            self.searches += 1
+            total = len(self._docs)
+            if not total:
+                return LexicalHits()
+            avg_len = self._total_len / total
+            for term in terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1.0 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    entry = self._docs[doc_id]
+                    if since is not None and entry[2] < since:
+                        continue
+                    norm = tf + self.K1 * (1.0 - self.B + self.B * entry[1] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.K1 + 1.0) / norm
+                    if term in required:
+                        matched[doc_id] = matched.get(doc_id, 0) + 1
+            best = sorted(scores, key=scores.get, reverse=True)[:n]
+            hits = [(scores[d], self._docs[d][3], self._docs[d][4]) for d in best]
+        complete = sum(1 for d in best if matched.get(d, 0) == len(required))
+        strong = tagged and complete >= min(self.min_hits, n)
+        if strong:
+            self.strong_searches += 1
+        return LexicalHits(hits=hits, strong=strong)
+
+    def stats(self) -> Dict[str, int]:
+        return {"docs": len(self._docs), "terms": len(self._postings), "searches": self.searches, "strong": self.strong_searches}
@@ -0,0 +1,211 @@
+"""Timing spans, counters and histograms for simple RAG, rendered in Prometheus text format."""
+
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+# seconds; spans range from sub-millisecond store lookups to multi-minute Jetstream fallbacks
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 180.0)
+
+# (name, type, help, labels, value) produced by a collector at scrape time
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, key)} {_num(v)}" for key, v in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if i < len(self.buckets):
+                entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = 'le="%s"' % _num(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, inf)} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(round(total, 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Process-wide metrics plus collectors that report existing component stats at scrape time."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, fn: Callable[[], Iterable[Sample]]) -> None:
+        with self._lock:
+            self._collectors.append(fn)
+
+    def unregister_collector(self, fn: Callable[[], Iterable[Sample]]) -> None:
+        with self._lock:
+            if fn in self._collectors:
+                self._collectors.remove(fn)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for m in metrics:
+            lines += m.render()
+        # the exposition format wants each metric's samples together
+        families: Dict[str, List[str]] = {}
+        for fn in collectors:
+            try:
+                samples = list(fn())
+            except Exception:
+                continue
+            for name, kind, help, labels, value in samples:
+                family = families.setdefault(name, [f"# HELP {name} {help}", f"# TYPE {name} {kind}"])
+                family.append(f"{name}{_labels(list(labels), list(labels.values()))} {_num(value)}")
+        for family in families.values():
+            lines += family
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("bsrag_stage_seconds", "Duration of pipeline stages and client calls.", ["stage"])
+EMBED_REQUESTS = REGISTRY.counter("bsrag_embed_requests_total", "Embedding API requests.", ["kind"])
+EMBED_TEXTS = REGISTRY.counter("bsrag_embed_texts_total", "Texts sent to the embedding API.")
+EMBED_THROTTLED = REGISTRY.counter("bsrag_embed_throttled_total", "Embedding requests rejected with 429.")
+JETSTREAM_FRAMES = REGISTRY.counter(
+    "bsrag_jetstream_frames_total", "Jetstream frames received, by outcome (rejected and invalid frames are dropped).", ["outcome"]
+)
+JETSTREAM_BYTES = REGISTRY.counter(
+    "bsrag_jetstream_bytes_total", "Jetstream frame bytes as received (wire) and after zstd decompression.", ["stage"]
+)
+FILTER_DROPPED = REGISTRY.counter(
+    "bsrag_filter_dropped_total", "Firehose post records dropped by the metadata filter cascade, by stage.", ["stage"]
+)
+JETSTREAM_POSTS = REGISTRY.counter("bsrag_jetstream_posts_total", "Posts kept from Jetstream frames.", ["consumer"])
+HTTP_RETRIES = REGISTRY.counter("bsrag_http_retries_total", "Bluesky HTTP requests retried, by host and status.", ["host", "status"])
+INGEST_DROPPED = REGISTRY.counter("bsrag_ingest_dropped_posts_total", "Posts dropped after repeated ingest failures.")
+
+# per-request stage timings (ms) collected by span(); set only around synchronous code
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("bsrag_timings", default=None)
+
+
+def observe(stage: str, seconds: float, timings: Optional[Dict[str, float]] = None) -> None:
+    """Record one stage duration in the histogram and in ``timings`` (or the active span's timings)."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    target = timings if timings is not None else _timings.get()
+    if target is not None:
+        target[stage] = round(target.get(stage, 0.0) + seconds * 1000.0, 3)
+
+
+@contextmanager
+def span(stage: str, timings: Optional[Dict[str, float]] = None) -> Iterator[None]:
+    """Time the block as ``stage``.
+
+    With ``timings`` the block's nested spans on the same thread are recorded
+    into that dict too. Never ``yield`` from a generator inside such a span:
+    the timings context must be entered and left on the same thread.
+    """
+    token = _timings.set(timings) if timings is not None else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if token is not None:
+            _timings.reset(token)
+        observe(stage, elapsed, timings)
+
+
+def timed(stage: str) -> Callable:
+    """Decorator form of ``span``."""
+
+    def wrap(fn: Callable) -> Callable:
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+
+        return inner
+
+    return wrap
@@ -0,0 +1,356 @@
+"""In-process NumPy vector index for simple RAG."""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from loguru import logger
+
+from .config import ChromaCfg
+from .store import VectorStore, empty_result, recency_cutoff
+from .utils import Chunk, ChunkBatch
+
+
+STRING_COLS = ("uri", "cid", "author", "author_display_name", "created_at")
+NUMERIC_COLS = {
+    "created_at_ts": np.float64,
+    "reply_count": np.int32,
+    "repost_count": np.int32,
+    "like_count": np.int32,
+    "chunk_index": np.int32,
+    "chunk_total": np.int32,
+}
+# rows per block when scoring the whole matrix (keeps any float16 -> float32 upcast small)
+BLOCK_ROWS = 16384
+
+
+class NumpyStore(VectorStore):
+    """Vectors in a memory-mapped matrix, metadata in columnar arrays.
+
+    Files live under ``{db_path}/{collection}.npstore/``:
+
+    - ``vectors.bin``: unit-normalised rows (float16 or float32), memory-mapped
+    - ``rows.jsonl``: one metadata row per vector, append-only, replayed into
+      the columns at startup
+    - ``deleted.txt``: positions of deleted rows, append-only; their vectors
+      stay in the matrix but are masked out of every query and scan
+    - ``index.json``: vector dimension and dtype
+
+    Search is a matrix-vector product over the rows, with the ``created_at_ts``
+    recency filter applied as a boolean mask. Distances are squared L2 between
+    unit vectors (``2 - 2 * cosine``), nearest first, which ranks exactly like
+    Chroma's default L2 space for unit-length embeddings such as Gemini's.
+    """
+
+    def __init__(self, cfg: ChromaCfg):
+        self.cfg = cfg
+        self.dir = os.path.join(cfg.db_path, f"{cfg.collection}.npstore")
+        self._lock = threading.RLock()
+        self._open()
+
+    # -- layout -----------------------------------------------------------
+
+    @property
+    def _vec_path(self) -> str:
+        return os.path.join(self.dir, "vectors.bin")
+
+    @property
+    def _rows_path(self) -> str:
+        return os.path.join(self.dir, "rows.jsonl")
+
+    @property
+    def _deleted_path(self) -> str:
+        return os.path.join(self.dir, "deleted.txt")
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.dir, "index.json")
+
+    def _reset(self) -> None:
+        self.n = 0
+        self.dim: Optional[int] = None
+        self.dtype = np.dtype(self.cfg.numpy_dtype)
+        self.capacity = 0
+        self._vecs: Optional[np.memmap] = None
+        self.ids: List[str] = []
+        self._ids: set = set()
+        # post URI -> positions of its live rows
+        self._rows_by_uri: Dict[str, List[int]] = {}
+        self.docs: List[str] = []
+        self.strings: Dict[str, List[str]] = {k: [] for k in STRING_COLS}
+        self.numeric: Dict[str, np.ndarray] = {k: np.zeros(0, dtype=t) for k, t in NUMERIC_COLS.items()}
+        self.deleted = np.zeros(0, dtype=bool)
+        self.dead = 0
+
+    def _open(self) -> None:
+        self._reset()
+        os.makedirs(self.dir, exist_ok=True)
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.dim = int(index["dim"])
+        self.dtype = np.dtype(index["dtype"])
+        self.capacity = os.path.getsize(self._vec_path) // (self.dim * self.dtype.itemsize)
+        if self.capacity:
+            self._vecs = np.memmap(self._vec_path, dtype=self.dtype, mode="r+", shape=(self.capacity, self.dim))
+        rows: List[Dict[str, Any]] = []
+        if os.path.exists(self._rows_path):
+            with open(self._rows_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        # torn final line from a crash mid-append; its vector is ignored too
+                        break
+        rows = rows[: self.capacity]
+        self._grow_columns(max(self.capacity, len(rows)))
+        self._append_columns(
+            [r["id"] for r in rows],
+            [r["document"] for r in rows],
+            {k: [r.get(k, "" if k in STRING_COLS else 0) for r in rows] for k in (*STRING_COLS, *NUMERIC_COLS)},
+        )
+        if os.path.exists(self._deleted_path):
+            with open(self._deleted_path, "r", encoding="utf-8") as f:
+                self._kill(int(line) for line in f if line.strip().isdigit())
+            # a deleted id may have been written again later (an edited post keeps its chunk ids)
+            self._ids = {self.ids[r] for r in range(self.n) if not self.deleted[r]}
+        logger.info(f"numpy store loaded {self.n} rows from {self.dir}")
+
+    def _grow_columns(self, capacity: int) -> None:
+        for k, arr in self.numeric.items():
+            if len(arr) < capacity:
+                grown = np.zeros(capacity, dtype=arr.dtype)
+                grown[: len(arr)] = arr
+                self.numeric[k] = grown
+        if len(self.deleted) < capacity:
+            grown = np.zeros(capacity, dtype=bool)
+            grown[: len(self.deleted)] = self.deleted
+            self.deleted = grown
+
+    def _ensure_capacity(self, needed: int) -> None:
+        if needed <= self.capacity and self._vecs is not None:
+            return
+        new_cap = max(1024, self.capacity * 2, needed)
+        if self._vecs is not None:
+            self._vecs.flush()
+            self._vecs = None
+        with open(self._vec_path, "ab") as f:
+            f.truncate(new_cap * self.dim * self.dtype.itemsize)
+        self._vecs = np.memmap(self._vec_path, dtype=self.dtype, mode="r+", shape=(new_cap, self.dim))
+        self.capacity = new_cap
+        self._grow_columns(new_cap)
+
+    def _append_columns(self, ids: List[str], docs: List[str], cols: Dict[str, list]) -> None:
+        start, end = self.n, self.n + len(ids)
+        self.ids.extend(ids)
+        self._ids.update(ids)
+        for row, uri in enumerate(cols["uri"], start):
+            self._rows_by_uri.setdefault(uri, []).append(row)
+        self.docs.extend(docs)
+        for k in STRING_COLS:
+            self.strings[k].extend(cols[k])
+        for k in NUMERIC_COLS:
+            self.numeric[k][start:end] = cols[k]
+        self.n = end
+
+    def _kill(self, rows) -> int:
+        killed = 0
+        for row in rows:
+            if row >= self.n or self.deleted[row]:
+                continue
+            self.deleted[row] = True
+            self._ids.discard(self.ids[row])
+            uri = self.strings["uri"][row]
+            live = self._rows_by_uri.get(uri)
+            if live is not None:
+                live.remove(row)
+                if not live:
+                    del self._rows_by_uri[uri]
+            killed += 1
+        self.dead += killed
+        return killed
+
+    # -- VectorStore ------------------------------------------------------
+
+    def add_chunks(self, chunks: Union[ChunkBatch, List[Chunk]], embeddings: List[Optional[List[float]]]) -> int:
+        chunks = ChunkBatch.from_chunks(chunks)
+        with self._lock:
+            ids = chunks.ids()
+            keep: List[int] = []
+            seen = set()
+            for i, (doc_id, vec) in enumerate(zip(ids, embeddings)):
+                if vec is None or not chunks.texts[i].strip():
+                    continue
+                if doc_id in self._ids or doc_id in seen:
+                    continue
+                if self.dim is not None and len(vec) != self.dim:
+                    logger.error(f"numpy store: embedding dim {len(vec)} != index dim {self.dim}")
+                    continue
+                seen.add(doc_id)
+                keep.append(i)
+            if not keep:
+                return 0
+            if len(keep) < len(chunks):
+                chunks = chunks.take(keep)
+            ids = [ids[i] for i in keep]
+            mat = np.asarray([embeddings[i] for i in keep], dtype=np.float32)
+            norms = np.linalg.norm(mat, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            mat /= norms
+            if self.dim is None:
+                self.dim = mat.shape[1]
+                with open(self._index_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim, "dtype": self.dtype.name}, f)
+            self._ensure_capacity(self.n + len(ids))
+            # vectors reach disk before their rows, so every row on disk has its vector
+            self._vecs[self.n : self.n + len(ids)] = mat.astype(self.dtype)
+            self._vecs.flush()
+            cols = chunks.columns()
+            keys = ["id", "document", *cols]
+            with open(self._rows_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(dict(zip(keys, row))) + "\n" for row in zip(ids, chunks.texts, *cols.values())))
+            self._append_columns(ids, chunks.texts, cols)
+        return len(ids)
+
+    def _mask(self, n: int, recent_days: Optional[int], where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        mask: Optional[np.ndarray] = None
+
+        def both(m: np.ndarray) -> np.ndarray:
+            return m if mask is None else mask & m
+
+        if self.dead:
+            mask = ~self.deleted[:n]
+        if recent_days is not None:
+            mask = both(self.numeric["created_at_ts"][:n] >= recency_cutoff(recent_days))
+        for key, cond in (where or {}).items():
+            if key in NUMERIC_COLS:
+                col = self.numeric[key][:n]
+            elif key in STRING_COLS:
+                col = np.asarray(self.strings[key][:n], dtype=object)
+            else:
+                raise ValueError(f"unsupported where field: {key}")
+            if not isinstance(cond, dict):
+                cond = {"$eq": cond}
+            for op, val in cond.items():
+                if op == "$eq":
+                    m = col == val
+                elif op == "$in":
+                    m = np.isin(col, list(val))
+                elif op == "$gte":
+                    m = col >= val
+                elif op == "$gt":
+                    m = col > val
+                elif op == "$lte":
+                    m = col <= val
+                elif op == "$lt":
+                    m = col < val
+                else:
+                    raise ValueError(f"unsupported where operator: {op}")
+                mask = both(np.asarray(m, dtype=bool))
+        return mask
+
+    def query(self, query_vec: List[float], n: int = 10, recent_days: Optional[int] = None, where: Optional[Dict[str, Any]] = None, include_embeddings: bool = False) -> Dict[str, Any]:
+        try:
+            with self._lock:
+                rows = self.n
+                if not rows or self._vecs is None:
+                    return empty_result()
+                q = np.asarray(query_vec, dtype=np.float32)
+                norm = float(np.linalg.norm(q))
+                if q.shape[0] != self.dim or norm == 0:
+                    return empty_result()
+                q /= norm
+                mask = self._mask(rows, recent_days, where)
+                idx = None
+                if mask is not None:
+                    idx = np.nonzero(mask)[0]
+                    if not len(idx):
+                        return empty_result()
+                if idx is not None and len(idx) * 2 < rows:
+                    # selective filter: gather only the matching rows
+                    sims = self._vecs[idx].astype(np.float32, copy=False) @ q
+                else:
+                    # broad or no filter: stream the matrix in blocks, then mask
+                    sims = np.concatenate([
+                        self._vecs[s : min(s + BLOCK_ROWS, rows)].astype(np.float32, copy=False) @ q
+                        for s in range(0, rows, BLOCK_ROWS)
+                    ])
+                    if idx is not None:
+                        sims = sims[idx]
+                k = min(n, len(sims))
+                top = np.argpartition(-sims, k - 1)[:k]
+                top = top[np.argsort(-sims[top])]
+                out = empty_result()
+                if include_embeddings:
+                    out["embeddings"] = []
+                for t in top:
+                    row = int(idx[t]) if idx is not None else int(t)
+                    meta = {c: self.strings[c][row] for c in STRING_COLS}
+                    for c, typ in NUMERIC_COLS.items():
+                        v = self.numeric[c][row]
+                        meta[c] = float(v) if typ is np.float64 else int(v)
+                    out["documents"].append(self.docs[row])
+                    out["metadatas"].append(meta)
+                    out["distances"].append(float(2.0 - 2.0 * sims[t]))
+                    if include_embeddings:
+                        out["embeddings"].append(self._vecs[row].astype(np.float32).tolist())
+                out["count"] = len(out["documents"])
+                return out
+        except Exception as e:
+            logger.error(f"numpy store query error: {e}")
+            return empty_result()
+
+    def existing_cids(self, uris: List[str]) -> Dict[str, str]:
+        with self._lock:
+            cids = self.strings["cid"]
+            return {u: cids[self._rows_by_uri[u][-1]] for u in uris if u in self._rows_by_uri}
+
+    def delete_posts(self, uris: List[str]) -> int:
+        with self._lock:
+            rows = sorted({r for u in uris for r in self._rows_by_uri.get(u, ())})
+            if not rows:
+                return 0
+            with open(self._deleted_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{r}\n" for r in rows))
+            return self._kill(rows)
+
+    def count(self) -> int:
+        return self.n - self.dead
+
+    def clear(self):
+        with self._lock:
+            self._vecs = None
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self._open()
+
+    def drop(self):
+        with self._lock:
+            self._vecs = None
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self._reset()
+
+    def scan(self, include_embeddings: bool = False, since: Optional[float] = None) -> Iterator[Tuple[str, str, Dict[str, Any], Optional[List[float]]]]:
+        with self._lock:
+            rows = self.n
+        for row in range(rows):
+            if self.deleted[row] or (since is not None and self.numeric["created_at_ts"][row] < since):
+                continue
+            meta = {c: self.strings[c][row] for c in STRING_COLS}
+            for c, typ in NUMERIC_COLS.items():
+                v = self.numeric[c][row]
+                meta[c] = float(v) if typ is np.float64 else int(v)
+            vec = self._vecs[row].astype(np.float32).tolist() if include_embeddings else None
+            yield self.ids[row], self.docs[row], meta, vec
+
+    @classmethod
+    def collection_names(cls, cfg: ChromaCfg) -> List[str]:
+        if not os.path.isdir(cfg.db_path):
+            return []
+        suffix = ".npstore"
+        return [d[: -len(suffix)] for d in os.listdir(cfg.db_path) if d.endswith(suffix)]
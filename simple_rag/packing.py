@@ -0,0 +1,127 @@
+"""Token-budgeted context packing for simple RAG prompts."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field, replace
+from typing import Dict, List
+
+import numpy as np
+
+from .utils import DOC_SEPARATOR, Chunk, format_doc_for_prompt
+
+
+# documents the prompt held before packing: the first 10 retrieval hits
+BASELINE_DOCS = 10
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+def join_overlapping(a: str, b: str, max_overlap: int) -> str:
+    """Concatenate consecutive ``chunk_text`` slices, dropping the text they share."""
+    for k in range(min(len(a), len(b), max_overlap), 0, -1):
+        if a.endswith(b[:k]):
+            return a + b[k:]
+    return a + " " + b
+
+
+@dataclass
+class PackResult:
+    chunks: List[Chunk] = field(default_factory=list)
+    tokens_used: int = 0
+    # tokens of the unpacked top-10 context minus tokens_used
+    tokens_saved: int = 0
+    candidates: int = 0
+    merged: int = 0
+
+
+class ContextPacker:
+    """Chooses the prompt context from over-fetched retrieval candidates.
+
+    Candidates are ordered by maximal marginal relevance: rank-based relevance
+    (the retrieval order already blends vector and keyword scores) traded off
+    against the highest cosine similarity to anything already chosen, using the
+    stored chunk embeddings. They are then taken in that order while the
+    formatted context fits the budget, with consecutive chunks of one post
+    merged back into a single passage. The budget is ``token_budget`` capped at
+    the size of the unpacked context (the first ``BASELINE_DOCS`` candidates),
+    so packing never sends more than the prompt did without it.
+    """
+
+    def __init__(self, token_budget: int = 1000, mmr_lambda: float = 0.7, chunk_overlap: int = 40):
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.chunk_overlap = chunk_overlap
+
+    def _mmr_order(self, chunks: List[Chunk]) -> List[int]:
+        n = len(chunks)
+        relevance = 1.0 - np.arange(n) / n
+        vecs = [np.asarray(c.embedding, dtype=np.float32) if c.embedding is not None else None for c in chunks]
+        dims = {v.shape[0] for v in vecs if v is not None}
+        have = [i for i, v in enumerate(vecs) if v is not None]
+        sims = np.zeros((n, n), dtype=np.float32)
+        if have and len(dims) == 1:
+            mat = np.stack([vecs[i] for i in have])
+            norms = np.linalg.norm(mat, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            mat /= norms
+            sims[np.ix_(have, have)] = mat @ mat.T
+        redundancy = np.zeros(n, dtype=np.float32)
+        left = list(range(n))
+        order: List[int] = []
+        while left:
+            scores = [self.mmr_lambda * relevance[i] - (1.0 - self.mmr_lambda) * redundancy[i] for i in left]
+            best = left.pop(int(np.argmax(scores)))
+            order.append(best)
+            redundancy = np.maximum(redundancy, sims[best])
+        return order
+
+    def _merge(self, chunks: List[Chunk]) -> List[Chunk]:
+        """Fold consecutive chunks of the same post into one passage, kept at its first-selected position."""
+        by_post: Dict[str, List[int]] = {}
+        for pos, ch in enumerate(chunks):
+            by_post.setdefault(ch.post.uri or f"#{pos}", []).append(pos)
+        out: Dict[int, Chunk] = {}
+        for positions in by_post.values():
+            runs: List[List[int]] = []
+            for pos in sorted(positions, key=lambda p: chunks[p].index):
+                if runs and chunks[pos].index == chunks[runs[-1][-1]].index + 1:
+                    runs[-1].append(pos)
+                else:
+                    runs.append([pos])
+            for run in runs:
+                first = chunks[run[0]]
+                text = first.text
+                for pos in run[1:]:
+                    text = join_overlapping(text, chunks[pos].text, self.chunk_overlap * 2)
+                out[min(run)] = replace(first, text=text, echoes=max(chunks[p].echoes for p in run))
+        return [out[pos] for pos in sorted(out)]
+
+    def _tokens(self, chunks: List[Chunk]) -> int:
+        """Estimated tokens of the context block ``build_prompt`` makes from ``chunks``."""
+        return estimate_tokens(DOC_SEPARATOR.join(format_doc_for_prompt(i + 1, ch) for i, ch in enumerate(chunks)))
+
+    def pack(self, candidates: List[Chunk], baseline_k: int = BASELINE_DOCS) -> PackResult:
+        if not candidates:
+            return PackResult()
+        baseline = self._tokens(candidates[:baseline_k])
+        budget = min(self.token_budget, baseline)
+        chosen: List[Chunk] = []
+        packed: List[Chunk] = []
+        used = 0
+        for i in self._mmr_order(candidates):
+            trial = self._merge(chosen + [candidates[i]])
+            tokens = self._tokens(trial)
+            if tokens > budget and chosen:
+                continue
+            chosen.append(candidates[i])
+            packed, used = trial, tokens
+        return PackResult(
+            chunks=packed,
+            tokens_used=used,
+            tokens_saved=baseline - used,
+            candidates=len(candidates),
+            merged=len(chosen) - len(packed),
+        )
@@ -0,0 +1,211 @@
+"""Time-partitioned vector store for simple RAG."""
+
+from __future__ import annotations
+
+import calendar
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type, Union
+
+from loguru import logger
+
+from .config import ChromaCfg
+from .store import VectorStore, backend_class, empty_result, recency_cutoff
+from .utils import Chunk, ChunkBatch
+
+
+# key format and bucket width in seconds, by granularity; key length tells them apart
+GRANULARITY = {"day": ("%Y%m%d", 86400), "hour": ("%Y%m%d%H", 3600)}
+KEY_FORMATS = {8: GRANULARITY["day"], 10: GRANULARITY["hour"]}
+
+
+def partition_key(ts: float, granularity: str) -> str:
+    fmt, _ = GRANULARITY[granularity]
+    return time.strftime(fmt, time.gmtime(ts))
+
+
+def partition_span(key: str) -> Tuple[float, float]:
+    """UTC [start, end) of the bucket named by ``key``."""
+    fmt, width = KEY_FORMATS[len(key)]
+    start = float(calendar.timegm(time.strptime(key, fmt)))
+    return start, start + width
+
+
+class PartitionedStore(VectorStore):
+    """One backend collection per day (or hour) of ``created_at``.
+
+    Partitions are named ``{collection}_{YYYYMMDD[HH]}`` and created on first
+    write. Queries with ``recent_days`` only search the partitions that overlap
+    the window, so their cost follows the window rather than the total history.
+    ``compact`` drops partitions older than ``retention_days``, archiving them
+    to gzipped JSONL first when ``archive_dir`` is set.
+    """
+
+    def __init__(self, cfg: ChromaCfg, backend_cls: Type[VectorStore]):
+        self.cfg = cfg
+        self.backend_cls = backend_cls
+        self.granularity = cfg.partition.lower()
+        if self.granularity not in GRANULARITY:
+            raise ValueError(f"Unknown STORE_PARTITION: {cfg.partition}")
+        self._parts: Dict[str, Optional[VectorStore]] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="partition")
+        pattern = re.compile(rf"^{re.escape(cfg.collection)}_(\d{{8}}|\d{{10}})$")
+        for name in backend_cls.collection_names(cfg):
+            m = pattern.match(name)
+            if m:
+                self._parts[m.group(1)] = None
+        logger.info(f"partitioned store: {len(self._parts)} {self.granularity} partitions of {cfg.collection}")
+
+    def _name(self, key: str) -> str:
+        return f"{self.cfg.collection}_{key}"
+
+    def _part(self, key: str) -> VectorStore:
+        with self._lock:
+            store = self._parts.get(key)
+            if store is None:
+                store = self.backend_cls(replace(self.cfg, collection=self._name(key), partition="none"))
+                self._parts[key] = store
+            return store
+
+    def _keys(self, since: Optional[float] = None) -> List[str]:
+        """Partition keys overlapping [since, now], newest first."""
+        with self._lock:
+            keys = list(self._parts)
+        if since is not None:
+            keys = [k for k in keys if partition_span(k)[1] > since]
+        return sorted(keys, reverse=True)
+
+    def _horizon(self) -> Optional[float]:
+        if self.cfg.retention_days <= 0:
+            return None
+        return time.time() - self.cfg.retention_days * 86400
+
+    def add_chunks(self, chunks: Union[ChunkBatch, List[Chunk]], embeddings: List[Optional[List[float]]]) -> int:
+        chunks = ChunkBatch.from_chunks(chunks)
+        horizon = self._horizon()
+        now = time.time()
+        groups: Dict[str, List[int]] = {}
+        skipped = 0
+        for pos, ts in enumerate(chunks.created_ts()):
+            if horizon is not None and ts < horizon:
+                # would land in a partition compaction is about to drop
+                skipped += 1
+                continue
+            # clock-skewed posts from the future go into the current bucket
+            groups.setdefault(partition_key(min(ts, now), self.granularity), []).append(pos)
+        if skipped:
+            logger.debug(f"partitioned store skipped {skipped} chunks older than retention")
+        return sum(self._part(key).add_chunks(chunks.take(pos), [embeddings[i] for i in pos]) for key, pos in groups.items())
+
+    def query(self, query_vec: List[float], n: int = 10, recent_days: Optional[int] = None, where: Optional[Dict[str, Any]] = None, include_embeddings: bool = False) -> Dict[str, Any]:
+        keys = self._keys(recency_cutoff(recent_days) if recent_days is not None else None)
+        if not keys:
+            return empty_result()
+        parts = [self._part(k) for k in keys]
+        results = list(self._pool.map(
+            lambda s: s.query(query_vec, n=n, recent_days=recent_days, where=where, include_embeddings=include_embeddings), parts
+        ))
+        hits = [
+            (dist, doc, meta, vec)
+            for res in results
+            for doc, meta, dist, vec in zip(
+                res["documents"], res["metadatas"], res["distances"], res.get("embeddings") or [None] * res["count"]
+            )
+        ]
+        hits.sort(key=lambda h: h[0])
+        out = empty_result()
+        if include_embeddings:
+            out["embeddings"] = [vec for _, _, _, vec in hits[:n]]
+        for dist, doc, meta, _ in hits[:n]:
+            out["documents"].append(doc)
+            out["metadatas"].append(meta)
+            out["distances"].append(dist)
+        out["count"] = len(out["documents"])
+        return out
+
+    def existing_cids(self, uris: List[str]) -> Dict[str, str]:
+        wanted = {u for u in uris if u}
+        found: Dict[str, str] = {}
+        # fresh posts live in the newest partitions, so most lookups end early
+        for key in self._keys():
+            if not wanted:
+                break
+            hits = self._part(key).existing_cids(list(wanted))
+            found.update(hits)
+            wanted -= hits.keys()
+        return found
+
+    def delete_posts(self, uris: List[str]) -> int:
+        # a delete event carries no createdAt, so every partition is asked
+        parts = [self._part(k) for k in self._keys()]
+        return sum(self._pool.map(lambda s: s.delete_posts(uris), parts))
+
+    def count(self) -> int:
+        return sum(self._part(k).count() for k in self._keys())
+
+    def partitions(self) -> Dict[str, int]:
+        """Chunk count per partition name, newest first."""
+        return {self._name(k): self._part(k).count() for k in self._keys()}
+
+    def _archive(self, key: str, store: VectorStore) -> str:
+        os.makedirs(self.cfg.archive_dir, exist_ok=True)
+        path = os.path.join(self.cfg.archive_dir, f"{self._name(key)}.jsonl.gz")
+        tmp = path + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for doc_id, doc, meta, vec in store.scan(include_embeddings=True):
+                f.write(json.dumps({"id": doc_id, "document": doc, "metadata": meta, "embedding": vec}) + "\n")
+        os.replace(tmp, path)
+        return path
+
+    def compact(self) -> List[str]:
+        horizon = self._horizon()
+        if horizon is None:
+            return []
+        dropped: List[str] = []
+        for key in self._keys():
+            if partition_span(key)[1] > horizon:
+                continue
+            store = self._part(key)
+            try:
+                if self.cfg.archive_dir:
+                    path = self._archive(key, store)
+                    logger.info(f"archived partition {self._name(key)} to {path}")
+                store.drop()
+            except Exception as e:
+                logger.warning(f"compaction of {self._name(key)} failed: {e}")
+                continue
+            with self._lock:
+                self._parts.pop(key, None)
+            dropped.append(self._name(key))
+        if dropped:
+            logger.info(f"compaction dropped {len(dropped)} partitions older than {self.cfg.retention_days} days")
+        return dropped
+
+    def clear(self):
+        for key in self._keys():
+            self._part(key).drop()
+        with self._lock:
+            self._parts.clear()
+
+    def drop(self):
+        self.clear()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def scan(self, include_embeddings: bool = False, since: Optional[float] = None) -> Iterator[Tuple[str, str, Dict[str, Any], Optional[List[float]]]]:
+        for key in self._keys(since):
+            yield from self._part(key).scan(include_embeddings=include_embeddings, since=since)
+
+    @classmethod
+    def collection_names(cls, cfg: ChromaCfg) -> List[str]:
+        """Partition collections of ``cfg.collection`` in the ``STORE_BACKEND`` backend."""
+        prefix = f"{cfg.collection}_"
+        return [n for n in backend_class(cfg).collection_names(cfg) if n.startswith(prefix)]
@@ -2,17 +2,27 @@
 
 from __future__ import annotations
 
+import os
+import threading
+import time
 from dataclasses import dataclass
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
 
 from loguru import logger
 
+from .admission import QueryCancelled
 from .config import AppCfg, get_cfg
 from .bluesky import BSky
+from .cache import AnswerCache, EmbeddingCache, normalize_text
 from .embeddings import Gemini
-from .store import Store
-from .utils import Post, Chunk, clean_text, chunk_text, extract_keywords
-from .ingest import stream_posts
+from .dedupe import DuplicateIndex
+from .lexical import LexicalIndex, rrf_fuse
+from .metrics import observe, span
+from .packing import BASELINE_DOCS, ContextPacker
+from .singleflight import SingleFlight
+from .store import chunk_id, cid_unchanged, make_store, recency_cutoff
+from .utils import Chunk, ChunkBatch, ChunkView, PostBatch, PostLike, extract_keywords, iso_to_epoch
+from .ingest import open_did_cache, stream_posts
 import asyncio
 
 
@@ -27,103 +37,391 @@ class SimpleRAG:
     def __init__(self, cfg: Optional[AppCfg] = None):
         self.cfg = cfg or get_cfg()
         self.bs = BSky(self.cfg.bluesky)
-        self.gm = Gemini(self.cfg.gemini)
-        self.db = Store(self.cfg.chroma)
+        self.embed_cache = EmbeddingCache(
+            os.path.join(self.cfg.cache.dir, "embeddings.sqlite"),
+            max_entries=self.cfg.cache.embed_max_entries,
+            memory_entries=self.cfg.cache.embed_memory_entries,
+        )
+        self.gm = Gemini(self.cfg.gemini, cache=self.embed_cache)
+        # resolved handles, shared by the ingest daemon and request-time Jetstream streams
+        self.dids = open_did_cache(self.cfg)
+        self.answers = AnswerCache(
+            os.path.join(self.cfg.cache.dir, "answers.sqlite"),
+            ttl=self.cfg.cache.answer_ttl,
+            max_distance=self.cfg.cache.answer_max_distance,
+            max_entries=self.cfg.cache.answer_max_entries,
+        )
+        self.db = make_store(self.cfg.chroma)
+        self.flights: Optional[SingleFlight] = SingleFlight() if self.cfg.rag.coalesce else None
+        self.dedupe: Optional[DuplicateIndex] = None
+        if self.cfg.rag.dedupe:
+            self.dedupe = DuplicateIndex(
+                os.path.join(self.cfg.chroma.db_path, "dedupe.sqlite"),
+                max_distance=self.cfg.rag.dedupe_max_distance,
+                window_days=self.cfg.rag.dedupe_days,
+                max_entries=self.cfg.rag.dedupe_max_entries,
+            )
+        self.packer = ContextPacker(
+            token_budget=self.cfg.rag.context_token_budget,
+            mmr_lambda=self.cfg.rag.mmr_lambda,
+            chunk_overlap=self.cfg.rag.chunk_overlap,
+        )
+        self.lexical: Optional[LexicalIndex] = None
+        if self.cfg.rag.lexical:
+            self.lexical = LexicalIndex(max_docs=self.cfg.rag.lexical_max_docs, min_hits=self.cfg.rag.lexical_min_hits)
+            try:
+                self.lexical.load(self.db.scan(since=recency_cutoff(self.cfg.rag.recent_days)))
+            except Exception as e:
+                logger.warning(f"lexical index bootstrap failed: {e}")
 
-    def ingest_posts(self, posts: List[Post]) -> int:
-        # chunk posts
-        chunks: List[Chunk] = []
-        for p in posts:
-            text = clean_text(p.text)
-            if not text:
-                continue
-            parts = chunk_text(text, self.cfg.rag.chunk_size, self.cfg.rag.chunk_overlap)
-            for i, t in enumerate(parts):
-                chunks.append(Chunk(text=t, post=p, index=i, total=len(parts)))
-        if not chunks:
+    def close(self) -> None:
+        """Release the Bluesky client, worker pools and SQLite connections; the instance is unusable afterwards."""
+        self.bs.close()
+        self.gm.close()
+        self.db.close()
+        for cache in (self.embed_cache, self.answers, self.dids, self.dedupe):
+            if cache is not None:
+                cache.close()
+
+    def refresh_lexical(self) -> int:
+        """Rebuild the keyword index from the store, picking up chunks written by other processes."""
+        if self.lexical is None:
             return 0
-        # embed
-        texts = [f"@{c.post.author}: {c.text}" for c in chunks]
-        vecs = self.gm.embed_batch(texts, task_type="RETRIEVAL_DOCUMENT", batch_size=12, delay=0.2)
-        # store
-        added = self.db.add_chunks(chunks, vecs)
+        return self.lexical.reload(self.db.scan(since=recency_cutoff(self.cfg.rag.recent_days)))
+
+    def ingest_posts(self, posts: Union[PostBatch, List[PostLike]], deleted: Optional[List[str]] = None) -> int:
+        """Embed and store new or changed posts, then drop the chunks of ``deleted`` post URIs.
+
+        Returns the number of chunks written.
+        """
+        posts = PostBatch.from_posts(posts)
+        # a post seen twice in one batch (an update, or an event replayed after a restart) is written once, as its latest version
+        latest = {u: i for i, u in enumerate(posts.uris)}
+        if len(latest) < len(posts):
+            posts = posts.take(sorted(latest.values()))
+        # skip posts stored under the same CID before anything is embedded; only records with a CID have a stable URI
+        stable = [u for u, c in zip(posts.uris, posts.cids) if c]
+        with span("store.existing_cids"):
+            stored = self.db.existing_cids(stable)
+        attested = self.dedupe.attested_cids(stable) if self.dedupe is not None else {}
+        if stored or attested:
+            posts = posts.take([
+                i for i, (u, c) in enumerate(zip(posts.uris, posts.cids))
+                if not (u in attested and cid_unchanged(attested[u], c)) and not (u in stored and cid_unchanged(stored[u], c))
+            ])
+        rechecked = [u for u in posts.uris if u in attested]
+        if rechecked:
+            # edited since it was attested as a near-duplicate: checked again from scratch below
+            self.dedupe.remove_posts(rechecked)
+        chunks = ChunkBatch.from_posts(posts, self.cfg.rag.chunk_size, self.cfg.rag.chunk_overlap)
+        # near-duplicates are attested on their canonical chunk instead of embedded
+        dup_in_batch: List[Tuple[ChunkView, ChunkView]] = []
+        dup_of_stored: List[Tuple[ChunkView, str]] = []
+        if self.dedupe is not None:
+            with span("ingest.dedupe"):
+                fresh, dup_in_batch, dup_of_stored = self.dedupe.split(chunks)
+                if len(fresh) < len(chunks):
+                    chunks = chunks.take([c.pos for c in fresh])
+            if dup_in_batch or dup_of_stored:
+                logger.info(f"dedupe: {len(dup_in_batch) + len(dup_of_stored)} near-duplicate chunks not embedded")
+        added = 0
+        vecs: List[Optional[List[float]]] = []
+        if chunks:
+            # embed
+            texts = [f"@{a}: {t}" for a, t in zip(chunks.authors(), chunks.texts)]
+            vecs = self.gm.embed_batch(texts, task_type="RETRIEVAL_DOCUMENT")
+            # store; posts left in ``stored`` at this point changed CID and are rewritten
+            with span("store.upsert_chunks"):
+                added = self.db.upsert_chunks(chunks, vecs, stored)
+            replaced = {u for u in chunks.uris() if u in stored}
+            if self.lexical is not None:
+                self.lexical.remove_posts(replaced)
+                self.lexical.add_chunks(chunks, vecs)
+            if self.dedupe is not None and replaced:
+                # the rewritten post's new signatures are committed below
+                self.dedupe.remove_posts(replaced)
+        if self.dedupe is not None:
+            kept = [c for c, v in zip(chunks, vecs) if v is not None]
+            kept_ids = {chunk_id(c.post.uri, c.index) for c in kept}
+            in_batch = [(c, chunk_id(canon.post.uri, canon.index)) for c, canon in dup_in_batch]
+            self.dedupe.commit(kept, dup_of_stored + [(c, cid) for c, cid in in_batch if cid in kept_ids])
+        if deleted:
+            with span("store.delete_posts"):
+                self.db.delete_posts(deleted)
+            if self.lexical is not None:
+                self.lexical.remove_posts(deleted)
+            if self.dedupe is not None:
+                self.dedupe.remove_posts(deleted)
         return added
 
-    def retrieve(self, question: str, max_results: Optional[int] = None, recent_days: Optional[int] = None) -> List[Chunk]:
-        max_results = max_results or self.cfg.rag.max_results
-        qvec = self.gm.query_embed(question)
-        if qvec is None:
-            return []
-        res = self.db.query(qvec, n=max_results, recent_days=recent_days or self.cfg.rag.recent_days)
-        # Fallback: if recency filter yields nothing, try without it
-        if not res.get("documents") or res.get("count", 0) == 0:
-            res = self.db.query(qvec, n=max_results, recent_days=None)
-        out: List[Chunk] = []
-        for doc, meta in zip(res.get("documents", []), res.get("metadatas", [])):
-            # Parse created_at back to datetime if it's a string
-            ca = meta.get("created_at", "")
-            from datetime import datetime
-            try:
-                created_at = datetime.fromisoformat(str(ca).replace("Z", "+00:00")) if ca else datetime.utcnow()
-            except Exception:
-                created_at = datetime.utcnow()
-            p = Post(
-                uri=meta.get("uri", ""),
-                cid="",
-                author=meta.get("author", ""),
-                author_display_name=meta.get("author_display_name", ""),
-                text=doc,
-                created_at=created_at,
-                reply_count=meta.get("reply_count", 0),
-                repost_count=meta.get("repost_count", 0),
-                like_count=meta.get("like_count", 0),
+    def clear(self) -> None:
+        """Wipe the vector store together with the indexes derived from it."""
+        self.db.clear()
+        if self.lexical is not None:
+            self.lexical.clear()
+        if self.dedupe is not None:
+            self.dedupe.clear()
+
+    def compact(self) -> List[str]:
+        """Apply store retention; dedupe signatures of chunks past the retention horizon are pruned with it."""
+        dropped = self.db.compact()
+        retention = self.cfg.chroma.partition.lower() in ("day", "hour") and self.cfg.chroma.retention_days > 0
+        if retention and self.dedupe is not None:
+            pruned = self.dedupe.prune(time.time() - self.cfg.chroma.retention_days * 86400)
+            if pruned:
+                logger.info(f"dedupe: pruned {pruned} signatures older than {self.cfg.chroma.retention_days} days")
+        return dropped
+
+    def _lexical_search(self, question: str, n: int, recent_days: Optional[int] = None):
+        if self.lexical is None:
+            return None
+        return self.lexical.search(question, n=n, since=recency_cutoff(recent_days or self.cfg.rag.recent_days))
+
+    @staticmethod
+    def _to_chunks(hits: List[Tuple[str, Dict[str, Any]]]) -> List[Chunk]:
+        # hits share one PostBatch; created_at stays an epoch int until a prompt formats it
+        posts = PostBatch()
+        chunks: List[Chunk] = []
+        for doc, meta in hits:
+            ts = meta.get("created_at_ts")
+            p = posts.append(
+                meta.get("uri", ""),
+                meta.get("cid", ""),
+                meta.get("author", ""),
+                meta.get("author_display_name", ""),
+                doc,
+                int(ts) if ts is not None else iso_to_epoch(meta.get("created_at")),
+                meta.get("reply_count", 0),
+                meta.get("repost_count", 0),
+                meta.get("like_count", 0),
             )
-            out.append(Chunk(text=doc, post=p, index=meta.get("chunk_index", 0), total=meta.get("chunk_total", 1)))
-        return out
+            chunks.append(Chunk(text=doc, post=p, index=meta.get("chunk_index", 0), total=meta.get("chunk_total", 1)))
+        return chunks
+
+    def retrieve(self, question: str, max_results: Optional[int] = None, recent_days: Optional[int] = None, qvec: Optional[List[float]] = None, with_embeddings: bool = False) -> List[Chunk]:
+        max_results = max_results or self.cfg.rag.max_results
+        with span("retrieve.lexical"):
+            lexical = self._lexical_search(question, max_results, recent_days)
+        lexical_ranked = [(doc, meta, None) for _, doc, meta in lexical.hits] if lexical else []
+        ranked = lexical_ranked
+        if qvec is None and lexical is not None and lexical.strong:
+            # keyword hits are conclusive (e.g. a #tag or @handle query): no query embedding needed
+            logger.info(f"lexical fast path: {len(lexical_ranked)} chunks")
+        else:
+            if qvec is None:
+                qvec = self.gm.query_embed(question)
+            if qvec is not None:
+                with span("store.query"):
+                    res = self.db.query(qvec, n=max_results, recent_days=recent_days or self.cfg.rag.recent_days, include_embeddings=with_embeddings)
+                    # Fallback: if recency filter yields nothing, try without it
+                    if not res.get("documents") or res.get("count", 0) == 0:
+                        res = self.db.query(qvec, n=max_results, recent_days=None, include_embeddings=with_embeddings)
+                docs = res.get("documents", [])
+                ranked = list(zip(docs, res.get("metadatas", []), res.get("embeddings") or [None] * len(docs)))
+                if lexical_ranked:
+                    ranked = rrf_fuse([ranked, lexical_ranked], n=max_results, k=self.cfg.rag.rrf_k)
+        chunks = self._to_chunks([(doc, meta) for doc, meta, _ in ranked])
+        if with_embeddings:
+            for ch, (_, _, vec) in zip(chunks, ranked):
+                ch.embedding = vec
+            missing = [ch for ch in chunks if ch.embedding is None]
+            if missing:
+                # keyword-only hits: their document vectors are usually still in the embedding cache
+                cached = self.gm.cached_vectors([f"@{c.post.author}: {c.text}" for c in missing])
+                for ch, vec in zip(missing, cached):
+                    ch.embedding = vec
+        return self._finish(chunks)
+
+    def _finish(self, chunks: List[Chunk]) -> List[Chunk]:
+        """Collapse near-duplicate results and attach attestation counts."""
+        if self.dedupe is None or not chunks:
+            return chunks
+        chunks = self.dedupe.collapse(chunks)
+        echoes = self.dedupe.echoes([chunk_id(c.post.uri, c.index) for c in chunks])
+        for c in chunks:
+            c.echoes = echoes.get(chunk_id(c.post.uri, c.index), 0)
+        return chunks
+
+    def _pipeline(self, question: str, fresh: bool, persona: Optional[str], use_cache: bool, stream: bool, cancel: Optional[threading.Event] = None) -> Iterator[Dict[str, Any]]:
+        """Run the RAG steps, yielding progress events; the last event is ``done`` with the result.
 
-    def ask(self, question: str, fresh: bool = True, persona: Optional[str] = None) -> Dict[str, Any]:
+        ``cancel`` is checked between stages; once set the run stops with ``QueryCancelled``.
+        The ``done`` event carries per-stage ``timings`` in milliseconds.
+        """
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+
+        def finish() -> Dict[str, float]:
+            observe("ask.total", time.perf_counter() - started, timings)
+            return dict(timings)
+
+        def check():
+            if cancel is not None and cancel.is_set():
+                raise QueryCancelled(question)
+
+        # 0) serve a recent answer to the same or a semantically close question
+        qvec = None
+        if self.answers.enabled:
+            hit = None
+            with span("ask.answer_cache", timings):
+                # with conclusive keyword hits only the exact-question cache applies; skip the embedding
+                lexical = self._lexical_search(question, self.cfg.rag.max_results)
+                if lexical is None or not lexical.strong:
+                    qvec = self.gm.query_embed(question)
+                if use_cache:
+                    hit = self.answers.lookup(question, persona, qvec)
+            if hit is not None:
+                logger.info("answer served from cache")
+                yield {"event": "sources", "sources": hit.get("sources", [])}
+                yield {"event": "token", "text": hit.get("answer", "")}
+                yield {"event": "done", **hit, "cached": True, "timings": finish()}
+                return
         # 1) collect fresh posts relevant to query
         if fresh:
+            check()
+            yield {"event": "stage", "stage": "fetching"}
             try:
-                posts = self.bs.hybrid_search(question, limit=60)
-                added = self.ingest_posts(posts)
+                with span("ask.fetch", timings):
+                    posts = self.bs.hybrid_search(question, limit=60)
+                check()
+                yield {"event": "stage", "stage": "embedding", "posts": len(posts)}
+                with span("ask.ingest", timings):
+                    added = self.ingest_posts(posts)
                 logger.info(f"fresh ingest added={added}")
+            except QueryCancelled:
+                raise
             except Exception as e:
                 logger.warning(f"fresh ingest skipped: {e}")
         # 2) retrieve
-        ctx_chunks = self.retrieve(question, max_results=self.cfg.rag.max_results)
+        check()
+        yield {"event": "stage", "stage": "retrieving"}
+        with span("ask.retrieve", timings):
+            candidates = self.retrieve(
+                question, max_results=self.cfg.rag.max_results * max(1, self.cfg.rag.context_overfetch), qvec=qvec, with_embeddings=True
+            )
+        with span("ask.pack", timings):
+            packed = self.packer.pack(candidates)
+        ctx_chunks = packed.chunks
+        logger.info(
+            f"context packed {len(ctx_chunks)} of {packed.candidates} candidates ({packed.merged} merged): "
+            f"{packed.tokens_used} tokens, {packed.tokens_saved} saved vs top-{BASELINE_DOCS}"
+        )
+        yield {"event": "stage", "stage": "retrieved", "chunks": len(ctx_chunks), "context_tokens": packed.tokens_used}
         if not ctx_chunks:
-            return {
+            yield {
+                "event": "done",
                 "answer": "I couldn't find relevant Bluesky posts to answer. Try rephrasing or ask about a recent topic.",
                 "context_used": 0,
                 "sources": [],
+                "cached": False,
+                "timings": finish(),
             }
-        # 3) generate
-        ans = self.gm.answer(question, ctx_chunks, persona=persona)
-        if not ans:
-            return {"answer": "Answer generation failed", "context_used": len(ctx_chunks), "sources": []}
+            return
         src = []
         seen = set()
         for ch in ctx_chunks[:6]:
             if ch.post.uri and ch.post.uri not in seen:
                 seen.add(ch.post.uri)
                 src.append(ch.post.uri)
-        return {"answer": ans, "context_used": len(ctx_chunks), "sources": src}
+        yield {"event": "sources", "sources": src}
+        # 3) generate
+        check()
+        yield {"event": "stage", "stage": "generating"}
+        if stream:
+            # tokens are yielded mid-generation, so this stage is timed by hand rather than with span()
+            gen_started = time.perf_counter()
+            parts: List[str] = []
+            stream_errors: List[Exception] = []
+            for delta in self.gm.answer_stream(question, ctx_chunks, persona=persona, errors=stream_errors):
+                check()
+                parts.append(delta)
+                yield {"event": "token", "text": delta}
+            observe("ask.generate", time.perf_counter() - gen_started, timings)
+            ans = "".join(parts).strip() or None
+        else:
+            with span("ask.generate", timings):
+                ans = self.gm.answer(question, ctx_chunks, persona=persona)
+        if not ans:
+            yield {
+                "event": "done", "answer": "Answer generation failed", "context_used": len(ctx_chunks), "sources": [], "cached": False,
+                "timings": finish(),
+            }
+            return
+        result = {
+            "answer": ans,
+            "context_used": len(ctx_chunks),
+            "sources": src,
+            "context_tokens": packed.tokens_used,
+            "context_tokens_saved": packed.tokens_saved,
+        }
+        if stream and stream_errors:
+            # a truncated answer is still shown to this caller, but never served from cache
+            logger.warning(f"answer stream broke off after {len(ans)} chars; not caching it")
+        else:
+            self.answers.put(question, persona, qvec, result)
+        yield {"event": "done", **result, "cached": False, "timings": finish()}
 
-    def ask_jetstream(self, question: str, keywords: Optional[str] = None, max_posts: int = 200, minutes: int = 2, persona: Optional[str] = None) -> Dict[str, Any]:
+    def _flight_keys(self, kind: str, question: str, persona: Optional[str]) -> List[str]:
+        """Same normalized question, or same keyword set, with the same persona: one shared execution."""
+        prefix = f"{kind}:{AnswerCache._persona_key(persona)}"
+        keys = [f"{prefix}:q:{normalize_text(question).lower()}"]
+        terms = extract_keywords(question, max_terms=8)
+        if terms:
+            keys.append(f"{prefix}:k:{' '.join(sorted(terms))}")
+        return keys
+
+    def _coalesced(self, kind: str, question: str, persona: Optional[str], cancel: Optional[threading.Event], run) -> Dict[str, Any]:
+        if self.flights is None:
+            return run(cancel)
+        result, shared = self.flights.do(self._flight_keys(kind, question, persona), run, cancel)
+        if shared:
+            logger.info(f"coalesced onto in-flight {kind}: {question}")
+            return {**result, "coalesced": True}
+        return dict(result)
+
+    def ask(self, question: str, fresh: bool = True, persona: Optional[str] = None, use_cache: bool = True, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """Answer ``question``; concurrent identical asks share one pipeline run (see SingleFlight)."""
+        kind = f"ask{int(fresh)}{int(use_cache)}"
+        return self._coalesced(kind, question, persona, cancel, lambda token: self._ask(question, fresh, persona, use_cache, token))
+
+    def _ask(self, question: str, fresh: bool, persona: Optional[str], use_cache: bool, cancel) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        for ev in self._pipeline(question, fresh, persona, use_cache, stream=False, cancel=cancel):
+            if ev["event"] == "done":
+                result = {k: v for k, v in ev.items() if k != "event"}
+        return result
+
+    def ask_stream(self, question: str, fresh: bool = True, persona: Optional[str] = None, use_cache: bool = True, cancel: Optional[threading.Event] = None) -> Iterator[Dict[str, Any]]:
+        """Like ``ask`` but yields stage, ``sources`` and answer ``token`` events as they happen."""
+        return self._pipeline(question, fresh, persona, use_cache, stream=True, cancel=cancel)
+
+    def ask_jetstream(self, question: str, keywords: Optional[str] = None, max_posts: int = 200, minutes: int = 2, persona: Optional[str] = None, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
         """Run a full pipeline: stream from Jetstream with keywords, ingest, then answer the question."""
+        kind = f"jetstream:{keywords or ''}"
+        return self._coalesced(
+            kind, question, persona, cancel, lambda token: self._ask_jetstream(question, keywords, max_posts, minutes, persona, token)
+        )
+
+    def _ask_jetstream(self, question: str, keywords: Optional[str], max_posts: int, minutes: int, persona: Optional[str], cancel) -> Dict[str, Any]:
         kw = keywords or question
-        try:
-            posts = asyncio.get_event_loop().run_until_complete(stream_posts(self.cfg, kw, max_posts, minutes))
-        except RuntimeError:
-            # If no running loop (rare on some environments), create one
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            posts = loop.run_until_complete(stream_posts(self.cfg, kw, max_posts, minutes))
-            loop.close()
-        added = self.ingest_posts(posts)
+        timings: Dict[str, float] = {}
+        with span("jetstream.stream", timings):
+            try:
+                posts = asyncio.get_event_loop().run_until_complete(stream_posts(self.cfg, kw, max_posts, minutes, bs=self.bs, stop=cancel, dids=self.dids))
+            except RuntimeError:
+                # If no running loop (rare on some environments), create one
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                posts = loop.run_until_complete(stream_posts(self.cfg, kw, max_posts, minutes, bs=self.bs, stop=cancel, dids=self.dids))
+                loop.close()
+        if cancel is not None and cancel.is_set():
+            raise QueryCancelled(question)
+        with span("jetstream.ingest", timings):
+            added = self.ingest_posts(posts)
         logger.info(f"jetstream ingest added={added} from {len(posts)} posts")
-        result = self.ask(question, fresh=False, persona=persona)
+        # the posts just streamed should shape the answer, so skip the answer cache lookup
+        result = self.ask(question, fresh=False, persona=persona, use_cache=False, cancel=cancel)
+        result["timings"] = {**timings, **result.get("timings", {})}
         result["jetstream_ingested_posts"] = len(posts)
         result["jetstream_chunks_added"] = added
         return result
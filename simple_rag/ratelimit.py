@@ -0,0 +1,133 @@
+"""Request pacing helpers for simple RAG."""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from typing import Mapping, Optional
+
+
+class AdaptiveLimiter:
+    """Spaces out calls to a remote API and adapts the rate to throttling.
+
+    Additive increase / multiplicative decrease: every success nudges the rate
+    up towards ``max_rate``, every 429 halves it (and honours Retry-After when
+    the server sends one). Thread-safe; callers block in ``acquire``.
+    """
+
+    def __init__(self, rate: float, min_rate: float = 0.5, max_rate: Optional[float] = None, step: float = 0.1):
+        self.rate = max(rate, min_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.step = step
+        self.throttled = 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + 1.0 / self.rate
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self._next = max(self._next, time.monotonic() + pause)
+
+
+def _header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+    try:
+        value = headers.get(name)
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds the server asks us to wait, from Retry-After or an exhausted ``ratelimit-*`` window."""
+    seconds = _header_float(headers, "retry-after")
+    if seconds is not None:
+        return max(0.0, seconds)
+    remaining = _header_float(headers, "ratelimit-remaining")
+    reset = _header_float(headers, "ratelimit-reset")
+    if remaining is not None and remaining <= 0 and reset is not None:
+        return max(0.0, reset - time.time())
+    return None
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0, floor: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff; never shorter than ``floor`` (e.g. a server-sent Retry-After)."""
+    delay = random.uniform(0.0, min(cap, base * (2 ** attempt)))
+    return max(delay, floor) if floor is not None else delay
+
+
+class TokenBucket:
+    """Token bucket whose refill rate follows the server's advertised rate limit.
+
+    Bluesky answers with ``ratelimit-limit``, ``ratelimit-remaining`` and
+    ``ratelimit-reset`` (epoch seconds) headers. Each response re-derives the
+    rate so the remaining quota is spread over the rest of the window (never
+    above ``rate``), and an exhausted quota or a 429 blocks callers until the
+    window resets. Thread-safe; callers block in ``acquire``.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.max_rate = max(rate, 0.01)
+        self.rate = self.max_rate
+        self.burst = burst or max(1.0, self.max_rate)
+        self.tokens = self.burst
+        self.throttled = 0
+        self.remaining: Optional[float] = None
+        self._stamp = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return
+                    wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        remaining = _header_float(headers, "ratelimit-remaining")
+        reset = _header_float(headers, "ratelimit-reset")
+        if remaining is None or reset is None:
+            return
+        window = max(1.0, reset - time.time())
+        with self._lock:
+            self.remaining = remaining
+            self._refill(time.monotonic())
+            # the quota may be shared with other clients, so the server's count wins
+            self.tokens = min(self.tokens, remaining)
+            if remaining <= 0:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + window)
+            else:
+                self.rate = min(self.max_rate, remaining / window)
+
+    def on_throttle(self, pause: float) -> None:
+        with self._lock:
+            self.throttled += 1
+            self.tokens = 0.0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
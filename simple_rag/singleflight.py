@@ -0,0 +1,78 @@
+"""Single-flight coalescing of concurrent identical queries."""
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .admission import QueryCancelled
+
+
+class _Flight:
+    """One shared execution; its ``is_set`` reports whether every attached request has gone away."""
+
+    def __init__(self, cancel: Optional[threading.Event]):
+        self.future: Future = Future()
+        self.cancels: List[Optional[threading.Event]] = [cancel]
+        self.keys: List[str] = []
+
+    def is_set(self) -> bool:
+        return all(c is not None and c.is_set() for c in self.cancels)
+
+
+class SingleFlight:
+    """Runs one execution per key at a time; concurrent callers with any matching key share its result.
+
+    The first caller (the leader) runs ``fn`` in its own thread; later callers
+    block on the leader's future. ``fn`` receives a cancel token that is only
+    set once every attached caller has cancelled, so one client disconnecting
+    does not abort the work others are waiting for.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, keys: List[str], fn: Callable[[Any], Any], cancel: Optional[threading.Event] = None) -> Tuple[Any, bool]:
+        """Return ``(result, shared)``; ``shared`` is True when the result came from another caller's execution."""
+        keys = [k for k in keys if k]
+        with self._lock:
+            flight = next((self._flights[k] for k in keys if k in self._flights), None)
+            if flight is not None:
+                flight.cancels.append(cancel)
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = _Flight(cancel)
+                flight.keys = keys
+                for k in keys:
+                    self._flights[k] = flight
+                self.executions += 1
+                leader = True
+        if not leader:
+            while True:
+                try:
+                    return flight.future.result(timeout=0.25), True
+                except FutureTimeout:
+                    if cancel is not None and cancel.is_set():
+                        raise QueryCancelled("coalesced query cancelled")
+        try:
+            result = fn(flight)
+            flight.future.set_result(result)
+            return result, False
+        except BaseException as e:
+            flight.future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                for k in flight.keys:
+                    if self._flights.get(k) is flight:
+                        del self._flights[k]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            in_flight = len({id(f) for f in self._flights.values()})
+        return {"executions": self.executions, "coalesced": self.coalesced, "in_flight": in_flight}
@@ -1,23 +1,172 @@
-"""ChromaDB store for simple RAG."""
+"""Vector stores for simple RAG: the backend interface and the ChromaDB backend."""
 
 from __future__ import annotations
 
 import os
-import uuid
+import threading
+from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type, Union
 
-import chromadb
-from chromadb.config import Settings
 from loguru import logger
 
 from .config import ChromaCfg
-from .utils import Chunk
+from .utils import Chunk, ChunkBatch, ChunkLike, chunk_id, epoch_to_iso
 
 
-class Store:
+def chunk_metadata(ch: ChunkLike) -> Dict[str, Any]:
+    p = ch.post
+    ts = p.created_ts
+    return {
+        "uri": p.uri,
+        "cid": p.cid,
+        "author": p.author,
+        "author_display_name": p.author_display_name,
+        "created_at": epoch_to_iso(ts),
+        "created_at_ts": ts,
+        "reply_count": p.reply_count,
+        "repost_count": p.repost_count,
+        "like_count": p.like_count,
+        "chunk_index": ch.index,
+        "chunk_total": ch.total,
+    }
+
+
+def recency_cutoff(recent_days: int) -> float:
+    return (datetime.utcnow() - timedelta(days=recent_days)).timestamp()
+
+
+def empty_result() -> Dict[str, Any]:
+    return {"documents": [], "metadatas": [], "distances": [], "count": 0}
+
+
+def cid_unchanged(stored: str, cid: str) -> bool:
+    """Whether a post stored with CID ``stored`` needs no rewrite for ``cid``.
+
+    Rows written before CIDs were recorded, and posts that arrive without
+    one, have nothing to compare, so they count as unchanged.
+    """
+    return not stored or not cid or stored == cid
+
+
+class VectorStore(ABC):
+    """What SimpleRAG needs from a vector store backend.
+
+    ``query`` returns ``documents``/``metadatas``/``distances`` lists ordered
+    nearest first plus their ``count`` (and ``embeddings`` when asked for);
+    metadata carries the fields written by ``chunk_metadata``. Re-adding an
+    existing chunk id is a no-op; ``upsert_chunks`` replaces a post's chunks
+    when its CID changed. Both take a ``ChunkBatch`` or a list of ``Chunk``s.
+    """
+
+    @abstractmethod
+    def add_chunks(self, chunks: Union[ChunkBatch, List[Chunk]], embeddings: List[Optional[List[float]]]) -> int:
+        raise NotImplementedError
+
+    def upsert_chunks(
+        self,
+        chunks: Union[ChunkBatch, List[Chunk]],
+        embeddings: List[Optional[List[float]]],
+        stored: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """Write chunks of new posts, rewrite those of posts whose CID changed and skip the rest.
+
+        ``stored`` is an ``existing_cids`` result already fetched for these
+        posts; it saves a second lookup.
+        """
+        chunks = ChunkBatch.from_chunks(chunks)
+        uris, cids = chunks.uris(), chunks.cids()
+        if stored is None:
+            stored = self.existing_cids(list(set(uris)))
+        keep = [i for i, (u, c) in enumerate(zip(uris, cids)) if u not in stored or not cid_unchanged(stored[u], c)]
+        replaced = sorted({uris[i] for i in keep if uris[i] in stored})
+        if replaced:
+            # an edited post may chunk differently, so its old chunks go first
+            self.delete_posts(replaced)
+        if len(keep) < len(chunks):
+            chunks = chunks.take(keep)
+            embeddings = [embeddings[i] for i in keep]
+        return self.add_chunks(chunks, embeddings) if keep else 0
+
+    @abstractmethod
+    def delete_posts(self, uris: List[str]) -> int:
+        """Remove every chunk of the given post URIs; returns the number of chunks removed."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def query(self, query_vec: List[float], n: int = 10, recent_days: Optional[int] = None, where: Optional[Dict[str, Any]] = None, include_embeddings: bool = False) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def existing_cids(self, uris: List[str]) -> Dict[str, str]:
+        """Stored CID (empty for rows written without one) of each post URI that has chunks."""
+        raise NotImplementedError
+
+    def existing_uris(self, uris: List[str]) -> set:
+        return set(self.existing_cids(uris))
+
+    @abstractmethod
+    def count(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def drop(self):
+        """Delete the underlying collection and its files."""
+        raise NotImplementedError
+
+    def compact(self) -> List[str]:
+        """Apply retention; returns the names of dropped partitions (unpartitioned stores keep everything)."""
+        return []
+
+    def close(self) -> None:
+        """Release threads or handles the backend holds (none by default)."""
+
+    @abstractmethod
+    def scan(self, include_embeddings: bool = False, since: Optional[float] = None) -> Iterator[Tuple[str, str, Dict[str, Any], Optional[List[float]]]]:
+        """Yield (id, document, metadata, embedding or None) for stored chunks, optionally only those created since ``since``."""
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def collection_names(cls, cfg: ChromaCfg) -> List[str]:
+        """Names of the collections of this backend under ``cfg.db_path``."""
+        raise NotImplementedError
+
+
+def backend_class(cfg: ChromaCfg) -> Type[VectorStore]:
+    """The unpartitioned store class selected by ``STORE_BACKEND`` (chroma or numpy)."""
+    backend = cfg.backend.lower()
+    if backend == "numpy":
+        from .npstore import NumpyStore
+        return NumpyStore
+    if backend == "chroma":
+        return ChromaStore
+    raise ValueError(f"Unknown STORE_BACKEND: {cfg.backend}")
+
+
+def make_store(cfg: ChromaCfg) -> VectorStore:
+    """Build the backend selected by ``STORE_BACKEND`` (chroma or numpy), partitioned if ``STORE_PARTITION`` is set."""
+    backend_cls = backend_class(cfg)
+    if cfg.partition.lower() in ("day", "hour"):
+        from .partitions import PartitionedStore
+        return PartitionedStore(cfg, backend_cls)
+    return backend_cls(cfg)
+
+
+class ChromaStore(VectorStore):
     def __init__(self, cfg: ChromaCfg):
+        # imported here so the numpy backend does not pay for loading chromadb
+        import chromadb
+        from chromadb.config import Settings
+
         self.cfg = cfg
+        self._write_lock = threading.Lock()
+        # CIDs of posts known to be stored; saves a collection lookup for posts seen on every query
+        self._known_cids: Dict[str, str] = {}
         os.makedirs(self.cfg.db_path, exist_ok=True)
         self.client = chromadb.PersistentClient(
             path=self.cfg.db_path,
@@ -29,62 +178,118 @@ class Store:
         )
 
     def clear(self):
-        self.client.delete_collection(self.cfg.collection)
-        self.col = self.client.create_collection(
-            name=self.cfg.collection,
-            metadata={"description": "Bluesky chunks (simple_rag)"},
-        )
+        with self._write_lock:
+            self.client.delete_collection(self.cfg.collection)
+            self.col = self.client.create_collection(
+                name=self.cfg.collection,
+                metadata={"description": "Bluesky chunks (simple_rag)"},
+            )
+            self._known_cids.clear()
 
-    def add_chunks(self, chunks: List[Chunk], embeddings: List[Optional[List[float]]]) -> int:
-        docs: List[str] = []
-        metas: List[Dict[str, Any]] = []
-        ids: List[str] = []
-        vecs: List[List[float]] = []
-        added = 0
-        for ch, vec in zip(chunks, embeddings):
-            if vec is None or not ch.text.strip():
-                continue
-            p = ch.post
-            doc_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{p.uri}#{ch.index}"))
-            docs.append(ch.text)
-            metas.append({
-                "uri": p.uri,
-                "author": p.author,
-                "author_display_name": p.author_display_name,
-                "created_at": p.created_at.isoformat(),
-                "created_at_ts": p.created_at.timestamp(),
-                "reply_count": p.reply_count,
-                "repost_count": p.repost_count,
-                "like_count": p.like_count,
-                "chunk_index": ch.index,
-                "chunk_total": ch.total,
-            })
-            ids.append(doc_id)
-            vecs.append(vec)
-            added += 1
-        if not docs:
+    def add_chunks(self, chunks: Union[ChunkBatch, List[Chunk]], embeddings: List[Optional[List[float]]]) -> int:
+        chunks = ChunkBatch.from_chunks(chunks)
+        keep = [i for i, vec in enumerate(embeddings[: len(chunks)]) if vec is not None and chunks.texts[i].strip()]
+        if not keep:
             return 0
-        self.col.add(embeddings=vecs, documents=docs, metadatas=metas, ids=ids)
-        return added
+        if len(keep) < len(chunks):
+            chunks = chunks.take(keep)
+        vecs = [embeddings[i] for i in keep]
+        with self._write_lock:
+            self.col.add(embeddings=vecs, documents=chunks.texts, metadatas=chunks.metadatas(), ids=chunks.ids())
+        self._remember_cids(zip(chunks.uris(), chunks.cids()))
+        return len(keep)
+
+    def _remember_cids(self, pairs) -> None:
+        if len(self._known_cids) > 200_000:
+            self._known_cids.clear()
+        self._known_cids.update((u, c or "") for u, c in pairs if u)
+
+    def existing_cids(self, uris: List[str]) -> Dict[str, str]:
+        wanted = {u for u in uris if u}
+        found = {u: self._known_cids[u] for u in wanted if u in self._known_cids}
+        missing = list(wanted - found.keys())
+        for i in range(0, len(missing), 500):
+            part = missing[i : i + 500]
+            try:
+                res = self.col.get(where={"uri": {"$in": part}}, include=["metadatas"])
+            except Exception as e:
+                logger.warning(f"chroma uri lookup error: {e}")
+                continue
+            hits = {m["uri"]: m.get("cid") or "" for m in res.get("metadatas") or [] if m and m.get("uri")}
+            found.update(hits)
+            self._remember_cids(hits.items())
+        return found
+
+    def delete_posts(self, uris: List[str]) -> int:
+        wanted = sorted({u for u in uris if u})
+        removed = 0
+        for i in range(0, len(wanted), 500):
+            part = wanted[i : i + 500]
+            with self._write_lock:
+                ids = self.col.get(where={"uri": {"$in": part}}, include=[]).get("ids") or []
+                if ids:
+                    self.col.delete(ids=ids)
+            removed += len(ids)
+            for u in part:
+                self._known_cids.pop(u, None)
+        return removed
+
+    def count(self) -> int:
+        return self.col.count()
 
-    def query(self, query_vec: List[float], n: int = 10, recent_days: Optional[int] = None, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def drop(self):
+        with self._write_lock:
+            self.client.delete_collection(self.cfg.collection)
+            self._known_cids.clear()
+
+    def scan(self, include_embeddings: bool = False, since: Optional[float] = None) -> Iterator[Tuple[str, str, Dict[str, Any], Optional[List[float]]]]:
+        include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+        where = {"created_at_ts": {"$gte": since}} if since is not None else None
+        offset = 0
+        while True:
+            res = self.col.get(where=where, limit=1000, offset=offset, include=include)
+            ids = res.get("ids") or []
+            if not ids:
+                return
+            embs = res.get("embeddings") if include_embeddings else None
+            for i, doc_id in enumerate(ids):
+                vec = list(map(float, embs[i])) if embs is not None else None
+                yield doc_id, res["documents"][i], res["metadatas"][i], vec
+            offset += len(ids)
+
+    @classmethod
+    def collection_names(cls, cfg: ChromaCfg) -> List[str]:
+        import chromadb
+        from chromadb.config import Settings
+
+        client = chromadb.PersistentClient(path=cfg.db_path, settings=Settings(anonymized_telemetry=False, allow_reset=True))
+        return [c if isinstance(c, str) else c.name for c in client.list_collections()]
+
+    def query(self, query_vec: List[float], n: int = 10, recent_days: Optional[int] = None, where: Optional[Dict[str, Any]] = None, include_embeddings: bool = False) -> Dict[str, Any]:
         where_filter = where or {}
         if recent_days is not None:
-            cutoff_ts = (datetime.utcnow() - timedelta(days=recent_days)).timestamp()
-            where_filter = {**where_filter, "created_at_ts": {"$gte": cutoff_ts}}
+            where_filter = {**where_filter, "created_at_ts": {"$gte": recency_cutoff(recent_days)}}
         try:
             res = self.col.query(
                 query_embeddings=[query_vec],
                 n_results=n,
                 where=where_filter or None,
-                include=["documents", "metadatas", "distances"],
+                include=["documents", "metadatas", "distances"] + (["embeddings"] if include_embeddings else []),
             )
-            return {
+            out = {
                 "documents": res.get("documents", [[]])[0],
                 "metadatas": res.get("metadatas", [[]])[0],
                 "distances": res.get("distances", [[]])[0],
                 "count": len(res.get("documents", [[]])[0]),
             }
+            if include_embeddings:
+                embs = res.get("embeddings")
+                out["embeddings"] = [list(map(float, v)) for v in embs[0]] if embs is not None else [None] * out["count"]
+            return out
         except Exception as e:
             logger.error(f"chroma query error: {e}")
-            return {"documents": [], "metadatas": [], "distances": [], "count": 0}
+            return empty_result()
+
+
+# Backwards-compatible name for the original Chroma-backed store
+Store = ChromaStore
@@ -3,10 +3,14 @@
 from __future__ import annotations
 
 import re
+import sys
 import html
+import time
+import uuid
+from array import array
 from dataclasses import dataclass
-from datetime import datetime
-from typing import List, Dict, Any, Optional, Iterable
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Sequence, Tuple, Union
 
 from loguru import logger
 
@@ -23,6 +27,10 @@ class Post:
     repost_count: int = 0
     like_count: int = 0
 
+    @property
+    def created_ts(self) -> int:
+        return int(self.created_at.timestamp())
+
 
 @dataclass
 class Chunk:
@@ -30,6 +38,342 @@ class Chunk:
     post: Post
     index: int
     total: int
+    # near-duplicate posts recorded against this chunk at ingest (see dedupe.py)
+    echoes: int = 0
+    # stored embedding, filled in by retrieval when the context packer needs it
+    embedding: Optional[List[float]] = None
+
+
+def _days_from_civil(y: int, m: int, d: int) -> int:
+    # days since 1970-01-01 in the proleptic Gregorian calendar (H. Hinnant's algorithm)
+    y -= m <= 2
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (m + (-3 if m > 2 else 9)) + 2) // 5 + d - 1
+    return era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+
+
+def iso_to_epoch(value: Any) -> int:
+    """Epoch seconds of an ISO-8601 timestamp; now when missing or unparseable.
+
+    The ``YYYY-MM-DDTHH:MM:SS[.fff][Z|+HH:MM]`` form Bluesky uses is parsed
+    without building a ``datetime``; anything else goes through ``fromisoformat``.
+    Timestamps without an offset are taken as UTC.
+    """
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    s = value if isinstance(value, str) else ""
+    try:
+        if len(s) >= 19 and s[4] == "-" and s[7] == "-" and s[10] in "Tt " and s[13] == ":" and s[16] == ":":
+            secs = _days_from_civil(int(s[0:4]), int(s[5:7]), int(s[8:10])) * 86400 + int(s[11:13]) * 3600 + int(s[14:16]) * 60 + int(s[17:19])
+            tail = s[19:].lstrip(".,0123456789") if s[19:20] in (".", ",") else s[19:]
+            if tail in ("", "Z", "z"):
+                return secs
+            if tail[0] in "+-" and len(tail) in (5, 6):
+                offset = int(tail[1:3]) * 3600 + int(tail[-2:]) * 60
+                return secs - offset if tail[0] == "+" else secs + offset
+        if s:
+            dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+            return int((dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp())
+    except ValueError:
+        pass
+    return int(time.time())
+
+
+def epoch_to_iso(ts: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(ts))
+
+
+def chunk_id(uri: str, index: int) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{uri}#{index}"))
+
+
+def _column(name: str, intern: bool = False) -> property:
+    def get(self):
+        return getattr(self.batch, name)[self.row]
+
+    def set(self, value):
+        getattr(self.batch, name)[self.row] = sys.intern(value or "") if intern else value
+
+    return property(get, set)
+
+
+class PostView:
+    """One row of a ``PostBatch`` with the attribute names of ``Post``.
+
+    Writes go through to the batch (``DIDResolver`` fills in handles this way);
+    ``created_at`` is only materialised as a ``datetime`` when asked for.
+    """
+
+    __slots__ = ("batch", "row")
+
+    def __init__(self, batch: "PostBatch", row: int):
+        self.batch = batch
+        self.row = row
+
+    uri = _column("uris")
+    cid = _column("cids")
+    author = _column("authors", intern=True)
+    author_display_name = _column("display_names", intern=True)
+    text = _column("texts")
+    created_ts = _column("created_ts")
+    reply_count = _column("reply_counts")
+    repost_count = _column("repost_counts")
+    like_count = _column("like_counts")
+
+    @property
+    def created_at(self) -> datetime:
+        return datetime.fromtimestamp(self.created_ts, timezone.utc)
+
+    def __repr__(self) -> str:
+        return f"PostView(uri={self.uri!r}, author={self.author!r}, created_ts={self.created_ts})"
+
+
+PostLike = Union[Post, PostView]
+
+
+class PostBatch:
+    """Posts stored column-wise: parallel lists and ``array``s instead of one object per post.
+
+    Timestamps are epoch seconds, counts are machine ints and handles are
+    interned, so a firehose batch costs a few growing buffers rather than a
+    dataclass, a ``datetime`` and duplicate author strings per post. Indexing
+    or iterating yields ``PostView``s for code written against ``Post``.
+    """
+
+    __slots__ = ("uris", "cids", "authors", "display_names", "texts", "created_ts", "reply_counts", "repost_counts", "like_counts")
+
+    def __init__(self):
+        self.uris: List[str] = []
+        self.cids: List[str] = []
+        self.authors: List[str] = []
+        self.display_names: List[str] = []
+        self.texts: List[str] = []
+        self.created_ts = array("q")
+        self.reply_counts = array("q")
+        self.repost_counts = array("q")
+        self.like_counts = array("q")
+
+    def append(
+        self,
+        uri: str,
+        cid: str,
+        author: str,
+        author_display_name: str,
+        text: str,
+        created_ts: int,
+        reply_count: int = 0,
+        repost_count: int = 0,
+        like_count: int = 0,
+    ) -> PostView:
+        self.uris.append(uri or "")
+        self.cids.append(cid or "")
+        self.authors.append(sys.intern(author or ""))
+        self.display_names.append(sys.intern(author_display_name or ""))
+        self.texts.append(text or "")
+        self.created_ts.append(int(created_ts))
+        self.reply_counts.append(int(reply_count or 0))
+        self.repost_counts.append(int(repost_count or 0))
+        self.like_counts.append(int(like_count or 0))
+        return PostView(self, len(self.uris) - 1)
+
+    def add(self, post: PostLike) -> PostView:
+        """Copy a ``Post`` or a view of another batch in as a new row."""
+        if isinstance(post, PostView):
+            src, r = post.batch, post.row
+            return self.append(
+                src.uris[r], src.cids[r], src.authors[r], src.display_names[r], src.texts[r],
+                src.created_ts[r], src.reply_counts[r], src.repost_counts[r], src.like_counts[r],
+            )
+        return self.append(
+            post.uri, post.cid, post.author, post.author_display_name, post.text,
+            post.created_ts, post.reply_count, post.repost_count, post.like_count,
+        )
+
+    @classmethod
+    def from_posts(cls, posts: Union["PostBatch", Iterable[PostLike]]) -> "PostBatch":
+        if isinstance(posts, PostBatch):
+            return posts
+        batch = cls()
+        for p in posts:
+            batch.add(p)
+        return batch
+
+    def take(self, rows: Sequence[int]) -> "PostBatch":
+        """A new batch holding ``rows`` of this one, in that order."""
+        out = PostBatch()
+        for name in self.__slots__:
+            col = getattr(self, name)
+            picked = [col[r] for r in rows]
+            setattr(out, name, array(col.typecode, picked) if isinstance(col, array) else picked)
+        return out
+
+    def __len__(self) -> int:
+        return len(self.uris)
+
+    def __getitem__(self, row: int) -> PostView:
+        if row < 0:
+            row += len(self.uris)
+        if not 0 <= row < len(self.uris):
+            raise IndexError(row)
+        return PostView(self, row)
+
+    def __iter__(self) -> Iterator[PostView]:
+        return (PostView(self, r) for r in range(len(self.uris)))
+
+
+class ChunkView:
+    """One row of a ``ChunkBatch`` with the attribute names of ``Chunk``."""
+
+    __slots__ = ("batch", "pos")
+
+    # fresh chunks carry no attestations or stored vector yet
+    echoes = 0
+    embedding = None
+
+    def __init__(self, batch: "ChunkBatch", pos: int):
+        self.batch = batch
+        self.pos = pos
+
+    @property
+    def text(self) -> str:
+        return self.batch.texts[self.pos]
+
+    @property
+    def post(self) -> PostView:
+        return PostView(self.batch.posts, self.batch.rows[self.pos])
+
+    @property
+    def index(self) -> int:
+        return self.batch.index[self.pos]
+
+    @property
+    def total(self) -> int:
+        return self.batch.total[self.pos]
+
+
+ChunkLike = Union[Chunk, ChunkView]
+
+
+class ChunkBatch:
+    """Chunks of a ``PostBatch``: chunk text plus the row, index and total of each, column-wise.
+
+    ``columns``/``metadatas`` produce the store metadata (see
+    ``store.chunk_metadata``) straight from the post columns.
+    """
+
+    __slots__ = ("posts", "rows", "index", "total", "texts")
+
+    def __init__(self, posts: PostBatch):
+        self.posts = posts
+        self.rows = array("q")
+        self.index = array("q")
+        self.total = array("q")
+        self.texts: List[str] = []
+
+    def append(self, row: int, text: str, index: int, total: int) -> None:
+        self.rows.append(row)
+        self.texts.append(text)
+        self.index.append(index)
+        self.total.append(total)
+
+    @classmethod
+    def from_posts(cls, posts: PostBatch, chunk_size: int = 400, overlap: int = 40) -> "ChunkBatch":
+        """Clean and split every post's text; posts left empty get no chunks."""
+        batch = cls(posts)
+        for row, raw in enumerate(posts.texts):
+            text = clean_text(raw)
+            if not text:
+                continue
+            parts = chunk_text(text, chunk_size, overlap)
+            for i, t in enumerate(parts):
+                batch.append(row, t, i, len(parts))
+        return batch
+
+    @classmethod
+    def from_chunks(cls, chunks: Union["ChunkBatch", Iterable[ChunkLike]]) -> "ChunkBatch":
+        if isinstance(chunks, ChunkBatch):
+            return chunks
+        posts = PostBatch()
+        batch = cls(posts)
+        # a PostView is rebuilt on every ``ChunkView.post`` access, so views are keyed by
+        # their source row; ``Post``s by identity, held in ``seen`` so an id is never reused
+        rows: Dict[Tuple[int, int], int] = {}
+        seen: List[PostLike] = []
+        for ch in chunks:
+            p = ch.post
+            key = (id(p.batch), p.row) if isinstance(p, PostView) else (id(p), -1)
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = posts.add(p).row
+                seen.append(p)
+            batch.append(row, ch.text, ch.index, ch.total)
+        return batch
+
+    def take(self, positions: Sequence[int]) -> "ChunkBatch":
+        """A new batch of the chunks at ``positions``, sharing this batch's posts."""
+        out = ChunkBatch(self.posts)
+        out.rows = array("q", [self.rows[i] for i in positions])
+        out.index = array("q", [self.index[i] for i in positions])
+        out.total = array("q", [self.total[i] for i in positions])
+        out.texts = [self.texts[i] for i in positions]
+        return out
+
+    def uris(self) -> List[str]:
+        uris = self.posts.uris
+        return [uris[r] for r in self.rows]
+
+    def cids(self) -> List[str]:
+        cids = self.posts.cids
+        return [cids[r] for r in self.rows]
+
+    def authors(self) -> List[str]:
+        authors = self.posts.authors
+        return [authors[r] for r in self.rows]
+
+    def created_ts(self) -> List[int]:
+        ts = self.posts.created_ts
+        return [ts[r] for r in self.rows]
+
+    def ids(self) -> List[str]:
+        return [chunk_id(u, i) for u, i in zip(self.uris(), self.index)]
+
+    def columns(self) -> Dict[str, list]:
+        """Store metadata as one list per field, in ``store.chunk_metadata`` order."""
+        p, rows = self.posts, self.rows
+        ts = self.created_ts()
+        return {
+            "uri": self.uris(),
+            "cid": self.cids(),
+            "author": self.authors(),
+            "author_display_name": [p.display_names[r] for r in rows],
+            "created_at": [epoch_to_iso(t) for t in ts],
+            "created_at_ts": ts,
+            "reply_count": [p.reply_counts[r] for r in rows],
+            "repost_count": [p.repost_counts[r] for r in rows],
+            "like_count": [p.like_counts[r] for r in rows],
+            "chunk_index": self.index.tolist(),
+            "chunk_total": self.total.tolist(),
+        }
+
+    def metadatas(self) -> List[Dict[str, Any]]:
+        """Per-chunk metadata dicts, for backends whose API takes one mapping per row."""
+        cols = self.columns()
+        keys = list(cols)
+        return [dict(zip(keys, values)) for values in zip(*cols.values())]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __getitem__(self, pos: int) -> ChunkView:
+        if pos < 0:
+            pos += len(self.texts)
+        if not 0 <= pos < len(self.texts):
+            raise IndexError(pos)
+        return ChunkView(self, pos)
+
+    def __iter__(self) -> Iterator[ChunkView]:
+        return (ChunkView(self, i) for i in range(len(self.texts)))
 
 
 def clean_text(text: str) -> str:
@@ -84,9 +428,50 @@ def extract_keywords(query: str, max_terms: int = 6) -> List[str]:
     return uniq[:max_terms]
 
 
+class KeywordMatcher:
+    """Matches ``extract_keywords`` terms with one compiled regex instead of a Python loop.
+
+    Same semantics as ``any(t.lstrip('#@') in text.lower() for t in terms)``.
+    ``may_match_raw`` screens an undecoded JSON frame: when every term is ASCII a
+    miss on the raw frame guarantees a miss on its text, so the frame can be
+    dropped before parsing.
+    """
+
+    __slots__ = ("words", "pattern", "raw_words")
+
+    def __init__(self, terms: Iterable[str]):
+        words = {t.lstrip("#@").lower() for t in terms}
+        self.words = sorted((w for w in words if w), key=len, reverse=True)
+        self.pattern = re.compile("|".join(map(re.escape, self.words))) if self.words else None
+        self.raw_words = None
+        if self.words and all(w.isascii() for w in self.words):
+            self.raw_words = [w.encode() for w in self.words]
+
+    def __bool__(self) -> bool:
+        return self.pattern is not None
+
+    def matches(self, text: str) -> bool:
+        return self.pattern is None or self.pattern.search(text.lower()) is not None
+
+    def may_match_raw(self, raw) -> bool:
+        if self.raw_words is None:
+            return True
+        # bytes.lower() plus memmem-backed `in` beats an IGNORECASE regex several times over
+        lowered = raw.lower()
+        if isinstance(lowered, str):
+            return any(w in lowered for w in self.words)
+        return any(w in lowered for w in self.raw_words)
+
+
+# between the documents of a prompt's context block
+DOC_SEPARATOR = "\n\n---\n\n"
+
+
 def format_doc_for_prompt(i: int, chunk: Chunk) -> str:
     p = chunk.post
     meta = f"Post #{i} by @{p.author} ({p.author_display_name}) on {p.created_at.isoformat()}\n\"{chunk.text}\"\n"
+    if chunk.echoes:
+        meta += f"(near-identical text also posted {chunk.echoes} more times)\n"
     return meta
 
 
@@ -0,0 +1,219 @@
+"""Worker processes that decode, clean and keyword-filter Jetstream frames off the event loop."""
+
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from .config import IngestCfg
+from .filters import RecordFilter
+from .firehose import FrameFilter, extract_posts, post_deletes, post_uri
+from .utils import KeywordMatcher
+
+
+class DecodedBatch(NamedTuple):
+    """Posts that survived a run of frames, column-wise so the result pickles small."""
+
+    repos: List[str]
+    rkeys: List[str]
+    cids: List[str]
+    texts: List[str]
+    created_ts: List[int]
+    time_us: List[int]
+    # newest ``time_us`` of any decoded frame in the run, whether or not it kept a post
+    last_time_us: int
+    frames: int
+    rejected: int
+    invalid: int
+    bytes_in: int
+    bytes_out: int
+    # records dropped per filter stage
+    filtered: Dict[str, int]
+    # (post URI, time_us) of each post delete op, when the filter lets them through
+    deleted: List[Tuple[str, int]]
+
+    def rows(self) -> Iterator[Tuple[str, str, str, str, int, int]]:
+        return zip(self.repos, self.rkeys, self.cids, self.texts, self.created_ts, self.time_us)
+
+
+def decode_frames(raws: Sequence[bytes], frames: FrameFilter) -> DecodedBatch:
+    repos: List[str] = []
+    rkeys: List[str] = []
+    cids: List[str] = []
+    texts: List[str] = []
+    created: List[int] = []
+    times: List[int] = []
+    deleted: List[Tuple[str, int]] = []
+    last = 0
+    start = (frames.frames, frames.rejected, frames.invalid, frames.bytes_in, frames.bytes_out)
+    drops = dict(frames.records.drops) if frames.records is not None else {}
+    for raw in raws:
+        msg = frames.decode(raw)
+        if msg is None:
+            continue
+        time_us = msg.get("time_us") or 0
+        last = max(last, time_us)
+        repo, found = extract_posts(msg, frames.matcher, frames.records)
+        for rkey, cid, text, created_ts in found:
+            repos.append(repo or "")
+            rkeys.append(rkey)
+            cids.append(cid)
+            texts.append(text)
+            created.append(created_ts)
+            times.append(time_us)
+        if frames.deletes:
+            repo, gone = post_deletes(msg)
+            deleted.extend((post_uri(repo, rkey), time_us) for rkey in gone)
+    return DecodedBatch(
+        repos, rkeys, cids, texts, created, times, last,
+        frames.frames - start[0], frames.rejected - start[1], frames.invalid - start[2],
+        frames.bytes_in - start[3], frames.bytes_out - start[4],
+        {k: n - drops.get(k, 0) for k, n in frames.records.drops.items()} if frames.records is not None else {},
+        deleted,
+    )
+
+
+@lru_cache(maxsize=32)
+def _worker_filter(terms: Tuple[str, ...], zstd_dict: Optional[str], records: Optional[Tuple[Any, ...]], deletes: bool) -> FrameFilter:
+    record_filter = RecordFilter(*records, metrics=False) if records is not None else None
+    return FrameFilter(KeywordMatcher(terms), metrics=False, zstd_dict=zstd_dict, records=record_filter, deletes=deletes)
+
+
+def _decode_in_worker(
+    raws: List[bytes], terms: Tuple[str, ...], zstd_dict: Optional[str], records: Optional[Tuple[Any, ...]], deletes: bool
+) -> DecodedBatch:
+    return decode_frames(raws, _worker_filter(terms, zstd_dict, records, deletes))
+
+
+class DecodePool:
+    """``workers`` processes, each decoding whole batches of up to ``batch_frames`` raw frames."""
+
+    def __init__(self, workers: int, batch_frames: int = 256):
+        self.workers = workers
+        self.batch_frames = max(1, batch_frames)
+        # spawn, not fork: the parent holds threads (SQLite, chroma, the event loop) that must not be forked
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.batches = 0
+        self.frames = 0
+
+    def submit(
+        self,
+        raws: List[bytes],
+        terms: Tuple[str, ...],
+        zstd_dict: Optional[str] = None,
+        records: Optional[Tuple[Any, ...]] = None,
+        deletes: bool = False,
+    ) -> "asyncio.Future[DecodedBatch]":
+        self.batches += 1
+        self.frames += len(raws)
+        return asyncio.get_running_loop().run_in_executor(self.executor, _decode_in_worker, raws, terms, zstd_dict, records, deletes)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "batch_frames": self.batch_frames, "batches": self.batches, "frames": self.frames}
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def worker_count(configured: int) -> int:
+    if configured < 0:
+        return max(1, (os.cpu_count() or 1) - 1)
+    return configured
+
+
+_shared: Optional[DecodePool] = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool(cfg: IngestCfg) -> Optional[DecodePool]:
+    """The process-wide decode pool, started on first use; None when ``INGEST_WORKERS`` is 0."""
+    global _shared
+    workers = worker_count(cfg.workers)
+    if workers <= 0:
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = DecodePool(workers, cfg.worker_batch)
+            logger.info(f"frame decode pool: {workers} worker processes, {cfg.worker_batch} frames per batch")
+        return _shared
+
+
+def close_shared_pool() -> None:
+    global _shared
+    with _shared_lock:
+        if _shared is not None:
+            _shared.close()
+            _shared = None
+
+
+class FrameDecoder:
+    """Turns raw frames into ``DecodedBatch``es, in arrival order.
+
+    Without a pool each frame is decoded inline through ``frames``. With one,
+    frames are buffered into batches for the workers and results are handed
+    back in submission order; at most two batches per worker are in flight,
+    so a saturated pool pushes back on the socket reader. A batch whose
+    worker fails is decoded again inline, so the cursor never moves past
+    frames that were not looked at.
+    """
+
+    def __init__(self, frames: FrameFilter, pool: Optional[DecodePool] = None, linger: float = 0.1):
+        self.frames = frames
+        self.pool = pool
+        self.linger = linger
+        self.terms = tuple(frames.matcher.words)
+        self.records = frames.records.spec() if frames.records is not None else None
+        self._buf: List[bytes] = []
+        # (future, the raw frames it decodes) so a failed batch can be retried
+        self._inflight: Deque[Tuple["asyncio.Future[DecodedBatch]", List[bytes]]] = deque()
+
+    def timeout(self, idle: Optional[float]) -> Optional[float]:
+        """How long the reader may wait for a frame before buffered frames should be flushed."""
+        return self.linger if self._buf or self._inflight else idle
+
+    async def push(self, raw: bytes) -> List[DecodedBatch]:
+        if self.pool is None:
+            decoded = decode_frames((raw,), self.frames)
+            return [decoded] if decoded.last_time_us or decoded.texts or decoded.deleted else []
+        self._buf.append(raw)
+        if len(self._buf) >= self.pool.batch_frames:
+            self._submit()
+        return await self._collect(block=len(self._inflight) >= 2 * self.pool.workers)
+
+    async def flush(self, wait: bool = False) -> List[DecodedBatch]:
+        """Send buffered frames off and return finished batches; ``wait`` waits for all of them."""
+        if self.pool is None:
+            return []
+        self._submit()
+        return await self._collect(drain=wait)
+
+    def _submit(self) -> None:
+        if self._buf:
+            self._inflight.append((self.pool.submit(self._buf, self.terms, self.frames.zstd_dict, self.records, self.frames.deletes), self._buf))
+            self._buf = []
+
+    async def _collect(self, block: bool = False, drain: bool = False) -> List[DecodedBatch]:
+        out: List[DecodedBatch] = []
+        while self._inflight and (drain or block or self._inflight[0][0].done()):
+            fut, raws = self._inflight.popleft()
+            block = False
+            try:
+                decoded = await fut
+            except Exception as e:
+                logger.warning(f"frame decode worker failed: {e}; decoding its {len(raws)} frames inline")
+                # counted straight into ``frames``, so nothing to absorb
+                out.append(decode_frames(raws, self.frames))
+                continue
+            self.frames.absorb(decoded.frames, decoded.rejected, decoded.invalid, decoded.bytes_in, decoded.bytes_out)
+            if self.frames.records is not None:
+                self.frames.records.absorb(decoded.filtered)
+            out.append(decoded)
+        return out
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+
+from simple_rag.utils import Chunk, ChunkBatch, Post, PostBatch
+
+
+def _posts(n: int) -> PostBatch:
+    batch = PostBatch()
+    for i in range(n):
+        batch.append(f"at://did:plc:{i}/app.bsky.feed.post/{i}", f"cid{i}", f"author{i}", f"Author {i}", f"post number {i}", 1_700_000_000 + i)
+    return batch
+
+
+def test_from_chunks_keeps_each_chunk_on_its_own_post():
+    chunks = ChunkBatch.from_posts(_posts(5), chunk_size=400, overlap=0)
+    rebuilt = ChunkBatch.from_chunks(list(chunks))
+    assert rebuilt.uris() == chunks.uris()
+    assert rebuilt.cids() == chunks.cids()
+    assert len(rebuilt.posts) == 5
+
+
+def test_from_chunks_shares_one_row_per_post():
+    post = Post("at://did:plc:a/app.bsky.feed.post/1", "cid", "a", "A", "text", datetime(2024, 1, 1, tzinfo=timezone.utc))
+    rebuilt = ChunkBatch.from_chunks([Chunk("one", post, 0, 2), Chunk("two", post, 1, 2)])
+    assert len(rebuilt.posts) == 1
+    assert rebuilt.uris() == [post.uri, post.uri]